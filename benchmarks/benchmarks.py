@@ -0,0 +1,263 @@
+"""
+Benchmarks de les etapes principals, en format asv (https://asv.readthedocs.io):
+mètodes `time_*` (temps) i `peakmem_*` (memòria màxima), parametritzats per mida.
+
+    asv run                      # amb asv (vegeu asv.conf.json)
+    python -m benchmarks.run     # sense asv: temps i pic de memòria de cada etapa
+
+Els llibres Excel es generen un sol cop per classe (`setup_cache`) amb benchmarks.synthetic.
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import data_cache  # noqa: E402
+from datasets import DatasetCatalogue  # noqa: E402
+from benchmarks import synthetic  # noqa: E402
+from differential import differential_expression  # noqa: E402
+from expression import build_expression_matrix, compute_condition_stats  # noqa: E402
+from export import iter_chunks, write_export  # noqa: E402
+from filtering import FilterCache, FilterSpec, display_columns, evaluate, select  # noqa: E402
+from gene_index import build_gene_index, table_aliases  # noqa: E402
+from loaders import load_merged_workbook, merge_on_gene, read_merged_workbook  # noqa: E402
+from schema import apply_schema  # noqa: E402
+from styling import highlight_all_datasets, highlight_matrix  # noqa: E402
+from tag_matrix import build_tag_matrix  # noqa: E402
+
+# Nombre de gens de cada mida provada
+GENE_COUNTS = [2_000, 20_000]
+
+
+def _write_gene_workbooks(directory: str) -> dict:
+    return {
+        n_genes: synthetic.write_workbook(
+            synthetic.gene_sheets(n_genes, n_sheets=5, duplicates=3),
+            os.path.join(directory, f"genes_{n_genes}.xlsx"),
+        )
+        for n_genes in GENE_COUNTS
+    }
+
+
+def _load(path: str, cache_dir: str):
+    # La taula unificada des de la còpia Arrow (es construeix la primera vegada)
+    data_cache.CACHE_DIR = cache_dir
+    return load_merged_workbook(path)
+
+
+def _spec() -> FilterSpec:
+    # Filtre típic: tres mètriques de dos datasets i una etiqueta
+    return FilterSpec(
+        p_value=0.05,
+        fdr=0.05,
+        logfc=1.5,
+        metrics={"iAs": ["iAs_pvalue", "iAs_logFC"], "NewiNs": ["NewiNs_FDR"]},
+        tags={"iAs": ("iAs_genes_tag", ["PREVALENT_DEG", "POSSIBLE_DEG"])},
+    )
+
+
+class MergeWorkbook:
+    """
+    Lectura i fusió del llibre de gens (load_and_merge_data): en fred des de l'Excel,
+    en calent des de la còpia Arrow i per datasets (DatasetCatalogue, només metadades
+    i un sol full carregat).
+    """
+    params = GENE_COUNTS
+    param_names = ["genes"]
+    timeout = 600
+
+    def setup_cache(self):
+        directory = tempfile.mkdtemp(prefix="geneanalysis-bench-")
+        return {"paths": _write_gene_workbooks(directory), "cache_dir": os.path.join(directory, "cache")}
+
+    def setup(self, cache, n_genes):
+        self.path = cache["paths"][n_genes]
+        _load(self.path, cache["cache_dir"])
+        DatasetCatalogue(self.path).frame(["iAs"])
+
+    def time_read_merged_workbook(self, cache, n_genes):
+        read_merged_workbook(self.path)
+
+    def time_load_cached(self, cache, n_genes):
+        _load(self.path, cache["cache_dir"])
+
+    def time_open_catalogue(self, cache, n_genes):
+        DatasetCatalogue(self.path)
+
+    def time_catalogue_one_dataset(self, cache, n_genes):
+        DatasetCatalogue(self.path).frame(["iAs"])
+
+    peakmem_read_merged_workbook = time_read_merged_workbook
+    peakmem_load_cached = time_load_cached
+    peakmem_catalogue_one_dataset = time_catalogue_one_dataset
+
+
+class Filter:
+    """
+    Filtratge de GEN Explorer: avaluació de les condicions, memòria cau, ordenació,
+    selecció d'una pàgina i exportació del resultat.
+    """
+    params = GENE_COUNTS
+    param_names = ["genes"]
+    timeout = 600
+
+    setup_cache = MergeWorkbook.setup_cache
+
+    def setup(self, cache, n_genes):
+        self.df = _load(cache["paths"][n_genes], cache["cache_dir"])
+        self.conditions = _spec().conditions()
+        self.rows = evaluate(self.df, self.conditions)
+        self.all_rows = np.arange(len(self.df))
+        self.cols = display_columns(self.df.columns, ["iAs", "NewiNs", "ProteiNs"])
+        self.filter_cache = FilterCache()
+        self.filter_cache.rows(self.df, self.conditions, version="bench")
+        self.export_path = os.path.join(cache["cache_dir"], f"export_{n_genes}.csv")
+        # Llista gran de gens (la meitat de la taula) amb un altre filtre
+        gene_list = self.df["Gene"].sample(n_genes // 2, random_state=0).tolist()
+        self.list_conditions = FilterSpec(genes=gene_list, metrics={"iAs": ["iAs_pvalue"]}).conditions()
+        self.gene_index = build_gene_index(self.df["Gene"])
+        self.tag_matrix = build_tag_matrix({col: self.df[col] for col in self.df.columns if col.endswith("_genes_tag")})
+
+    def time_evaluate(self, cache, n_genes):
+        evaluate(self.df, self.conditions)
+
+    def time_evaluate_gene_list(self, cache, n_genes):
+        evaluate(self.df, self.list_conditions)
+
+    def time_evaluate_gene_list_indexed(self, cache, n_genes):
+        evaluate(self.df, self.list_conditions, gene_index=self.gene_index)
+
+    def time_evaluate_tag_matrix(self, cache, n_genes):
+        evaluate(self.df, self.conditions, tag_matrix=self.tag_matrix)
+
+    def time_tag_query_count(self, cache, n_genes):
+        # PREVALENT_DEG a iAs i NewiNs però no a AllOrgs, sobre totes les files
+        self.tag_matrix.count(self.tag_matrix.query(
+            {"iAs": "PREVALENT_DEG", "NewiNs": "PREVALENT_DEG"}, {"AllOrgs": "PREVALENT_DEG"}
+        ))
+
+    def time_tag_intersections(self, cache, n_genes):
+        self.tag_matrix.intersections("PREVALENT_DEG")
+
+    def time_filter_cache_hit(self, cache, n_genes):
+        self.filter_cache.rows(self.df, self.conditions, version="bench")
+
+    def time_sorted_rows(self, cache, n_genes):
+        FilterCache().sorted_rows(self.df, self.conditions, version="bench", sort_by="iAs_logFC", ascending=False)
+
+    def time_select_page(self, cache, n_genes):
+        select(self.df, self.all_rows[:200], self.cols)
+
+    def time_export_csv(self, cache, n_genes):
+        write_export(iter_chunks(self.df, self.all_rows, self.cols), self.export_path, "csv")
+
+    peakmem_evaluate = time_evaluate
+    peakmem_export_csv = time_export_csv
+
+
+class ExpressionSheet:
+    """
+    Fulls de comptatges (GEN Boxplots): lectura del full sencer (loaders.read_full_sheet),
+    conversió a matriu i consulta gen a gen.
+    """
+    params = GENE_COUNTS
+    param_names = ["genes"]
+    timeout = 600
+
+    def setup_cache(self):
+        directory = tempfile.mkdtemp(prefix="geneanalysis-bench-")
+        return {
+            n_genes: synthetic.write_workbook(
+                synthetic.counts_sheets(n_genes, n_sheets=1, n_samples=24),
+                os.path.join(directory, f"counts_{n_genes}.xlsx"),
+            )
+            for n_genes in GENE_COUNTS
+        }
+
+    def setup(self, cache, n_genes):
+        self.path = cache[n_genes]
+        self.sheet = pd.read_excel(self.path, sheet_name=0, decimal=",")
+        self.sheet["Gene"] = self.sheet["Gene"].astype(str)
+        self.matrix = build_expression_matrix(self.sheet)
+        self.genes = self.matrix.genes[:: max(1, len(self.matrix.genes) // 50)][:50]
+
+    def time_read_sheet(self, cache, n_genes):
+        pd.read_excel(self.path, sheet_name=0, decimal=",")
+
+    def time_build_expression_matrix(self, cache, n_genes):
+        build_expression_matrix(self.sheet)
+
+    def time_compute_condition_stats(self, cache, n_genes):
+        compute_condition_stats(self.matrix.values, self.matrix.conditions)
+
+    def time_top_genes(self, cache, n_genes):
+        self.matrix.top_genes(50)
+
+    def time_differential_expression(self, cache, n_genes):
+        differential_expression(self.matrix)
+
+    def time_differential_expression_subset(self, cache, n_genes):
+        differential_expression(self.matrix, samples=self.matrix.samples[::2])
+
+    def time_sample_means_50_genes(self, cache, n_genes):
+        for gene in self.genes:
+            self.matrix.sample_means(gene)
+
+    def time_scan_sheet_50_genes(self, cache, n_genes):
+        # Consulta gen a gen sobre el DataFrame (com feia GEN Boxplots abans de la matriu)
+        for gene in self.genes:
+            self.sheet[self.sheet["Gene"] == gene]
+
+    peakmem_read_sheet = time_read_sheet
+    peakmem_build_expression_matrix = time_build_expression_matrix
+
+
+class GeneSearch:
+    """
+    Índex de cerca de gens de la barra lateral: construcció (un cop per versió de les dades),
+    cerca mentre s'escriu i resolució d'una llista enganxada.
+    """
+    params = GENE_COUNTS
+    param_names = ["genes"]
+
+    def setup(self, n_genes):
+        self.df = apply_schema(merge_on_gene(synthetic.gene_sheets(n_genes, n_sheets=5)))
+        self.index = build_gene_index(self.df["Gene"], table_aliases(self.df))
+        self.pasted = self.df["Gene"].sample(min(n_genes, 1000), random_state=0).str.lower().tolist()
+
+    def time_build_index(self, n_genes):
+        build_gene_index(self.df["Gene"], table_aliases(self.df))
+
+    def time_search_prefix(self, n_genes):
+        self.index.search("GENE00")
+
+    def time_search_substring(self, n_genes):
+        self.index.search("123")
+
+    def time_resolve_pasted_list(self, n_genes):
+        self.index.resolve(self.pasted)
+
+
+class Styling:
+    """
+    Càlcul dels estils de la taula principal i de la matriu de colors per a una pàgina.
+    """
+    params = [200, 1_000, 10_000]
+    param_names = ["rows"]
+
+    def setup(self, n_rows):
+        sheets = synthetic.gene_sheets(max(n_rows, 1000), n_sheets=5, coverage=1.0)
+        merged = apply_schema(merge_on_gene(sheets))
+        self.page = merged.iloc[:n_rows][display_columns(merged.columns, ["iAs", "NewiNs", "AllOrgs", "ProteiNs"])]
+        tag_cols = [c for c in self.page.columns if c.endswith(("_genes_tag", "_expr_pval_Patient_Ctrl"))]
+        self.matrix = self.page[["Gene"] + tag_cols].rename(columns=lambda c: c.split("_")[0])
+
+    def time_highlight_all_datasets(self, n_rows):
+        highlight_all_datasets(self.page)
+
+    def time_highlight_matrix(self, n_rows):
+        highlight_matrix(self.matrix)
@@ -0,0 +1,105 @@
+"""
+Executa els benchmarks de benchmarks/benchmarks.py sense asv i mostra, per a cada etapa
+i mida, el temps (mínim i mediana de diverses repeticions) i el pic de memòria
+(assignacions de Python i numpy mesurades amb tracemalloc).
+
+    python -m benchmarks.run [--filter Filter] [--repeat 5] [--quick] [--json resultats.json]
+"""
+import argparse
+import inspect
+import itertools
+import json
+import re
+import statistics
+import time
+import tracemalloc
+
+from benchmarks import benchmarks as suite
+
+
+def benchmark_classes() -> list:
+    return [
+        cls for _, cls in inspect.getmembers(suite, inspect.isclass)
+        if cls.__module__ == suite.__name__ and any(name.startswith("time_") for name in dir(cls))
+    ]
+
+
+def param_combinations(cls, quick: bool = False) -> list:
+    """
+    Combinacions de paràmetres d'una classe (asv: `params` és una llista o una llista de llistes).
+    Amb `quick`, només la primera de cada paràmetre.
+    """
+    params = getattr(cls, "params", None)
+    if params is None:
+        return [()]
+    if not isinstance(params[0], (list, tuple)):
+        params = [params]
+    if quick:
+        params = [values[:1] for values in params]
+    return list(itertools.product(*params))
+
+
+def measure(func, args, repeat: int) -> dict:
+    """
+    Temps de `repeat` execucions i pic de memòria d'una execució addicional.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"min_s": min(times), "median_s": statistics.median(times), "peak_mb": peak / 2**20}
+
+
+def run(pattern: str = "", repeat: int = 3, quick: bool = False) -> list:
+    results = []
+    for cls in benchmark_classes():
+        methods = sorted(name for name in dir(cls) if name.startswith("time_"))
+        methods = [name for name in methods if re.search(pattern, f"{cls.__name__}.{name}")]
+        if not methods:
+            continue
+
+        cache = [cls().setup_cache()] if hasattr(cls, "setup_cache") else []
+        for params in param_combinations(cls, quick):
+            instance = cls()
+            if hasattr(instance, "setup"):
+                instance.setup(*cache, *params)
+            for name in methods:
+                result = measure(getattr(instance, name), (*cache, *params), repeat)
+                result.update(benchmark=f"{cls.__name__}.{name[len('time_'):]}", params=list(params))
+                results.append(result)
+                print(
+                    f"{result['benchmark']:<45} {str(list(params)):<10} "
+                    f"{result['min_s'] * 1000:10.2f} ms {result['median_s'] * 1000:10.2f} ms "
+                    f"{result['peak_mb']:10.1f} MB",
+                    flush=True,
+                )
+            if hasattr(instance, "teardown"):
+                instance.teardown(*cache, *params)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmarks sense asv.")
+    parser.add_argument("--filter", default="", help="Expressió regular sobre 'Classe.etapa'")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticions per mesurar el temps")
+    parser.add_argument("--quick", action="store_true", help="Només la mida més petita")
+    parser.add_argument("--json", help="Desa els resultats en aquest fitxer JSON")
+    args = parser.parse_args(argv)
+
+    print(f"{'etapa':<45} {'mida':<10} {'mínim':>13} {'mediana':>13} {'pic mem.':>13}")
+    results = run(args.filter, args.repeat, args.quick)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
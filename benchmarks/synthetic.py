@@ -0,0 +1,133 @@
+"""
+Generador de llibres Excel sintètics amb les mateixes convencions que les dades reals:
+
+- Llibre de gens (GEN Explorer): un full per dataset amb 'Gene', pvalue, FDR, logFC,
+  logFCs (text amb coma decimal), un identificador (ensembl_id) i '<full>_genes_tag';
+  el full ProteiNs té 'expr_pval_Patient_Ctrl' (up/down) en lloc de genes_tag.
+- Llibres de comptatges (GEN Boxplots): un full per dataset amb 'Gene' i una columna per mostra
+  acabada en '_C' (control) o '_P' (pacient); el full AllOrgs va al llibre d'organoides.
+
+    python -m benchmarks.synthetic --out data/ --genes 20000 --sheets 6 --samples 24
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DEG_TAGS = ["NOT_DEG", "POSSIBLE_DEG", "PREVALENT_DEG"]
+PROTEIN_TAGS = ["up", "down", None]
+
+# Noms de fulls semblants als reals (si se'n demanen més, s'hi afegeixen 'Sheet<n>')
+SHEET_NAMES = ["iAs", "NewiNs", "AllOrgs", "iPSCs", "iNs", "Fibros"]
+
+
+def sheet_names(n_sheets: int) -> list:
+    """
+    Retorna `n_sheets` noms de fulls de dades (sense comptar ProteiNs).
+    """
+    extra = [f"Sheet{i}" for i in range(max(0, n_sheets - len(SHEET_NAMES)))]
+    return (SHEET_NAMES + extra)[:n_sheets]
+
+
+def gene_names(n_genes: int) -> np.ndarray:
+    return np.array([f"GENE{i:06d}" for i in range(n_genes)], dtype=object)
+
+
+def gene_sheets(n_genes: int, n_sheets: int = 5, coverage: float = 0.7, duplicates: int = 0,
+                proteins: bool = True, seed: int = 0) -> dict:
+    """
+    Retorna {nom_full: DataFrame} per al llibre de gens.
+    Cada full conté una fracció `coverage` dels gens (en ordre aleatori), de manera que la
+    unió per 'Gene' tingui forats com a les dades reals. `duplicates` repeteix les primeres
+    files de cada full per provar la política de gens repetits.
+    """
+    rng = np.random.default_rng(seed)
+    genes = gene_names(n_genes)
+    n = max(1, int(n_genes * coverage))
+    sheets = {}
+    for name in sheet_names(n_sheets):
+        g = rng.choice(genes, n, replace=False)
+        df = pd.DataFrame({
+            "Gene": g,
+            "pvalue": rng.random(n),
+            "FDR": rng.random(n),
+            "logFC": rng.normal(0, 2, n),
+            # Com als Excel reals, alguns valors arriben com a text amb coma decimal
+            "logFCs": [f"{v:.3f}".replace(".", ",") for v in rng.normal(0, 2, n)],
+            "ensembl_id": [f"ENSG{x[4:]}" for x in g],
+            "genes_tag": rng.choice(DEG_TAGS, n, p=[0.7, 0.2, 0.1]),
+        })
+        if duplicates:
+            df = pd.concat([df, df.iloc[:duplicates]], ignore_index=True)
+        sheets[name] = df
+
+    if proteins:
+        n_prot = max(1, n // 2)
+        g = rng.choice(genes, n_prot, replace=False)
+        sheets["ProteiNs"] = pd.DataFrame({
+            "Gene": g,
+            "pvalue": rng.random(n_prot),
+            "logFC": rng.normal(0, 2, n_prot),
+            "expr_pval_Patient_Ctrl": rng.choice(np.array(PROTEIN_TAGS, dtype=object), n_prot),
+        })
+    return sheets
+
+
+def counts_sheets(n_genes: int, n_sheets: int = 4, n_samples: int = 12, coverage: float = 0.8,
+                  seed: int = 0) -> dict:
+    """
+    Retorna {nom_full: DataFrame} per al llibre de comptatges normalitzats:
+    'Gene' i `n_samples` mostres ('S<i>_C' i 'S<i>_P' alternades).
+    """
+    rng = np.random.default_rng(seed)
+    genes = gene_names(n_genes)
+    n = max(1, int(n_genes * coverage))
+    sheets = {}
+    for name in sheet_names(n_sheets):
+        g = rng.choice(genes, n, replace=False)
+        samples = {f"S{i}_{'C' if i % 2 else 'P'}": rng.gamma(2, 50, n) for i in range(n_samples)}
+        sheets[name] = pd.DataFrame({"Gene": g, **samples})
+    return sheets
+
+
+def write_workbook(sheets: dict, path: str) -> str:
+    """
+    Escriu {nom_full: DataFrame} en un Excel i en retorna la ruta.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synthetic", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", default="data", help="Directori de sortida")
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--sheets", type=int, default=5, help="Fulls de dades (a més de ProteiNs)")
+    parser.add_argument("--samples", type=int, default=12, help="Mostres per full de comptatges")
+    parser.add_argument("--duplicates", type=int, default=0, help="Files repetides per full")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    counts = counts_sheets(args.genes, args.sheets, args.samples, seed=args.seed)
+    orgs = {name: df for name, df in counts.items() if name == "AllOrgs"} or dict([list(counts.items())[-1]])
+    paths = [
+        write_workbook(
+            gene_sheets(args.genes, args.sheets, duplicates=args.duplicates, seed=args.seed),
+            os.path.join(args.out, "Gene_data_20250312.xlsx"),
+        ),
+        write_workbook(
+            {name: df for name, df in counts.items() if name not in orgs} or counts,
+            os.path.join(args.out, "data_normalized_counts.xlsx"),
+        ),
+        write_workbook(orgs, os.path.join(args.out, "data_norm_counts_orgs.xlsx")),
+    ]
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
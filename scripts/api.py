@@ -0,0 +1,412 @@
+"""
+API HTTP local sobre les mateixes dades que l'aplicació, per a notebooks i pipelines.
+
+    python -m scripts.api [--host 127.0.0.1] [--port 8502] [--workers 8]
+
+Servidor asíncron (Tornado) amb una sola còpia de les dades en memòria per a totes les
+peticions: fa servir les mateixes càrregues que l'aplicació (vegeu warmup.py) i les mateixes
+còpies en disc (blocs Arrow, matrius .npy mapades en memòria), que es carreguen en segon pla
+en arrencar. Les consultes s'executen en fils, fora del bucle d'esdeveniments, i els resultats
+grans s'envien a blocs a mesura que es generen.
+
+    GET  /ready                  estat de la càrrega (warmup.Warmup.progress)
+    POST /filter                 filtres de GEN Explorer: una especificació com les de scripts.batch
+                                 (?sort_by=columna&ascending=0&offset=0&limit=1000)
+    GET  /expression             expressió per mostra dels gens indicats (?genes=A,B&datasets=iNs,iAs),
+                                 o estadístics per condició amb ?summary=1; també POST amb
+                                 {"genes": [...], "datasets": [...], "summary": false}
+    POST /tags                   gens amb unes etiquetes a uns datasets i no a uns altres:
+                                 {"include": {"iAs": ["PREVALENT_DEG"]}, "exclude": {...}, "datasets": [...]}
+    GET  /tags/counts            recompte de cada etiqueta per dataset (?datasets=...)
+    GET  /tags/intersections     interseccions d'una etiqueta entre datasets (?tag=PREVALENT_DEG&datasets=...)
+
+Les taules es retornen en JSON Lines (una fila per línia) o, amb ?format=arrow (o la capçalera
+`Accept: application/vnd.apache.arrow.stream`), en format Arrow IPC stream:
+
+    pyarrow.ipc.open_stream(urllib.request.urlopen(request)).read_pandas()
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tornado.web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+
+if __package__:
+    # Executat com a `python -m scripts.api`: els mòduls del projecte s'importen pel nom
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch import check_datasets, check_tags, filter_spec_from_dict, name_list, spec_datasets
+from charts import expression_long_table
+from data_cache import sheet_versions
+from export import CHUNK_ROWS, STREAM_FORMATS, iter_chunks, stream_bytes
+from expression import condition_summary
+from filtering import FilterCache, display_columns
+from loaders import DUPLICATE_POLICIES
+from schema import dataset_prefix
+from warmup import (
+    COUNTS_FILES, EXPLORER_FILE, WARMUP_ENABLED, counts_catalogue, counts_matrix, default_warmup,
+    explorer_gene_index, explorer_store, warm_up,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8502
+
+# Fils per executar les consultes (el bucle d'esdeveniments només envia i rep)
+API_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Gens per bloc en les consultes d'expressió
+EXPRESSION_CHUNK_GENES = 1000
+
+
+class QueryApi:
+    """
+    Consultes de l'API, sense HTTP. Totes les peticions comparteixen les tasques de càrrega
+    (i, per tant, les mateixes taules i matrius en memòria) i una memòria cau de filtres.
+    Els mètodes són síncrons: els gestors HTTP els criden des de `executor`.
+    """
+
+    def __init__(self, explorer_file: str = EXPLORER_FILE, counts_files=COUNTS_FILES, duplicates: str = "first",
+                 workers: int = API_WORKERS, warmup=None):
+        self.explorer_file = explorer_file
+        self.counts_files = tuple(counts_files)
+        self.duplicates = duplicates
+        self.warmup = warmup or default_warmup()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geneanalysis-api")
+        self.filter_cache = FilterCache(max_bytes=64 * 2**20)
+
+    def table(self):
+        """
+        Versió vigent de la taula unificada de GEN Explorer (vegeu datasets.DatasetCatalogue).
+        """
+        store = explorer_store(self.explorer_file, self.duplicates, self.warmup, retry=True).result()
+        return store.current.table
+
+    def filter_rows(self, spec: dict, sort_by: str = None, ascending: bool = True, offset: int = 0,
+                    limit: int = None) -> tuple:
+        """
+        Executa una especificació de filtres (vegeu batch.filter_spec_from_dict) i retorna
+        (files totals, versió de les dades, blocs de la pàgina `offset`/`limit`).
+        Les columnes són 'Gene' i les dels datasets de `spec["datasets"]` (per defecte, tots).
+        """
+        table = self.table()
+        tag_matrix = table.tag_matrix()
+        filter_spec = filter_spec_from_dict(spec, table.columns, tag_matrix.column_tags)
+        datasets = spec_datasets(spec, table.columns)
+
+        needed = set(datasets) | {dataset_prefix(col) for cols in filter_spec.metrics.values() for col in cols}
+        df = table.frame(needed)
+        columns = display_columns(df.columns, datasets)
+        if sort_by is not None and sort_by not in columns:
+            raise ValueError(f"No es pot ordenar per {sort_by!r}: no és una de les columnes del resultat")
+        gene_index = explorer_gene_index(table, self.warmup, retry=True).result() if filter_spec.genes else None
+        rows = self.filter_cache.sorted_rows(
+            df, filter_spec.conditions(), version=table.version, sort_by=sort_by, ascending=ascending,
+            gene_index=gene_index, tag_matrix=tag_matrix,
+        )
+        page = rows[offset:] if limit is None else rows[offset:offset + limit]
+        return len(rows), table.version, iter_chunks(df, page, columns)
+
+    def counts_matrices(self, datasets: list = None) -> dict:
+        """
+        {dataset: ExpressionMatrix o None} dels fulls de comptatges indicats (per defecte, tots).
+        """
+        _, sheets_info, _ = counts_catalogue(self.counts_files, warmup=self.warmup, retry=True).result()
+        if datasets is not None:
+            check_datasets(datasets, sheets_info)
+        datasets = datasets or list(sheets_info)
+        versions = {path: sheet_versions(path) for path in {sheets_info[ds] for ds in datasets}}
+        return {
+            ds: counts_matrix(
+                sheets_info[ds], ds, versions[sheets_info[ds]].get(ds, "")[:16], self.warmup, retry=True
+            ).result()
+            for ds in datasets
+        }
+
+    def expression(self, genes: list, datasets: list = None, summary: bool = False):
+        """
+        Blocs (de EXPRESSION_CHUNK_GENES gens) de la taula llarga Gene, Dataset, Sample, Condition,
+        Expression (vegeu charts.expression_long_table) o, amb `summary`, dels estadístics per
+        condició de cada gen i dataset (vegeu expression.condition_summary).
+        """
+        if not genes:
+            raise ValueError("Cal indicar almenys un gen")
+        matrices = self.counts_matrices(datasets)
+        datasets = list(matrices)
+        build = condition_summary if summary else expression_long_table
+        for start in range(0, len(genes), EXPRESSION_CHUNK_GENES):
+            chunk = build(matrices, genes[start:start + EXPRESSION_CHUNK_GENES], datasets)
+            # Un bloc buit (cap gen amb dades) no té els tipus de les columnes: no s'envia
+            if len(chunk):
+                yield chunk
+
+    def tag_rows(self, include: dict = None, exclude: dict = None, datasets: list = None) -> tuple:
+        """
+        Files que tenen, a cada dataset d'`include`, alguna de les etiquetes indicades i, a cada
+        dataset d'`exclude`, cap d'elles (vegeu tag_matrix.TagMatrix.query). Retorna
+        (files, versió de les dades, blocs amb 'Gene' i l'etiqueta de cada dataset de `datasets`).
+        """
+        if not all(selection is None or isinstance(selection, dict) for selection in (include, exclude)):
+            raise ValueError("include i exclude han de tenir la forma {dataset: [etiquetes]}")
+        table = self.table()
+        tag_matrix = table.tag_matrix()
+        if datasets is not None:
+            check_datasets(datasets, tag_matrix.datasets)
+        check_datasets(list(include or {}) + list(exclude or {}), tag_matrix.datasets)
+        include, exclude = (
+            {ds: _tag_list(tags, tag_matrix, ds) for ds, tags in (selection or {}).items()}
+            for selection in (include, exclude)
+        )
+        columns = self._tag_columns(tag_matrix, datasets)
+        rows = tag_matrix.positions(tag_matrix.query(include, exclude))
+        genes = np.asarray(table.genes)
+
+        def chunks():
+            for start in range(0, len(rows), CHUNK_ROWS):
+                part = rows[start:start + CHUNK_ROWS]
+                frame = tag_matrix.frame(part, columns)
+                frame.insert(0, "Gene", genes[part])
+                yield frame
+
+        return len(rows), table.version, chunks()
+
+    def tag_counts(self, datasets: list = None) -> dict:
+        """
+        {dataset: {etiqueta: nombre de gens}} de tota la taula.
+        """
+        tag_matrix = self.table().tag_matrix()
+        check_datasets(datasets or [], tag_matrix.datasets)
+        counts = tag_matrix.counts(columns=self._tag_columns(tag_matrix, datasets))
+        return {ds: {tag: int(n) for tag, n in counts[ds].items()} for ds in counts.columns}
+
+    def tag_intersections(self, tag: str, datasets: list = None) -> list:
+        """
+        [{"datasets": [...], "genes": n}] de cada combinació de datasets on apareix `tag`
+        (vegeu tag_matrix.TagMatrix.intersections), de més a menys gens.
+        """
+        tag_matrix = self.table().tag_matrix()
+        check_datasets(datasets or [], tag_matrix.datasets)
+        if tag not in tag_matrix.tags:
+            raise ValueError(f"Etiqueta desconeguda: {tag!r}")
+        intersections = tag_matrix.intersections(tag, self._tag_columns(tag_matrix, datasets))
+        return [
+            {
+                "datasets": [ds for ds, member in zip(intersections.index.names, combination) if member],
+                "genes": int(n),
+            }
+            for combination, n in intersections.items()
+        ]
+
+    @staticmethod
+    def _tag_columns(tag_matrix, datasets: list = None) -> list:
+        return [col for col in tag_matrix.columns if datasets is None or tag_matrix.dataset_of(col) in datasets]
+
+
+def _tag_list(tags, tag_matrix, dataset: str) -> list:
+    # Etiquetes d'un dataset a include/exclude: una etiqueta o una llista, totes del dataset
+    tags = name_list(tags, f"Les etiquetes de {dataset}")
+    column = tag_matrix.columns[tag_matrix.datasets.index(dataset)]
+    check_tags(tags, tag_matrix.column_tags.get(column, []), dataset)
+    return tags
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    """
+    Base dels gestors: executa les consultes a l'executor de l'API (els errors de la consulta,
+    ValueError, es retornen com a 400 amb {"error": missatge}) i envia les taules a blocs.
+    """
+
+    def initialize(self, api: QueryApi):
+        self.api = api
+
+    async def run(self, fn, *args):
+        try:
+            return await IOLoop.current().run_in_executor(self.api.executor, fn, *args)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+
+    def json_body(self) -> dict:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, "El cos de la petició no és JSON vàlid")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, "S'esperava un objecte JSON")
+        return body
+
+    def list_argument(self, name: str):
+        # Llista separada per comes (None si no s'indica)
+        value = self.get_query_argument(name, None)
+        return None if value is None else [item.strip() for item in value.split(",") if item.strip()]
+
+    def int_argument(self, name: str, default=None):
+        value = self.get_query_argument(name, None)
+        if value is None:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, f"{name} ha de ser un enter")
+        if number < 0:
+            raise tornado.web.HTTPError(400, f"{name} no pot ser negatiu")
+        return number
+
+    def bool_argument(self, name: str, default: bool = False) -> bool:
+        value = self.get_query_argument(name, None)
+        return default if value is None else value.lower() not in ("0", "false", "no", "")
+
+    def output_format(self) -> str:
+        fmt = self.get_query_argument("format", None)
+        if fmt is None:
+            fmt = "arrow" if STREAM_FORMATS["arrow"] in self.request.headers.get("Accept", "") else "json"
+        if fmt not in STREAM_FORMATS:
+            raise tornado.web.HTTPError(400, f"Format desconegut: {fmt!r} ({', '.join(STREAM_FORMATS)})")
+        return fmt
+
+    async def stream(self, chunks, fmt: str):
+        """
+        Envia els blocs a mesura que es generen (cada bloc es genera i es serialitza a l'executor).
+        Si el client tanca la connexió, es deixa de generar.
+        """
+        self.set_header("Content-Type", STREAM_FORMATS[fmt])
+        parts = stream_bytes(chunks, fmt)
+        try:
+            while True:
+                data = await self.run(next, parts, None)
+                if data is None:
+                    break
+                if data:
+                    self.write(data)
+                    await self.flush()
+        except StreamClosedError:
+            logger.info("El client ha tancat la connexió (%s)", self.request.uri)
+        finally:
+            parts.close()
+
+    def write_error(self, status_code: int, **kwargs):
+        error = kwargs.get("exc_info", (None, None, None))[1]
+        message = error.log_message if isinstance(error, tornado.web.HTTPError) and error.log_message else self._reason
+        self.finish({"error": message})
+
+
+class ReadyHandler(ApiHandler):
+    def get(self):
+        self.finish(self.api.warmup.progress())
+
+
+class FilterHandler(ApiHandler):
+    async def post(self):
+        spec = self.json_body()
+        fmt = self.output_format()
+        total, version, chunks = await self.run(
+            self.api.filter_rows,
+            spec,
+            self.get_query_argument("sort_by", None),
+            self.bool_argument("ascending", True),
+            self.int_argument("offset", 0),
+            self.int_argument("limit"),
+        )
+        self.set_header("X-Total-Rows", str(total))
+        self.set_header("X-Data-Version", version)
+        await self.stream(chunks, fmt)
+
+
+class ExpressionHandler(ApiHandler):
+    async def get(self):
+        await self.respond(self.list_argument("genes") or [], self.list_argument("datasets"),
+                           self.bool_argument("summary"))
+
+    async def post(self):
+        body = self.json_body()
+        try:
+            genes = name_list(body.get("genes", []), "genes")
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        await self.respond(genes, body.get("datasets"), bool(body.get("summary", False)))
+
+    async def respond(self, genes: list, datasets: list, summary: bool):
+        fmt = self.output_format()
+        if not genes:
+            raise tornado.web.HTTPError(400, "Cal indicar almenys un gen")
+        # Es comprova (i es carrega, si cal) abans d'enviar res, perquè els errors siguin un 400
+        await self.run(self.api.counts_matrices, datasets)
+        await self.stream(self.api.expression(genes, datasets, summary), fmt)
+
+
+class TagsHandler(ApiHandler):
+    async def post(self):
+        body = self.json_body()
+        fmt = self.output_format()
+        total, version, chunks = await self.run(
+            self.api.tag_rows, body.get("include"), body.get("exclude"), body.get("datasets")
+        )
+        self.set_header("X-Total-Rows", str(total))
+        self.set_header("X-Data-Version", version)
+        await self.stream(chunks, fmt)
+
+
+class TagCountsHandler(ApiHandler):
+    async def get(self):
+        self.finish(await self.run(self.api.tag_counts, self.list_argument("datasets")))
+
+
+class TagIntersectionsHandler(ApiHandler):
+    async def get(self):
+        tag = self.get_query_argument("tag", "PREVALENT_DEG")
+        intersections = await self.run(self.api.tag_intersections, tag, self.list_argument("datasets"))
+        self.finish({"tag": tag, "intersections": intersections})
+
+
+def make_app(api: QueryApi) -> tornado.web.Application:
+    routes = [
+        (r"/ready", ReadyHandler),
+        (r"/filter", FilterHandler),
+        (r"/expression", ExpressionHandler),
+        (r"/tags", TagsHandler),
+        (r"/tags/counts", TagCountsHandler),
+        (r"/tags/intersections", TagIntersectionsHandler),
+    ]
+    return tornado.web.Application([(path, handler, {"api": api}) for path, handler in routes])
+
+
+async def serve(api: QueryApi, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+    make_app(api).listen(port, address=host)
+    logger.info("API a http://%s:%d", host, port)
+    await asyncio.Event().wait()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.api",
+        description="API HTTP local per consultar les dades de GEN Explorer i GEN Boxplots.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Adreça d'escolta (per defecte, només local)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (per defecte {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Fils per executar les consultes")
+    parser.add_argument("--explorer", default=EXPLORER_FILE, help=f"Excel de GEN Explorer (per defecte {EXPLORER_FILE})")
+    parser.add_argument("--counts", nargs="+", default=list(COUNTS_FILES), help="Excels de comptatges de GEN Boxplots")
+    parser.add_argument("--duplicates", default="first", choices=DUPLICATE_POLICIES,
+                        help="Tractament dels gens repetits dins d'un full")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    api = QueryApi(args.explorer, args.counts, args.duplicates, args.workers)
+    if WARMUP_ENABLED:
+        # Les dades es carreguen en segon pla: /ready en mostra el progrés
+        warm_up(args.explorer, args.counts, args.duplicates, api.warmup)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,17 +3,65 @@ import streamlit as st
 # 1) Configuració de la pàgina: wide mode
 st.set_page_config(layout="wide")
 
+import pandas as pd
+
+from instrumentation import stage_run
 from subapps import app
 from subapps import app_boxplot
+from warmup import WARMUP_ENABLED, default_warmup, warm_up
+from warmup_panel import show_warmup_progress
+
+@st.cache_resource
+def start_warmup():
+    """
+    Escalfament de les dades en segon pla (vegeu warmup.py): un sol cop per procés del servidor,
+    en la primera execució de qualsevol sessió. Amb GENEANALYSIS_WARMUP=0 no es programa res
+    i cada pàgina carrega les seves dades quan les necessita.
+    """
+    return warm_up() if WARMUP_ENABLED else default_warmup()
+
+def show_stage_panel(run):
+    """
+    Panell de depuració (barra lateral): temps, files, memòria i memòria cau de cada etapa
+    de l'última execució de la pàgina, i descàrrega en JSON.
+    """
+    with st.sidebar.expander("Etapes de l'última execució", expanded=True):
+        if not run.records:
+            st.write("No s'ha registrat cap etapa.")
+            return
+        records = pd.DataFrame(run.to_dicts())
+        table = pd.DataFrame({
+            "Etapa": ["· " * depth + name for depth, name in zip(records["depth"], records["stage"])],
+            "ms": (records["seconds"] * 1000).round(1),
+            "Files entrada": records["rows_in"].astype("Int64"),
+            "Files sortida": records["rows_out"].astype("Int64"),
+            "Memòria (MB)": (records["memory_bytes"] / 2**20).round(1),
+            "Memòria cau": records["cache"].fillna(""),
+        })
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        st.caption(f"Total: {run.total_seconds() * 1000:.0f} ms")
+        st.download_button(
+            "Descarregar JSON",
+            data=run.to_json(),
+            file_name=f"etapes_{run.run_id}.json",
+            mime="application/json",
+        )
 
 def main():
+    start_warmup()
     opcions = ["GEN Explorer", "GEN Boxplots"]
     eleccio = st.sidebar.radio("Pàgines:", opcions, index=0)
 
-    if eleccio == "GEN Explorer":
-        app.main()
-    else:
-        app_boxplot.main()
+    with stage_run(eleccio) as run:
+        if eleccio == "GEN Explorer":
+            app.main()
+        else:
+            app_boxplot.main()
+
+    st.sidebar.write("---")
+    show_warmup_progress()
+    if st.sidebar.toggle("Mostra el temps per etapa", value=False):
+        show_stage_panel(run)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
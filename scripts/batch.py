@@ -0,0 +1,278 @@
+"""
+Execució per lots dels filtres de GEN Explorer, sense Streamlit (apte per a cron).
+
+    python -m scripts.batch specs.json [altres.yaml ...] --out resultats/ [--workers 4]
+
+Cada fitxer d'especificacions (JSON o YAML) conté una llista d'especificacions, o bé
+{"specs": [...]}. Cada especificació té la mateixa forma que els filtres de la barra lateral:
+
+    {
+        "name": "iAs_prevalents",
+        "genes": [],
+        "p_value": 0.05, "fdr": 0.05, "logfc": 1.5,
+        "metrics": {"iAs": ["iAs_pvalue", "iAs_logFC"]},
+        "tags": {"iAs": ["PREVALENT_DEG"]},
+        "datasets": ["iAs", "ProteiNs"],
+        "format": "csv"
+    }
+
+Les dades es carreguen un sol cop i totes les especificacions s'executen en paral·lel sobre
+la mateixa taula. Es desa un fitxer per especificació i un resum (`summary.json`) amb el
+nombre de files i gens de cadascuna i els temps.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+if __package__:
+    # Executat com a `python -m scripts.batch`: els mòduls del projecte s'importen
+    # pel nom, com quan streamlit executa scripts/app_integrada.py
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from export import EXPORT_FORMATS, iter_chunks, write_export
+from filtering import FilterSpec, display_columns, evaluate
+from gene_index import build_gene_index
+from loaders import DUPLICATE_POLICIES, load_merged_workbook, tag_vocabularies
+from schema import dataset_prefix, tag_column
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILE = os.path.join("data", "Gene_data_20250312.xlsx")
+
+# Claus permeses en una especificació
+SPEC_KEYS = {"name", "genes", "p_value", "fdr", "logfc", "metrics", "tags", "datasets", "format"}
+
+
+def read_specs(path: str) -> list:
+    """
+    Llegeix un fitxer d'especificacions JSON o YAML (segons l'extensió).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"Cal instal·lar PyYAML per llegir {path} (o fer servir JSON)")
+            content = yaml.safe_load(f)
+        else:
+            content = json.load(f)
+
+    specs = content.get("specs") if isinstance(content, dict) else content
+    if not isinstance(specs, list):
+        raise ValueError(f"{path}: s'esperava una llista d'especificacions")
+    return specs
+
+
+def filter_spec_from_dict(spec: dict, columns, tag_values: dict = None) -> FilterSpec:
+    """
+    Construeix el FilterSpec d'una especificació, comprovant que les columnes existeixen.
+    Amb `tag_values` ({columna d'etiquetes: valors possibles}, p.ex. loaders.tag_vocabularies
+    o TagMatrix.column_tags) també es comprova que les etiquetes demanades existeixen.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"L'especificació ha de ser un objecte, no {type(spec).__name__}")
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise ValueError(f"Claus desconegudes: {', '.join(sorted(unknown))}")
+
+    columns = set(columns)
+    metrics = {ds: name_list(cols, f"metrics[{ds!r}]") for ds, cols in _mapping(spec, "metrics").items()}
+    missing = [col for cols in metrics.values() for col in cols if col not in columns]
+    tags = {}
+    for ds, values in _mapping(spec, "tags").items():
+        tag_col = tag_column(ds)
+        if tag_col not in columns:
+            missing.append(tag_col)
+        values = name_list(values, f"tags[{ds!r}]")
+        if tag_values is not None and tag_col in tag_values:
+            check_tags(values, tag_values[tag_col], ds)
+        tags[ds] = (tag_col, values)
+    if missing:
+        raise ValueError(f"Columnes inexistents: {', '.join(missing)}")
+
+    defaults = FilterSpec()
+    return FilterSpec(
+        genes=name_list(spec.get("genes", []), "genes"),
+        p_value=spec.get("p_value", defaults.p_value),
+        fdr=spec.get("fdr", defaults.fdr),
+        logfc=spec.get("logfc", defaults.logfc),
+        metrics=metrics,
+        tags=tags,
+    )
+
+
+def spec_datasets(spec: dict, columns) -> list:
+    """
+    Datasets de les columnes del resultat d'una especificació (`spec["datasets"]`; per defecte,
+    tots els de `columns`). Han de ser una llista de datasets existents.
+    """
+    all_datasets = sorted({dataset_prefix(col) for col in columns if "_" in col})
+    return check_datasets(spec.get("datasets", all_datasets), all_datasets)
+
+
+def check_datasets(datasets, known) -> list:
+    """
+    Comprova que `datasets` és una llista de noms de `known` (un text sol no s'accepta) i la retorna.
+    """
+    if not isinstance(datasets, list) or not all(isinstance(ds, str) for ds in datasets):
+        raise ValueError("datasets ha de ser una llista de noms de datasets")
+    unknown = [ds for ds in datasets if ds not in known]
+    if unknown:
+        raise ValueError(f"Datasets desconeguts: {', '.join(map(str, unknown))}")
+    return datasets
+
+
+def check_tags(tags: list, known, dataset: str):
+    """
+    Comprova que totes les etiquetes `tags` d'un dataset són de `known` (els seus valors possibles).
+    """
+    unknown = [tag for tag in tags if tag not in known]
+    if unknown:
+        raise ValueError(
+            f"Etiquetes desconegudes a {dataset}: {', '.join(map(str, unknown))} "
+            f"(n'hi ha: {', '.join(map(str, known))})"
+        )
+
+
+def name_list(value, key: str) -> list:
+    """
+    Un nom o una llista de noms (p.ex. "PREVALENT_DEG" o ["PREVALENT_DEG", "POSSIBLE_DEG"]) com a llista.
+    """
+    value = [value] if isinstance(value, str) else value
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ValueError(f"{key} ha de ser un nom o una llista de noms")
+    return value
+
+
+def run_spec(df, spec: dict, out_dir: str, default_format: str = "csv", gene_index=None) -> dict:
+    """
+    Executa una especificació sobre la taula unificada i en desa el resultat.
+    Amb `gene_index` (vegeu filtering.evaluate) les llistes de gens es resolen amb l'índex.
+    Retorna la seva entrada del resum.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"L'especificació ha de ser un objecte, no {type(spec).__name__}")
+    start = time.perf_counter()
+    name = spec.get("name", "")
+    fmt = spec.get("format", default_format)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'exportació desconegut: {fmt!r}")
+
+    conditions = filter_spec_from_dict(spec, df.columns, tag_vocabularies(df)).conditions()
+    datasets = spec_datasets(spec, df.columns)
+    rows = evaluate(df, conditions, gene_index=gene_index)
+    filtered = time.perf_counter()
+
+    cols = display_columns(df.columns, datasets)
+    output = os.path.join(out_dir, f"{_file_name(name)}{EXPORT_FORMATS[fmt][0]}")
+    write_export(iter_chunks(df, rows, cols), output, fmt)
+
+    return {
+        "name": name,
+        "output": output,
+        "format": fmt,
+        "rows": int(len(rows)),
+        "genes": int(df["Gene"].iloc[rows].nunique()),
+        "filter_seconds": round(filtered - start, 4),
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def run_batch(file_path: str, specs: list, out_dir: str, workers: int = None,
+              duplicates: str = "first", default_format: str = "csv") -> dict:
+    """
+    Carrega les dades un sol cop i executa totes les especificacions en paral·lel (fils que
+    comparteixen la mateixa taula). Una especificació errònia (també una entrada que no és
+    un objecte, identificada al resum per la seva posició, p.ex. "#2") no atura les altres:
+    el seu error queda al resum. Retorna el resum, que també es desa a `<out_dir>/summary.json`.
+    """
+    start = time.perf_counter()
+    names = [spec.get("name") for spec in specs if isinstance(spec, dict)]
+    if any(not name for name in names) or len({_file_name(name) for name in names}) != len(names):
+        raise ValueError("Cada especificació ha de tenir un 'name' únic (també com a nom de fitxer)")
+
+    df = load_merged_workbook(file_path, duplicates=duplicates)
+    if df is None or "Gene" not in df.columns:
+        raise ValueError(f"No s'ha trobat la columna 'Gene' a {file_path}")
+    # Índex de gens compartit (només si alguna especificació filtra per gens)
+    gene_index = (
+        build_gene_index(df["Gene"]) if any(isinstance(spec, dict) and spec.get("genes") for spec in specs) else None
+    )
+    loaded = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+
+    def run_one(position, spec):
+        name = spec.get("name") if isinstance(spec, dict) else f"#{position + 1}"
+        try:
+            return run_spec(df, spec, out_dir, default_format, gene_index)
+        except Exception as e:
+            logger.error("Especificació %s: %s", name, e)
+            return {"name": name, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers or min(len(specs), os.cpu_count() or 1) or 1) as pool:
+        results = list(pool.map(run_one, range(len(specs)), specs))
+
+    summary = {
+        "file": os.path.abspath(file_path),
+        "data_version": df.attrs.get("version"),
+        "load_seconds": round(loaded - start, 4),
+        "total_seconds": round(time.perf_counter() - start, 4),
+        "specs": results,
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.batch",
+        description="Executa filtres de GEN Explorer per lots, sense interfície.",
+    )
+    parser.add_argument("specs", nargs="+", help="Fitxers d'especificacions (JSON o YAML)")
+    parser.add_argument("--file", default=DEFAULT_FILE, help=f"Excel d'entrada (per defecte {DEFAULT_FILE})")
+    parser.add_argument("--out", default="resultats", help="Directori de sortida")
+    parser.add_argument("--workers", type=int, default=None, help="Especificacions en paral·lel")
+    parser.add_argument("--format", default="csv", choices=list(EXPORT_FORMATS),
+                        help="Format per defecte dels fitxers de sortida")
+    parser.add_argument("--duplicates", default="first", choices=DUPLICATE_POLICIES,
+                        help="Tractament dels gens repetits dins d'un full")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    try:
+        specs = [spec for path in args.specs for spec in read_specs(path)]
+        summary = run_batch(args.file, specs, args.out, args.workers, args.duplicates, args.format)
+    except (OSError, ValueError) as e:
+        logger.error("%s", e)
+        return 2
+
+    logger.info("Dades carregades en %.2f s", summary["load_seconds"])
+    for result in summary["specs"]:
+        if "error" in result:
+            logger.info("%-30s ERROR: %s", result["name"], result["error"])
+        else:
+            logger.info("%-30s %8d files %8d gens %8.2f s", result["name"], result["rows"],
+                        result["genes"], result["seconds"])
+    logger.info("Total: %.2f s", summary["total_seconds"])
+    return 1 if any("error" in result for result in summary["specs"]) else 0
+
+
+def _mapping(spec: dict, key: str) -> dict:
+    value = spec.get(key, {})
+    if not isinstance(value, dict):
+        raise ValueError(f"{key} ha de ser un objecte {{dataset: [...]}}")
+    return value
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("._") or "spec"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
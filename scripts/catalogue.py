@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import load_workbook
+
+from data_cache import cached_json
+
+# S'ha d'incrementar quan canvia el contingut del catàleg desat en disc
+CATALOGUE_CACHE_VERSION = 2
+
+
+def scan_workbook(file_path: str) -> list:
+    """
+    Obre un Excel una sola vegada, en mode només lectura (streaming), i per a cada full
+    amb columna 'Gene' en llegeix només aquesta columna.
+    Retorna [(nom_full, [gens], nombre_de_files_amb_gen), ...].
+    """
+    results = []
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None)
+            if not header or "Gene" not in header:
+                # El full pot no tenir la columna 'Gene'
+                continue
+            gene_col = header.index("Gene") + 1
+            genes = [
+                str(value)
+                for (value,) in sheet.iter_rows(min_row=2, min_col=gene_col, max_col=gene_col, values_only=True)
+                if value is not None and value != ""
+            ]
+            results.append((sheet.title, genes, len(genes)))
+    finally:
+        workbook.close()
+    return results
+
+
+def read_sheets_info(file_paths, max_workers: int = None):
+    """
+    Construeix el catàleg de gens en una sola passada per fitxer i retorna:
+      - Llista global ordenada de gens
+      - Diccionari que mapeja {nom_full: file_path}
+      - Diccionari {nom_full: nombre de files amb gen}
+    Cada fitxer s'analitza en un procés separat (si n'hi ha més d'un). Els processos s'inicien
+    amb "spawn" i no amb fork: aquesta funció es crida des de fils (l'escalfament, vegeu warmup.py)
+    d'un servidor que en té d'altres en marxa, i un fork en aquestes condicions es pot bloquejar.
+    """
+    file_paths = list(file_paths)
+    max_workers = max_workers or min(len(file_paths), os.cpu_count() or 1)
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            scanned = list(pool.map(scan_workbook, file_paths))
+    else:
+        scanned = [scan_workbook(file_path) for file_path in file_paths]
+
+    tots_gens = set()
+    sheets_info = {}  # Map: nom_full -> file_path
+    row_counts = {}   # Map: nom_full -> nombre de files
+    for file_path, sheets in zip(file_paths, scanned):
+        for nom_full, genes, n_rows in sheets:
+            tots_gens.update(genes)
+            sheets_info[nom_full] = file_path
+            row_counts[nom_full] = n_rows
+
+    return sorted(tots_gens), sheets_info, row_counts
+
+
+def load_sheets_info(file_paths):
+    """
+    Igual que `read_sheets_info`, però desant el resultat en disc (JSON) mentre
+    cap dels fitxers canviï, de manera que cada procés no hagi de rellegir els Excel.
+    """
+    tots_gens, sheets_info, row_counts = cached_json(
+        list(file_paths),
+        read_sheets_info,
+        variant=f"catalogue-v{CATALOGUE_CACHE_VERSION}",
+    )
+    return tots_gens, sheets_info, row_counts
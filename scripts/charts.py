@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# Colors i ordre de les condicions (C: control, P: pacient)
+CONDITION_COLORS = {"C": "#bae1ff", "P": "#daf7a6"}
+CONDITION_ORDER = ["C", "P"]
+
+# Gràfics per fila en la figura d'un gen
+CHARTS_PER_ROW = 4
+
+
+def expression_long_table(matrices: dict, genes, datasets) -> pd.DataFrame:
+    """
+    Taula llarga (Gene, Dataset, Sample, Condition, Expression) amb l'expressió de cada mostra
+    per als gens i datasets indicats, sense valors nuls. Es construeix directament a partir
+    de les files de cada ExpressionMatrix (`matrices`: {dataset: matriu o None}), sense melt.
+    """
+    parts = {key: [] for key in ("Gene", "Dataset", "Sample", "Condition", "Expression")}
+    for dataset in datasets:
+        matrix = matrices.get(dataset)
+        if matrix is None:
+            continue
+        for gene in genes:
+            values = matrix.row(gene)
+            if values is None:
+                continue
+            valid = ~np.isnan(values)
+            n = int(valid.sum())
+            parts["Gene"].append(np.full(n, gene, dtype=object))
+            parts["Dataset"].append(np.full(n, dataset, dtype=object))
+            parts["Sample"].append(matrix.samples[valid])
+            parts["Condition"].append(matrix.conditions[valid])
+            parts["Expression"].append(np.asarray(values[valid], dtype=np.float32))
+
+    if not parts["Gene"]:
+        return pd.DataFrame({key: pd.Series(dtype=object) for key in parts})
+    return pd.DataFrame({key: np.concatenate(arrays) for key, arrays in parts.items()})
+
+
+def condition_stats_table(matrices: dict, genes, datasets) -> pd.DataFrame:
+    """
+    Estadístics precalculats (Gene, Dataset, Condition, n, mean, median, q1, q3, ...) dels
+    gens i datasets indicats, llegits de cada ExpressionMatrix (vegeu expression.ConditionStats).
+    """
+    tables = []
+    for dataset in datasets:
+        matrix = matrices.get(dataset)
+        if matrix is None:
+            continue
+        for gene in genes:
+            table = matrix.condition_stats(gene)
+            if table is not None and len(table):
+                tables.append(table.assign(Gene=gene, Dataset=dataset))
+    if not tables:
+        return None
+    return pd.concat(tables, ignore_index=True)
+
+
+def missing_cells(matrices: dict, long: pd.DataFrame, genes, datasets) -> list:
+    """
+    Combinacions (gen, dataset, motiu) sense cap valor a la taula llarga. Motius:
+    "no_gene_column" (el full no té 'Gene'), "absent" (el gen no hi és) o "empty" (tots NaN).
+    """
+    present = set(zip(long["Gene"], long["Dataset"]))
+    missing = []
+    for gene in genes:
+        for dataset in datasets:
+            if (gene, dataset) in present:
+                continue
+            matrix = matrices.get(dataset)
+            if matrix is None:
+                reason = "no_gene_column"
+            elif matrix.row(gene) is None:
+                reason = "absent"
+            else:
+                reason = "empty"
+            missing.append((gene, dataset, reason))
+    return missing
+
+
+def expression_label(dataset: str) -> str:
+    return "Log2 abundances" if dataset == "ProteiNs" else "mRNA Expression <br> (Normalized Read Counts)"
+
+
+def gene_figure(long: pd.DataFrame, gene: str, datasets, include_zero: bool = True,
+                stats: pd.DataFrame = None) -> go.Figure:
+    """
+    Una sola figura per a un gen, amb un boxplot per dataset (com a molt CHARTS_PER_ROW per fila).
+    Si es passen els estadístics precalculats (`condition_stats_table`), les caixes els fan
+    servir directament en lloc de calcular-los al navegador.
+    """
+    datasets = list(datasets)
+    n_rows = max(1, -(-len(datasets) // CHARTS_PER_ROW))
+    n_cols = max(1, min(len(datasets), CHARTS_PER_ROW))
+    cells = [(gene, dataset, i // CHARTS_PER_ROW + 1, i % CHARTS_PER_ROW + 1) for i, dataset in enumerate(datasets)]
+    return _faceted_figure(long, cells, n_rows, n_cols, include_zero, stats)
+
+
+def selection_figure(long: pd.DataFrame, genes, datasets, include_zero: bool = True,
+                     stats: pd.DataFrame = None) -> go.Figure:
+    """
+    Una sola figura per a tota la selecció: una fila per gen i una columna per dataset.
+    """
+    genes, datasets = list(genes), list(datasets)
+    cells = [(gene, dataset, i + 1, j + 1) for i, gene in enumerate(genes) for j, dataset in enumerate(datasets)]
+    return _faceted_figure(long, cells, max(1, len(genes)), max(1, len(datasets)), include_zero, stats)
+
+
+def _faceted_figure(long: pd.DataFrame, cells, n_rows: int, n_cols: int, include_zero: bool,
+                    stats: pd.DataFrame = None) -> go.Figure:
+    """
+    Construeix la figura a partir de les cel·les (gen, dataset, fila, columna).
+    Cada cel·la té una caixa per condició (sense punts) i els punts de les mostres en un
+    sol traç WebGL per condició. Les cel·les sense dades queden buides.
+    """
+    titles = [""] * (n_rows * n_cols)
+    for gene, dataset, row, col in cells:
+        titles[(row - 1) * n_cols + (col - 1)] = f"{dataset} : {gene}"
+    fig = make_subplots(
+        rows=n_rows,
+        cols=n_cols,
+        subplot_titles=titles,
+        vertical_spacing=min(0.12, 0.3 / n_rows),
+        horizontal_spacing=0.06,
+    )
+
+    groups = {key: df for key, df in long.groupby(["Gene", "Dataset", "Condition"], sort=False)}
+    box_stats = {}
+    if stats is not None:
+        for row in stats.itertuples(index=False):
+            box_stats[(row.Gene, row.Dataset, row.Condition)] = row
+    conditions = {}
+    for gene, dataset, condition in groups:
+        conditions.setdefault((gene, dataset), set()).add(condition)
+
+    traces, trace_rows, trace_cols = [], [], []
+    shown_in_legend = set()
+    for gene, dataset, row, col in cells:
+        present = conditions.get((gene, dataset), set())
+        for condition in [c for c in CONDITION_ORDER if c in present] + sorted(present - set(CONDITION_ORDER)):
+            points = groups[(gene, dataset, condition)]
+            color = CONDITION_COLORS.get(condition)
+            show_legend = condition not in shown_in_legend
+            shown_in_legend.add(condition)
+            x = np.full(len(points), condition, dtype=object)
+            y = points["Expression"].to_numpy()
+            box = dict(
+                name=condition, legendgroup=condition, marker_color=color,
+                line=dict(width=1), boxpoints=False, showlegend=show_legend,
+            )
+            precomputed = box_stats.get((gene, dataset, condition))
+            if precomputed is not None:
+                # Caixa amb els estadístics precalculats: només s'envien 6 valors
+                traces.append(go.Box(
+                    x=[condition], q1=[precomputed.q1], median=[precomputed.median], q3=[precomputed.q3],
+                    lowerfence=[precomputed.lower_fence], upperfence=[precomputed.upper_fence],
+                    mean=[precomputed.mean], **box,
+                ))
+            else:
+                traces.append(go.Box(x=x, y=y, hoverinfo="skip", **box))
+            # Els punts en WebGL (les caixes no en tenen versió)
+            traces.append(go.Scattergl(
+                x=x, y=y, mode="markers", name=condition, legendgroup=condition, showlegend=False,
+                marker=dict(size=10, opacity=0.8, color=color),
+                customdata=points["Sample"].to_numpy(),
+                hovertemplate="Sample=%{customdata}<br>Expression=%{y}<extra>" + condition + "</extra>",
+            ))
+            trace_rows += [row, row]
+            trace_cols += [col, col]
+
+    # Tots els traços d'una vegada (afegir-los un a un revalida la figura a cada pas)
+    if traces:
+        fig.add_traces(traces, rows=trace_rows, cols=trace_cols)
+    fig.update_xaxes(categoryorder="array", categoryarray=CONDITION_ORDER, title_text="Condition")
+    y_titles = {(row, col): expression_label(dataset) for _, dataset, row, col in cells}
+    for (row, col), title in y_titles.items():
+        fig.get_subplot(row, col).yaxis.title.text = title
+
+    if include_zero:
+        fig.update_yaxes(rangemode="tozero")
+    fig.update_layout(height=max(450, 380 * n_rows), legend_title_text="Condition", margin=dict(t=60))
+    return fig
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import zipfile
+from xml.etree import ElementTree
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# Directori on es guarden els fitxers Arrow cachejats (configurable per variable d'entorn)
+CACHE_DIR = os.environ.get("GENEANALYSIS_CACHE_DIR", os.path.join("data", ".cache"))
+
+# Clau de les metadades Arrow on es desen els df.attrs
+_ATTRS_KEY = b"geneanalysis.attrs"
+
+# Espais de noms i patrons de l'XML d'un .xlsx (per als hashos per full)
+_XLSX_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_SHARED_STRING_CELL = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+
+def file_signature(file_path: str) -> dict:
+    """
+    Retorna la signatura barata d'un fitxer: ruta absoluta, mida i data de modificació.
+    """
+    stat = os.stat(file_path)
+    return {
+        "path": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Calcula el hash SHA-256 del contingut d'un fitxer llegint-lo a blocs.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_version(file_path: str, cache_dir: str = None) -> str:
+    """
+    Retorna el hash de contingut d'un fitxer.
+
+    Per no rellegir tot el fitxer a cada arrencada, es guarda un fitxer auxiliar
+    (.json) amb la ruta, mida, mtime i hash. Si la mida i el mtime coincideixen,
+    es reutilitza el hash desat; si no, es recalcula.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    signature = file_signature(file_path)
+    sidecar = os.path.join(cache_dir, f"{path_key(signature['path'])}.json")
+
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if all(saved.get(k) == v for k, v in signature.items()):
+            return saved["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    signature["sha256"] = content_hash(file_path)
+    try:
+        _atomic_write_text(sidecar, json.dumps(signature))
+    except OSError as e:
+        logger.warning("No s'ha pogut escriure %s: %s", sidecar, e)
+    return signature["sha256"]
+
+
+def sheet_versions(file_path: str, cache_dir: str = None) -> dict:
+    """
+    Retorna el hash de contingut de cada full d'un Excel ({nom_full: sha256}).
+
+    En un .xlsx el hash d'un full és el del seu XML més els textos compartits
+    (sharedStrings) als quals fa referència, de manera que canviar un full no canvia
+    el hash dels altres. Si el fitxer no és un .xlsx, tots els fulls tenen el hash del fitxer.
+    Com a `file_version`, el resultat es desa en un fitxer auxiliar mentre la mida i el
+    mtime no canviïn.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    signature = file_signature(file_path)
+    sidecar = os.path.join(cache_dir, f"{path_key(signature['path'], 'sheets')}.json")
+
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if all(saved.get(k) == v for k, v in signature.items()):
+            return saved["sheets"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        sheets = _xlsx_sheet_hashes(file_path)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        sha = file_version(file_path, cache_dir)
+        sheets = {name: sha for name in pd.ExcelFile(file_path).sheet_names}
+    signature["sheets"] = sheets
+    try:
+        _atomic_write_text(sidecar, json.dumps(signature))
+    except OSError as e:
+        logger.warning("No s'ha pogut escriure %s: %s", sidecar, e)
+    return sheets
+
+
+def _xlsx_sheet_hashes(file_path: str) -> dict:
+    with zipfile.ZipFile(file_path) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        relations = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in relations}
+        strings = _shared_strings(archive) if "xl/sharedStrings.xml" in archive.namelist() else []
+
+        hashes = {}
+        for sheet in workbook.iter(f"{_XLSX_MAIN}sheet"):
+            target = targets[sheet.get(f"{_XLSX_REL}id")]
+            xml = archive.read(target.lstrip("/") if target.startswith("/") else f"xl/{target}")
+            digest = hashlib.sha256(xml)
+            for i in sorted({int(i) for i in _SHARED_STRING_CELL.findall(xml)}):
+                digest.update(f"\0{i}\0".encode("utf-8"))
+                digest.update(strings[i].encode("utf-8") if i < len(strings) else b"")
+            hashes[sheet.get("name")] = digest.hexdigest()
+    return hashes
+
+
+def _shared_strings(archive: zipfile.ZipFile) -> list:
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag == f"{_XLSX_MAIN}si":
+                strings.append("".join(t.text or "" for t in element.iter(f"{_XLSX_MAIN}t")))
+                element.clear()
+    return strings
+
+
+def cached_frame(file_path: str, build, variant: str = "", cache_dir: str = None) -> pd.DataFrame:
+    """
+    Retorna el DataFrame derivat de `file_path`, fent servir una còpia Arrow en disc.
+
+    - La clau de la memòria cau és la ruta, la mida, el mtime i el hash del contingut
+      del fitxer, més `variant` (per distingir diferents transformacions del mateix fitxer).
+    - Si existeix la còpia per a la versió actual, es llegeix amb memory-map.
+    - Si no, es crida `build(file_path)`, es desa el resultat i s'eliminen les còpies
+      de versions anteriors del mateix fitxer.
+    - Els df.attrs (si són serialitzables en JSON) es conserven a les metadades Arrow.
+    - Les columnes de tipus barrejats es retornen ja normalitzades (`arrow_safe`), tant si
+      es llegeixen de la còpia com si es construeixen.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    sha = file_version(file_path, cache_dir)
+    prefix = path_key(os.path.abspath(file_path), variant)
+    arrow_path = os.path.join(cache_dir, f"{prefix}-{sha[:16]}.arrow")
+
+    with stage("arrow_cache", cached=True) as record:
+        if os.path.exists(arrow_path):
+            try:
+                df = read_frame(arrow_path)
+                record.rows_out = len(df)
+                return df
+            except (OSError, pa.ArrowException) as e:
+                logger.warning("Còpia Arrow il·legible (%s), es reconstrueix: %s", arrow_path, e)
+
+        record.cache = "miss"
+        df = build(file_path)
+        if df is None:
+            return df
+        # El mateix DataFrame que es llegirà de la còpia en les sessions següents
+        df = arrow_safe(df)
+        record.rows_out = len(df)
+        try:
+            write_frame(df, arrow_path)
+            remove_stale(cache_dir, prefix, keep=arrow_path)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning("No s'ha pogut desar la còpia Arrow %s: %s", arrow_path, e)
+        return df
+
+
+def cached_json(file_paths, build, variant: str = "", cache_dir: str = None):
+    """
+    Com `cached_frame`, però per a resultats petits serialitzables en JSON que depenen
+    de diversos fitxers: la clau inclou la versió (hash) de cadascun.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    versions = [(os.path.abspath(p), file_version(p, cache_dir)) for p in file_paths]
+    prefix = path_key("|".join(p for p, _ in versions), variant)
+    digest = hashlib.sha1(repr(versions).encode("utf-8")).hexdigest()[:16]
+    json_path = os.path.join(cache_dir, f"{prefix}-{digest}.result.json")
+
+    with stage("json_cache", cached=True) as record:
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        record.cache = "miss"
+        result = build(file_paths)
+        try:
+            _atomic_write_text(json_path, json.dumps(result))
+            remove_stale(cache_dir, prefix, keep=json_path, suffix=".result.json")
+        except OSError as e:
+            logger.warning("No s'ha pogut desar %s: %s", json_path, e)
+        return result
+
+
+def write_frame(df: pd.DataFrame, path: str):
+    """
+    Escriu un DataFrame en format Arrow IPC sense compressió (apte per a memory-map).
+    L'escriptura és atòmica: primer a un fitxer temporal i després es renomena.
+    """
+    table = arrow_table(df)
+    if df.attrs:
+        metadata = dict(table.schema.metadata or {})
+        metadata[_ATTRS_KEY] = json.dumps(df.attrs).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    try:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_frame(path: str, columns: list = None) -> pd.DataFrame:
+    """
+    Llegeix (amb memory-map) un fitxer escrit amb `write_frame` i en recupera els df.attrs.
+    Amb `columns` només es llegeixen aquestes columnes.
+    """
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    df = table.to_pandas()
+    df.attrs.update(_schema_attrs(table.schema))
+    return df
+
+
+def read_frame_schema(path: str) -> tuple:
+    """
+    Noms de columna i df.attrs d'un fitxer escrit amb `write_frame`, sense llegir-ne les dades.
+    """
+    with pa.memory_map(path) as source:
+        schema = pa.ipc.open_file(source).schema
+    return list(schema.names), _schema_attrs(schema)
+
+
+def _schema_attrs(schema: pa.Schema) -> dict:
+    raw_attrs = (schema.metadata or {}).get(_ATTRS_KEY)
+    return json.loads(raw_attrs.decode("utf-8")) if raw_attrs else {}
+
+
+def arrow_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Converteix un DataFrame a taula Arrow (sense l'índex), tolerant columnes de tipus barrejats.
+    """
+    return pa.Table.from_pandas(arrow_safe(df), preserve_index=False)
+
+
+def arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arrow no accepta columnes 'object' amb tipus barrejats (p.ex. números i text).
+    En aquestes columnes es converteixen a text els valors no nuls (retorna el mateix
+    DataFrame si no n'hi ha cap).
+    """
+    mixed_cols = []
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            mixed_cols.append(col)
+
+    if not mixed_cols:
+        return df
+    df = df.copy()
+    for col in mixed_cols:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def path_key(path: str, variant: str = "") -> str:
+    """
+    Clau curta (hash) per a una ruta i una variant, apta com a nom de fitxer.
+    """
+    return hashlib.sha1(f"{path}|{variant}".encode("utf-8")).hexdigest()[:16]
+
+
+def remove_stale(cache_dir: str, prefix: str, keep: str, suffix: str = ".arrow"):
+    """
+    Elimina les còpies d'altres versions (mateix prefix i sufix, excepte `keep`).
+    """
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(f"{prefix}-") and name.endswith(suffix) and path != keep:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _atomic_write_text(path: str, text: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _tmp_path(path: str) -> str:
+    # Únic per procés i fil, perquè diversos treballadors puguin escriure alhora
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
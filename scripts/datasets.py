@@ -0,0 +1,196 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+from data_cache import file_version, sheet_versions
+from gene_index import table_aliases
+from instrumentation import stage
+from loaders import MERGED_CACHE_VERSION, gene_union, sheet_blocks, sheet_columns, sheet_metadata
+from schema import ID_SUBSTRINGS, classify_column, dataset_prefix
+from tag_matrix import TagMatrix, build_tag_matrix
+
+# Nombre de combinacions de datasets (taules de treball) que es conserven ja unides
+MAX_FRAMES = 4
+
+
+class DatasetCatalogue:
+    """
+    Taula unificada d'un Excel (mateixes files, columnes i tipus que loaders.read_merged_sheets)
+    que es carrega per datasets i només quan cal:
+
+    - En construir-la només es llegeixen les metadades de cada full (columnes, vocabulari
+      d'etiquetes, gens repetits) i la columna 'Gene' de tots els blocs, per fixar l'ordre global
+      de les files.
+    - Les columnes d'un full s'alineen a aquest ordre el primer cop que un filtre o la taula
+      les demana (`frame`) i es conserven per a les sessions següents.
+
+    Les files són sempre les mateixes sigui quina sigui la combinació de datasets carregada:
+    les posicions (FilterCache, GeneIndex) valen per a totes les taules de treball.
+    """
+
+    def __init__(self, file_path: str, duplicates: str = "first", previous: "DatasetCatalogue" = None,
+                 cache_dir: str = None):
+        self.file_path = file_path
+        self.duplicates = duplicates
+        self.cache_dir = cache_dir or data_cache.CACHE_DIR
+        self.version = f"{file_version(file_path, self.cache_dir)[:16]}-merged-v{MERGED_CACHE_VERSION}-{duplicates}"
+        self.sheet_versions = sheet_versions(file_path, self.cache_dir)
+        with stage("sheet_metadata") as record:
+            metadata = sheet_metadata(file_path, duplicates, self.sheet_versions, self.cache_dir)
+            indexes = {
+                name: sheet_columns(file_path, name, digest, [], duplicates, self.cache_dir).index
+                for name, digest in self.sheet_versions.items()
+            }
+            record.rows_out = sum(len(index) for index in indexes.values())
+        # Els fulls buits no aporten ni files ni columnes
+        self.metadata = {
+            name: meta for name, meta in metadata.items() if len(indexes[name]) or meta["columns"]
+        }
+        if not self.metadata:
+            raise ValueError(f"No s'han trobat dades a {file_path}")
+        self.genes = gene_union(indexes[name] for name in self.metadata)
+        self._aligned = {}  # full -> columnes del full alineades a `genes`
+        self._frames = OrderedDict()  # tupla de fulls -> taula de treball
+        self._tag_matrix = None
+        self._lock = threading.Lock()
+
+        if previous is not None and previous.genes.equals(self.genes):
+            # Mateixos gens: els fulls que no han canviat es reutilitzen ja alineats
+            for name, part in previous._aligned.items():
+                if name in self.metadata and previous.sheet_versions.get(name) == self.sheet_versions[name]:
+                    self._aligned[name] = part
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    @property
+    def sheets(self) -> list:
+        return list(self.metadata)
+
+    @property
+    def columns(self) -> list:
+        """
+        Totes les columnes de la taula unificada, en el mateix ordre.
+        """
+        return ["Gene"] + [col for meta in self.metadata.values() for col in meta["columns"]]
+
+    @property
+    def duplicate_genes(self) -> dict:
+        return {name: meta["duplicate_genes"] for name, meta in self.metadata.items() if meta["duplicate_genes"]}
+
+    def tag_values(self, tag_col: str) -> list:
+        """
+        Valors possibles d'una columna d'etiquetes (de les metadades, sense carregar el full).
+        """
+        for meta in self.metadata.values():
+            if tag_col in meta["tags"]:
+                return meta["tags"][tag_col]
+        return []
+
+    def loaded(self) -> list:
+        """
+        Fulls que ja s'han carregat en memòria.
+        """
+        return [name for name in self.metadata if name in self._aligned]
+
+    def memory_bytes(self) -> int:
+        return sum(int(part.memory_usage(index=False, deep=True).sum()) for part in list(self._aligned.values()))
+
+    def frame(self, datasets) -> pd.DataFrame:
+        """
+        Taula de treball: 'Gene' i les columnes dels datasets indicats (prefixos de columna,
+        vegeu schema.dataset_prefix), amb totes les files de la taula unificada.
+        Els fulls que encara no s'han fet servir es carreguen ara.
+        """
+        datasets = set(datasets)
+        names = tuple(
+            name for name, meta in self.metadata.items()
+            if any(dataset_prefix(col) in datasets for col in meta["columns"])
+        )
+        with self._lock:
+            df = self._frames.get(names)
+            if df is not None:
+                self._frames.move_to_end(names)
+                return df
+            self._load(names)
+            parts = [pd.DataFrame({"Gene": np.asarray(self.genes)})] + [self._aligned[name] for name in names]
+            df = pd.concat(parts, axis=1, copy=False)
+            df.attrs = {
+                "version": self.version,
+                "duplicate_genes": self.duplicate_genes,
+                "schema": {col: classify_column(col) for col in df.columns},
+                "sheet_versions": self.sheet_versions,
+            }
+            self._frames[names] = df
+            while len(self._frames) > MAX_FRAMES:
+                self._frames.popitem(last=False)
+        return df
+
+    def preload(self, sheets: list = None) -> list:
+        """
+        Carrega en memòria els fulls indicats (per defecte, tots) sense construir cap taula de
+        treball. Es carreguen d'un en un i el bloqueig s'allibera entre full i full, de manera que
+        una pàgina que necessita un altre dataset no espera que s'hagin carregat tots.
+        Retorna els fulls que s'han carregat ara.
+        """
+        loaded = []
+        for name in sheets or self.sheets:
+            with self._lock:
+                loaded.extend(self._load([name]))
+        return loaded
+
+    def _load(self, names) -> list:
+        # Cal tenir el bloqueig
+        missing = [name for name in names if name not in self._aligned]
+        if missing:
+            with stage("load_datasets", rows_in=len(missing)) as record:
+                blocks = sheet_blocks(self.file_path, self.duplicates, self.sheet_versions, self.cache_dir, missing)
+                for name, block in blocks.items():
+                    self._aligned[name] = block.reindex(self.genes).reset_index(drop=True)
+                record.rows_out = len(self.genes)
+        return missing
+
+    def tag_matrix(self) -> TagMatrix:
+        """
+        Matriu d'etiquetes de tots els datasets (vegeu tag_matrix.py). Es construeix el primer
+        cop que es demana llegint només les columnes d'etiquetes, sense carregar els fulls.
+        """
+        with self._lock:
+            if self._tag_matrix is None:
+                with stage("tag_matrix", rows_in=len(self.genes)):
+                    tag_columns = {}
+                    for name, meta in self.metadata.items():
+                        if not meta["tags"]:
+                            continue
+                        if name in self._aligned:
+                            part = self._aligned[name]
+                        else:
+                            part = sheet_columns(
+                                self.file_path, name, self.sheet_versions[name], list(meta["tags"]),
+                                self.duplicates, self.cache_dir,
+                            ).reindex(self.genes)
+                        tag_columns.update({col: part[col] for col in meta["tags"]})
+                    self._tag_matrix = build_tag_matrix(tag_columns, n_rows=len(self.genes))
+        return self._tag_matrix
+
+    def aliases(self) -> dict:
+        """
+        {àlies: gen} de les columnes d'identificadors de tots els fulls (vegeu
+        gene_index.table_aliases), llegint només aquestes columnes dels blocs.
+        """
+        aliases = {}
+        for name, meta in self.metadata.items():
+            id_cols = [col for col in meta["columns"] if any(sub in col.lower() for sub in ID_SUBSTRINGS)]
+            if not id_cols:
+                continue
+            part = sheet_columns(
+                self.file_path, name, self.sheet_versions[name], id_cols, self.duplicates, self.cache_dir
+            )
+            # Mateix ordre de files que la taula unificada (el primer gen d'un àlies repetit guanya)
+            part = part.reindex(self.genes).rename_axis("Gene").reset_index()
+            for alias, gene in table_aliases(part).items():
+                aliases.setdefault(alias, gene)
+        return aliases
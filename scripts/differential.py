@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from expression import ExpressionMatrix
+
+
+def differential_expression(matrix: ExpressionMatrix, first: str = "C", second: str = "P",
+                            samples=None, conditions: dict = None, log_scale: bool = False,
+                            pseudocount: float = 1.0) -> pd.DataFrame:
+    """
+    Recalcula l'expressió diferencial de tots els gens d'un full de comptatges alhora
+    (second respecte a first, p.ex. P vs C):
+
+    - logFC: diferència de mitjanes en escala log2 (log2(x + pseudocount), llevat que els
+      valors ja siguin logarítmics, `log_scale=True`, com a ProteiNs)
+    - t, pvalue: prova t de Welch (bilateral) sobre els mateixos valors log2
+    - FDR: Benjamini-Hochberg sobre els p-valors dels gens amb prou dades
+
+    Les condicions surten del sufix de cada mostra; es poden canviar amb `conditions`
+    ({mostra: condició}) i es pot limitar el càlcul a un subconjunt de mostres (`samples`).
+    Els gens amb menys de 2 valors en algun dels dos grups tenen NaN a t, pvalue i FDR (i no
+    compten en la correcció); el logFC es calcula sempre que cada grup tingui almenys un valor.
+    """
+    sample_conditions = np.array(
+        [conditions.get(s, c) if conditions else c for s, c in zip(matrix.samples, matrix.conditions)],
+        dtype=object,
+    )
+    selected = np.ones(len(matrix.samples), dtype=bool)
+    if samples is not None:
+        selected = np.isin(matrix.samples, list(samples))
+
+    values = np.asarray(matrix.values, dtype=np.float64)
+    if not log_scale:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.log2(values + pseudocount)
+
+    a = values[:, selected & (sample_conditions == first)]
+    b = values[:, selected & (sample_conditions == second)]
+    n_a, mean_a, var_a = _group_moments(a)
+    n_b, mean_b, var_b = _group_moments(b)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se_a, se_b = var_a / n_a, var_b / n_b
+        se = np.sqrt(se_a + se_b)
+        t = (mean_b - mean_a) / se
+        # Graus de llibertat de Welch-Satterthwaite
+        df = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+    enough = (n_a >= 2) & (n_b >= 2)
+    t[~enough] = np.nan
+    pvalue = np.where(enough, 2 * stats.t.sf(np.abs(t), df), np.nan)
+
+    return pd.DataFrame({
+        "Gene": matrix.genes,
+        "logFC": mean_b - mean_a,
+        "t": t,
+        "pvalue": pvalue,
+        "FDR": benjamini_hochberg(pvalue),
+        f"n_{first}": n_a,
+        f"n_{second}": n_b,
+        f"mean_{first}": mean_a,
+        f"mean_{second}": mean_b,
+    })
+
+
+def benjamini_hochberg(pvalues: np.ndarray) -> np.ndarray:
+    """
+    FDR de Benjamini-Hochberg. Els NaN es mantenen i no compten en el nombre de proves.
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    fdr = np.full(pvalues.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(pvalues))
+    if len(valid) == 0:
+        return fdr
+    order = valid[np.argsort(pvalues[valid], kind="stable")]
+    ranked = pvalues[order] * len(valid) / np.arange(1, len(valid) + 1)
+    # Mínim acumulat des del p-valor més gran cap al més petit
+    fdr[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return fdr
+
+
+def _group_moments(block: np.ndarray):
+    # Nombre de valors, mitjana i variància mostral (ddof=1) de cada fila, ignorant NaN
+    n = (~np.isnan(block)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(block, axis=1) / n
+        var = np.nansum((block - mean[:, None]) ** 2, axis=1) / (n - 1)
+    return n, mean, var
@@ -0,0 +1,130 @@
+import os
+import threading
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import data_cache
+
+
+def export_parquet(df: pd.DataFrame, version: str, cache_dir: str = None) -> str:
+    """
+    Desa la taula unificada en Parquet (un fitxer per versió de les dades) i en retorna la ruta.
+    Si ja existeix per a aquesta versió, no es torna a escriure.
+    """
+    cache_dir = cache_dir or data_cache.CACHE_DIR
+    prefix = data_cache.path_key("duckdb", "merged")
+    path = os.path.join(cache_dir, f"{prefix}-{data_cache.path_key(version)}.parquet")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        pq.write_table(data_cache.arrow_table(df), tmp_path)
+        os.replace(tmp_path, path)
+        data_cache.remove_stale(cache_dir, prefix, keep=path, suffix=".parquet")
+    return path
+
+
+class DuckDBBackend:
+    """
+    Filtratge de GEN Explorer amb DuckDB sobre un fitxer Parquet.
+
+    Les condicions de FilterSpec.conditions() es tradueixen a una sola consulta SQL:
+    els filtres s'apliquen dins la lectura del Parquet (predicate pushdown) i només es
+    llegeixen les columnes demanades. L'ordre de les files és el del fitxer, de manera que
+    el resultat coincideix amb el de filtering.evaluate + filtering.select.
+    """
+
+    def __init__(self, parquet_path: str, threads: int = None):
+        self.parquet_path = parquet_path
+        self._con = duckdb.connect()
+        if threads:
+            self._con.execute(f"SET threads = {int(threads)}")
+
+    def positions(self, conditions) -> np.ndarray:
+        """
+        Posicions (ordenades) de les files que compleixen les condicions.
+        """
+        where, params = self._where(conditions)
+        sql = f"SELECT file_row_number FROM {self._source()} {where} ORDER BY file_row_number"
+        cursor = self._con.cursor()
+        return cursor.execute(sql, [self.parquet_path] + params).fetchnumpy()["file_row_number"]
+
+    def count(self, conditions) -> tuple:
+        """
+        Retorna (nombre de files, nombre de gens diferents) que compleixen les condicions.
+        """
+        where, params = self._where(conditions)
+        sql = f'SELECT count(*), count(DISTINCT "Gene") FROM {self._source()} {where}'
+        cursor = self._con.cursor()
+        n_rows, n_genes = cursor.execute(sql, [self.parquet_path] + params).fetchone()
+        return n_rows, n_genes
+
+    def query(self, conditions, columns, sort_by: str = None, ascending: bool = True,
+              limit: int = None, offset: int = 0) -> pd.DataFrame:
+        """
+        Files que compleixen les condicions, amb només les columnes `columns`.
+        L'índex del resultat és la posició de cada fila a la taula unificada.
+
+        Opcionalment, les files s'ordenen per `sort_by` (nuls al final, empats en l'ordre
+        original) i només se'n retorna la finestra [offset, offset + limit).
+        """
+        projection = ", ".join(["file_row_number"] + [_quote(col) for col in columns])
+        where, params = self._where(conditions)
+        order = "file_row_number"
+        if sort_by:
+            direction = "ASC" if ascending else "DESC"
+            order = f"{_quote(sort_by)} {direction} NULLS LAST, file_row_number"
+        sql = f"SELECT {projection} FROM {self._source()} {where} ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        cursor = self._con.cursor()
+        df = cursor.execute(sql, [self.parquet_path] + params).df()
+        df = df.set_index("file_row_number")
+        df.index.name = None
+        return df
+
+    def iter_query(self, conditions, columns, chunk_rows: int = 50_000):
+        """
+        Com `query` (ordre original, totes les files), però retorna el resultat en blocs
+        de com a molt `chunk_rows` files, sense materialitzar-lo sencer.
+        """
+        projection = ", ".join(_quote(col) for col in columns)
+        where, params = self._where(conditions)
+        sql = f"SELECT {projection} FROM {self._source()} {where} ORDER BY file_row_number"
+        cursor = self._con.cursor()
+        reader = cursor.execute(sql, [self.parquet_path] + params).fetch_record_batch(chunk_rows)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def _source(self) -> str:
+        return "read_parquet(?, file_row_number = true)"
+
+    def _where(self, conditions):
+        clauses = []
+        params = []
+        for condition in conditions:
+            op = condition[0]
+            if op == "genes":
+                clauses.append('"Gene" IN (SELECT UNNEST(?::VARCHAR[]))')
+                params.append([str(gene) for gene in condition[1]])
+            elif op == "lt":
+                clauses.append(f"{_quote(condition[1])} < ?")
+                params.append(float(condition[2]))
+            elif op == "abs_ge":
+                clauses.append(f"abs({_quote(condition[1])}) >= ?")
+                params.append(float(condition[2]))
+            elif op == "in":
+                values = list(condition[2])
+                clauses.append(f"{_quote(condition[1])} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                raise ValueError(f"Condició desconeguda: {condition!r}")
+        if not clauses:
+            return "", params
+        return "WHERE " + " AND ".join(clauses), params
+
+
+def _quote(identifier: str) -> str:
+    return '"' + str(identifier).replace('"', '""') + '"'
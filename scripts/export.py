@@ -0,0 +1,176 @@
+import gzip
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import data_cache
+from filtering import select, spec_key
+
+# Format -> (extensió, tipus MIME)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "csv.gz": (".csv.gz", "application/gzip"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+# Formats per enviar un resultat per xarxa a mesura que es genera (vegeu `stream_bytes`)
+STREAM_FORMATS = {
+    "json": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Files per bloc en escriure (la memòria màxima depèn d'això, no de la mida del resultat)
+CHUNK_ROWS = 50_000
+
+# Nombre màxim d'exportacions que es conserven en disc
+MAX_EXPORT_FILES = 50
+
+
+def iter_chunks(df: pd.DataFrame, rows: np.ndarray, columns, chunk_rows: int = CHUNK_ROWS):
+    """
+    Genera el resultat filtrat (files `rows`, columnes `columns`) en blocs de `chunk_rows` files.
+    """
+    for start in range(0, len(rows), chunk_rows):
+        yield select(df, rows[start:start + chunk_rows], columns)
+
+
+def write_export(chunks, path: str, fmt: str):
+    """
+    Escriu els blocs (DataFrames amb les mateixes columnes) al fitxer `path` en el format `fmt`,
+    sense construir mai el fitxer sencer en memòria. L'escriptura és atòmica.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'exportació desconegut: {fmt!r}")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if fmt in ("csv", "csv.gz"):
+            opener = gzip.open if fmt == "csv.gz" else open
+            with opener(tmp_path, "wt", newline="", encoding="utf-8") as f:
+                for i, chunk in enumerate(chunks):
+                    chunk.to_csv(f, index=False, header=(i == 0))
+        else:
+            _write_arrow_chunks(chunks, tmp_path, fmt)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def stream_bytes(chunks, fmt: str):
+    """
+    Serialitza els blocs a mesura que arriben i en genera els bytes, sense tenir mai tot el
+    resultat en memòria: "json" (JSON Lines, un objecte per fila; els valors nuls com a null)
+    o "arrow" (format Arrow IPC stream, un record batch per bloc).
+    """
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Format desconegut: {fmt!r}")
+    if fmt == "json":
+        for chunk in chunks:
+            if len(chunk):
+                text = _as_text(chunk).to_json(orient="records", lines=True, force_ascii=False)
+                yield (text if text.endswith("\n") else text + "\n").encode("utf-8")
+        return
+
+    sink = io.BytesIO()
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            schema = _export_schema(chunk)
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(pa.Table.from_pandas(_as_text(chunk), schema=schema, preserve_index=False))
+        yield _drain(sink)
+    if writer is None:
+        # Resultat buit: un stream vàlid sense files
+        writer = pa.ipc.new_stream(sink, pa.schema([]))
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    # Bytes escrits fins ara; el buffer es buida per al bloc següent (cada missatge Arrow
+    # ocupa un múltiple de 8 bytes, de manera que l'alineació no canvia)
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def cached_export(version: str, conditions, columns, fmt: str, make_chunks, cache_dir: str = None) -> str:
+    """
+    Retorna la ruta del fitxer exportat per a aquesta versió de les dades, aquests filtres,
+    aquestes columnes i aquest format. Només s'escriu (amb `make_chunks()`) si encara no existeix;
+    les descàrregues repetides del mateix resultat no costen res.
+    """
+    cache_dir = cache_dir or data_cache.CACHE_DIR
+    exports_dir = os.path.join(cache_dir, "exports")
+    key = spec_key(conditions, f"{version}|{list(columns)}|{fmt}")
+    path = os.path.join(exports_dir, f"{key}{EXPORT_FORMATS[fmt][0]}")
+    if not os.path.exists(path):
+        write_export(make_chunks(), path, fmt)
+        prune_exports(exports_dir)
+    return path
+
+
+def prune_exports(exports_dir: str, max_files: int = MAX_EXPORT_FILES):
+    """
+    Conserva només les `max_files` exportacions més recents.
+    """
+    paths = [
+        os.path.join(exports_dir, name)
+        for name in os.listdir(exports_dir)
+        if not name.endswith(".tmp")
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[max_files:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _write_arrow_chunks(chunks, path: str, fmt: str):
+    writer = None
+    schema = None
+    try:
+        for chunk in chunks:
+            if schema is None:
+                schema = _export_schema(chunk)
+                writer = pq.ParquetWriter(path, schema) if fmt == "parquet" else pa.ipc.new_file(path, schema)
+            writer.write_table(pa.Table.from_pandas(_as_text(chunk), schema=schema, preserve_index=False))
+        if writer is None:
+            # Resultat buit: fitxer vàlid sense files
+            schema = pa.schema([])
+            writer = pq.ParquetWriter(path, schema) if fmt == "parquet" else pa.ipc.new_file(path, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _export_schema(chunk: pd.DataFrame) -> pa.Schema:
+    """
+    Esquema Arrow fix per a tots els blocs: les columnes de text (object) sempre com a string,
+    perquè un bloc amb tots els valors nuls no canviï el tipus de la columna.
+    """
+    schema = data_cache.arrow_table(chunk.iloc[:0]).schema.remove_metadata()
+    for i, col in enumerate(chunk.columns):
+        if chunk[col].dtype == object:
+            schema = schema.set(i, pa.field(str(col), pa.string()))
+    return schema
+
+
+def _as_text(chunk: pd.DataFrame) -> pd.DataFrame:
+    object_cols = [col for col in chunk.columns if chunk[col].dtype == object]
+    if not object_cols:
+        return chunk
+    chunk = chunk.copy()
+    for col in object_cols:
+        chunk[col] = chunk[col].where(chunk[col].isna(), chunk[col].astype(str))
+    return chunk
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# Estadístics precalculats per gen i condició (l'ordre és el de l'últim eix de ConditionStats.values).
+# Els quartils i les tanques (fences, els extrems dels bigotis) es calculen com Plotly
+# (quartilemethod "linear", vegeu `compute_condition_stats`).
+STAT_NAMES = ("n", "mean", "median", "q1", "q3", "min", "max", "lower_fence", "upper_fence")
+
+# S'ha d'incrementar quan canvia el càlcul dels estadístics, perquè els desats es tornin a calcular
+STATS_VERSION = 2
+
+# Condicions que es mostren primer (la resta, per ordre alfabètic)
+CONDITION_ORDER = ("C", "P")
+
+
+@dataclass
+class ConditionStats:
+    """
+    Estadístics de cada gen per condició, calculats per a tots els gens alhora.
+
+    - conditions: condicions (C, P, ...)
+    - values: float32 de forma (condicions, gens, len(STAT_NAMES)); NaN si la condició
+      no té cap valor per al gen
+    """
+    conditions: np.ndarray
+    values: np.ndarray
+
+    def stat(self, name: str, condition: str) -> np.ndarray:
+        """
+        Retorna un estadístic d'una condició per a tots els gens (en l'ordre de la matriu).
+        """
+        c = list(self.conditions).index(condition)
+        return self.values[c, :, STAT_NAMES.index(name)]
+
+
+@dataclass
+class ExpressionMatrix:
+    """
+    Matriu densa d'expressió d'un full de comptatges (gens x mostres).
+
+    - genes: nom de cada fila (un sol cop per gen)
+    - samples: nom de cada columna (mostra)
+    - conditions: condició de cada mostra (sufix després de l'últim '_', en majúscules: C, P...)
+    - values: float32, una fila per gen (si el gen era repetit, mitjana per mostra)
+    - index: {gen: fila}
+    """
+    genes: np.ndarray
+    samples: np.ndarray
+    conditions: np.ndarray
+    values: np.ndarray
+    index: dict
+    stats: ConditionStats = None
+
+    def row(self, gene: str):
+        """
+        Retorna la fila d'expressió d'un gen (vista, sense còpia) o None si el gen no hi és.
+        """
+        i = self.index.get(gene)
+        if i is None:
+            return None
+        return self.values[i]
+
+    def sample_means(self, gene: str):
+        """
+        Retorna un DataFrame (Sample, Condition, Expression) amb l'expressió de cada mostra
+        per al gen indicat, sense les mostres sense valor. Retorna None si el gen no hi és.
+        """
+        values = self.row(gene)
+        if values is None:
+            return None
+        valid = ~np.isnan(values)
+        return pd.DataFrame({
+            "Sample": self.samples[valid],
+            "Condition": self.conditions[valid],
+            "Expression": values[valid],
+        })
+
+    def condition_stats(self, gene: str):
+        """
+        Retorna un DataFrame (una fila per condició, columnes STAT_NAMES) amb els estadístics
+        precalculats del gen, o None si el gen no hi és o no hi ha estadístics.
+        """
+        i = self.index.get(gene)
+        if i is None or self.stats is None:
+            return None
+        table = pd.DataFrame(self.stats.values[:, i, :], columns=list(STAT_NAMES))
+        table.insert(0, "Condition", self.stats.conditions)
+        return table[table["n"] > 0].reset_index(drop=True)
+
+    def top_genes(self, n: int = 20, stat: str = "mean", first: str = "C", second: str = "P",
+                  absolute: bool = True) -> pd.DataFrame:
+        """
+        Els `n` gens amb més diferència de `stat` entre dues condicions (second - first),
+        a partir dels estadístics precalculats (sense recórrer les mostres).
+        """
+        a = self.stats.stat(stat, first).astype(np.float64)
+        b = self.stats.stat(stat, second).astype(np.float64)
+        diff = b - a
+        score = np.abs(diff) if absolute else diff
+        valid = np.flatnonzero(~np.isnan(score))
+        n = min(n, len(valid))
+        top = valid[np.argpartition(-score[valid], n - 1)[:n]] if n else valid[:0]
+        top = top[np.argsort(-score[top], kind="stable")]
+        return pd.DataFrame({
+            "Gene": self.genes[top],
+            f"{first}_{stat}": a[top],
+            f"{second}_{stat}": b[top],
+            "Diferència": diff[top],
+        })
+
+    @cached_property
+    def gene_lookup(self) -> pd.Index:
+        # Taula de hash gen -> fila, per resoldre moltes consultes alhora
+        return pd.Index(self.genes, dtype=object)
+
+    def positions(self, genes) -> np.ndarray:
+        """
+        Fila de cada gen indicat (-1 si no hi és), en un sol pas sobre la taula de hash.
+        """
+        return self.gene_lookup.get_indexer(list(genes))
+
+
+def condition_summary(matrices: dict, genes, datasets, stats=("n", "mean", "median")) -> pd.DataFrame:
+    """
+    Taula ampla amb una fila per gen i, per a cada dataset, els estadístics precalculats
+    `stats` de cada condició (columnes '<dataset>_<estadístic>_<condició>'), per a tota una
+    llista de gens alhora (`matrices`: {dataset: ExpressionMatrix o None}).
+    Els gens absents d'un dataset hi tenen NaN.
+    """
+    genes = list(genes)
+    table = {"Gene": genes}
+    for dataset in datasets:
+        matrix = matrices.get(dataset)
+        if matrix is None or matrix.stats is None:
+            continue
+        rows = matrix.positions(genes)
+        present = rows >= 0
+        for c, condition in enumerate(matrix.stats.conditions):
+            for name in stats:
+                values = np.full(len(genes), np.nan, dtype=np.float32)
+                values[present] = matrix.stats.values[c, rows[present], STAT_NAMES.index(name)]
+                table[f"{dataset}_{name}_{condition}"] = values
+    return pd.DataFrame(table)
+
+
+def compute_condition_stats(values: np.ndarray, conditions: np.ndarray) -> ConditionStats:
+    """
+    Calcula STAT_NAMES per a cada gen (fila de `values`) i condició, de manera vectoritzada.
+
+    Cada bloc de mostres d'una condició s'ordena un sol cop per files (els NaN queden al final);
+    els quartils, el mínim i el màxim surten de posicions de les files ordenades.
+
+    Els quartils i les tanques són els que calcula Plotly per defecte (plotly.js, box/calc.js),
+    perquè la caixa precalculada sigui la mateixa que dibuixaria amb els punts:
+    - el quantil p d'n valors és a la posició p·n - 0.5, interpolant linealment i limitada
+      al primer i l'últim valor (la mediana coincideix amb la de numpy, els quartils no);
+    - la tanca inferior és el valor més petit >= q1 - 1.5·IQR, però mai més gran que q1,
+      i la superior el valor més gran <= q3 + 1.5·IQR, però mai més petit que q3.
+    """
+    present = set(conditions)
+    labels = [c for c in CONDITION_ORDER if c in present] + sorted(present - set(CONDITION_ORDER))
+    out = np.full((len(labels), values.shape[0], len(STAT_NAMES)), np.nan, dtype=np.float32)
+    for c, label in enumerate(labels):
+        block = np.sort(np.asarray(values[:, conditions == label], dtype=np.float64), axis=1)
+        n = (~np.isnan(block)).sum(axis=1)
+        out[c, :, 0] = n
+        rows = np.flatnonzero(n > 0)
+        if len(rows) == 0:
+            continue
+        block, n = block[rows], n[rows]
+        q1, median, q3 = (_sorted_quantile(block, n, q) for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        with np.errstate(invalid="ignore"):
+            lower = np.nanmin(np.where(block >= (q1 - 1.5 * iqr)[:, None], block, np.nan), axis=1)
+            upper = np.nanmax(np.where(block <= (q3 + 1.5 * iqr)[:, None], block, np.nan), axis=1)
+        lower, upper = np.minimum(lower, q1), np.maximum(upper, q3)
+        out[c, rows, 1:] = np.column_stack([
+            np.nansum(block, axis=1) / n, median, q1, q3,
+            block[:, 0], block[np.arange(len(rows)), n - 1], lower, upper,
+        ])
+    return ConditionStats(conditions=np.array(labels, dtype=object), values=out)
+
+
+def _sorted_quantile(block: np.ndarray, n: np.ndarray, q: float) -> np.ndarray:
+    # Quantil de files ordenades amb `n` valors no nuls cadascuna, com Lib.interp de plotly.js
+    position = np.clip(q * n - 0.5, 0, n - 1)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, n - 1)
+    rows = np.arange(len(block))
+    low, high = block[rows, below], block[rows, above]
+    return low + (high - low) * (position - below)
+
+
+def sample_condition(sample) -> str:
+    """
+    Condició d'una mostra a partir del sufix del nom (p.ex. 'Pac3_P' -> 'P'), en majúscules
+    per evitar confusions p/P o c/C.
+    """
+    return str(sample).split("_")[-1].upper()
+
+
+def build_expression_matrix(df: pd.DataFrame):
+    """
+    Construeix l'ExpressionMatrix d'un full complet (columna 'Gene' + una columna per mostra).
+    Retorna None si el full no té la columna 'Gene'.
+
+    Els valors no numèrics passen a NaN. Els gens repetits es fusionen en una sola fila
+    amb la mitjana de cada mostra. Les mostres queden ordenades pel nom i les condicions
+    es calculen un sol cop per full.
+    """
+    if "Gene" not in df.columns:
+        return None
+
+    sample_cols = sorted((col for col in df.columns if col != "Gene"), key=str)
+    values = df[sample_cols].apply(pd.to_numeric, errors="coerce")
+    values.index = df["Gene"].astype(str)
+    if values.index.has_duplicates:
+        values = values.groupby(level=0, sort=False).mean()
+
+    genes = values.index.to_numpy(dtype=object)
+    samples = np.array([str(col) for col in sample_cols], dtype=object)
+    conditions = np.array([sample_condition(s) for s in samples], dtype=object)
+    values = np.ascontiguousarray(values.to_numpy(dtype=np.float32))
+    return ExpressionMatrix(
+        genes=genes,
+        samples=samples,
+        conditions=conditions,
+        values=values,
+        index={gene: i for i, gene in enumerate(genes)},
+        stats=compute_condition_stats(values, conditions),
+    )
+
+
+def save_expression_matrix(matrix: ExpressionMatrix, directory: str):
+    """
+    Desa la matriu en un directori: `values.npy` (float32, apte per a memory-map)
+    i `index.json` (gens i mostres). L'escriptura és atòmica: es prepara en un
+    directori temporal i després es renomena.
+    """
+    parent, name = os.path.split(directory)
+    tmp_dir = os.path.join(parent, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        np.save(os.path.join(tmp_dir, "values.npy"), matrix.values)
+        with open(os.path.join(tmp_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"genes": matrix.genes.tolist(), "samples": matrix.samples.tolist()}, f)
+        if matrix.stats is not None:
+            save_condition_stats(matrix.stats, tmp_dir)
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # Un altre procés l'ha desat abans: ens quedem amb la seva còpia
+            if not os.path.exists(os.path.join(directory, "index.json")):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def open_expression_matrix(directory: str) -> ExpressionMatrix:
+    """
+    Obre una matriu desada amb `save_expression_matrix`. Els valors es mapen en memòria
+    (només lectura), de manera que tots els processos comparteixen les mateixes pàgines.
+    """
+    with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    genes = np.array(index["genes"], dtype=object)
+    samples = np.array(index["samples"], dtype=object)
+    return ExpressionMatrix(
+        genes=genes,
+        samples=samples,
+        conditions=np.array([sample_condition(s) for s in samples], dtype=object),
+        values=np.load(os.path.join(directory, "values.npy"), mmap_mode="r"),
+        index={gene: i for i, gene in enumerate(genes)},
+        stats=open_condition_stats(directory),
+    )
+
+
+def save_condition_stats(stats: ConditionStats, directory: str):
+    """
+    Desa els estadístics (`stats.npy`, apte per a memory-map) i les seves etiquetes (`stats.json`)
+    al directori de la matriu. Primer s'escriu el .npy i després el .json, que és el que
+    indica que els estadístics hi són.
+    """
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    npy_path = os.path.join(directory, "stats.npy")
+    json_path = os.path.join(directory, "stats.json")
+    with open(npy_path + suffix, "wb") as f:
+        np.save(f, stats.values)
+    os.replace(npy_path + suffix, npy_path)
+    with open(json_path + suffix, "w", encoding="utf-8") as f:
+        json.dump({"conditions": stats.conditions.tolist(), "stats": list(STAT_NAMES), "version": STATS_VERSION}, f)
+    os.replace(json_path + suffix, json_path)
+
+
+def open_condition_stats(directory: str):
+    """
+    Obre (memory-map) els estadístics desats amb `save_condition_stats`.
+    Retorna None si no n'hi ha o si es van desar amb una altra llista d'estadístics o una altra
+    versió del càlcul (STATS_VERSION).
+    """
+    try:
+        with open(os.path.join(directory, "stats.json"), "r", encoding="utf-8") as f:
+            labels = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if labels.get("stats") != list(STAT_NAMES) or labels.get("version") != STATS_VERSION:
+        return None
+    return ConditionStats(
+        conditions=np.array(labels["conditions"], dtype=object),
+        values=np.load(os.path.join(directory, "stats.npy"), mmap_mode="r"),
+    )
+
+
+def cached_expression_matrix(file_path: str, sheet_name: str, read_sheet, cache_dir: str = None,
+                             version: str = None):
+    """
+    Retorna l'ExpressionMatrix d'un full (amb els estadístics per condició precalculats),
+    convertint-lo només la primera vegada.
+
+    La còpia en disc (`<cache>/counts/...`) s'identifica pel fitxer, el full i la versió:
+    `version` (p.ex. el hash del full, data_cache.sheet_versions) o, si no s'indica, el hash
+    del contingut del fitxer; `read_sheet(file_path, sheet_name)` només es crida quan
+    no existeix. Retorna None si el full no té la columna 'Gene'.
+    """
+    cache_dir = cache_dir or data_cache.CACHE_DIR
+    counts_dir = os.path.join(cache_dir, "counts")
+    prefix = data_cache.path_key(os.path.abspath(file_path), sheet_name)
+    version = version or data_cache.file_version(file_path, cache_dir)
+    directory = os.path.join(counts_dir, f"{prefix}-{version[:16]}")
+
+    with stage("npy_cache", cached=True) as record:
+        if os.path.exists(os.path.join(directory, "index.json")):
+            matrix = open_expression_matrix(directory)
+            if matrix.stats is None:
+                # Còpia sense estadístics (o d'una versió anterior del càlcul): es calculen i s'hi desen
+                matrix.stats = compute_condition_stats(matrix.values, matrix.conditions)
+                try:
+                    save_condition_stats(matrix.stats, directory)
+                except OSError as e:
+                    logger.warning("No s'han pogut desar els estadístics a %s: %s", directory, e)
+            record.rows_out = len(matrix.genes)
+            return matrix
+
+        record.cache = "miss"
+        matrix = build_expression_matrix(read_sheet(file_path, sheet_name))
+        if matrix is None:
+            return None
+        record.rows_out = len(matrix.genes)
+        try:
+            os.makedirs(counts_dir, exist_ok=True)
+            save_expression_matrix(matrix, directory)
+            data_cache.remove_stale(counts_dir, prefix, keep=directory, suffix="")
+        except OSError as e:
+            logger.warning("No s'ha pogut desar la matriu %s: %s", directory, e)
+            return matrix
+        # Es retorna la versió mapada perquè la matriu construïda en memòria es pugui alliberar
+        return open_expression_matrix(directory)
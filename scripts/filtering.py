@@ -0,0 +1,320 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from schema import ID_SUBSTRINGS, dataset_prefix, metric_kinds
+
+# Nombre màxim de files que es fan servir per estimar la selectivitat de cada condició
+SELECTIVITY_SAMPLE_SIZE = 1024
+
+
+@dataclass
+class FilterSpec:
+    """
+    Configuració de filtres de GEN Explorer (la mateixa que es construeix a la barra lateral).
+
+    - genes: gens seleccionats (buit = tots)
+    - p_value, fdr, logfc: llindars globals
+    - metrics: {dataset: [columnes pvalue/FDR/logFC seleccionades]}
+    - tags: {dataset: (columna_tag, [valors seleccionats])}
+    """
+    genes: list = field(default_factory=list)
+    p_value: float = 0.05
+    fdr: float = 0.05
+    logfc: float = 1.5
+    metrics: dict = field(default_factory=dict)
+    tags: dict = field(default_factory=dict)
+
+    def conditions(self) -> tuple:
+        """
+        Tradueix la configuració a una llista canònica (ordenada i sense repeticions)
+        de condicions atòmiques:
+          ("genes", (gens...))           -> Gene dins la llista
+          ("lt", columna, llindar)       -> valor no nul i < llindar (pvalue, FDR)
+          ("abs_ge", columna, llindar)   -> valor no nul i |valor| >= llindar (logFC)
+          ("in", columna, (valors...))   -> etiqueta dins la llista
+        """
+        conditions = set()
+        if self.genes:
+            conditions.add(("genes", tuple(sorted(set(self.genes)))))
+
+        thresholds = {"pvalue": ("lt", self.p_value), "fdr": ("lt", self.fdr), "logfc": ("abs_ge", self.logfc)}
+        for cols in self.metrics.values():
+            for col in cols:
+                for kind in metric_kinds(col):
+                    op, threshold = thresholds[kind]
+                    conditions.add((op, col, float(threshold)))
+
+        for tag_col, selected_tags in self.tags.values():
+            if selected_tags:
+                conditions.add(("in", tag_col, tuple(sorted(selected_tags))))
+
+        return tuple(sorted(conditions, key=repr))
+
+
+def evaluate(df: pd.DataFrame, conditions, rows: np.ndarray = None, gene_index=None, tag_matrix=None) -> np.ndarray:
+    """
+    Retorna les posicions (ordenades) de les files de `df` que compleixen totes les condicions.
+
+    Les condicions s'avaluen de la més selectiva a la menys selectiva, i cadascuna només
+    sobre les files que han superat les anteriors; si no en queda cap, s'atura.
+    Si es passa `rows`, només es consideren aquestes files (p.ex. un resultat ja filtrat).
+    Si es passa `gene_index` (GeneIndex construït sobre la columna 'Gene' de `df`), la llista
+    de gens es resol directament en posicions de files, sense recórrer tota la columna.
+    Si es passa `tag_matrix` (tag_matrix.TagMatrix de les mateixes files), els filtres
+    d'etiquetes es resolen amb els seus bitmaps i `df` no cal que en tingui les columnes.
+    """
+    gene_conditions = [c for c in conditions if c[0] == "genes"]
+    if gene_index is not None and gene_conditions:
+        for condition in gene_conditions:
+            positions = gene_index.positions(condition[1])
+            rows = positions if rows is None else np.intersect1d(rows, positions, assume_unique=True)
+        conditions = [c for c in conditions if c[0] != "genes"]
+    tag_conditions = [c for c in conditions if c[0] == "in" and tag_matrix is not None and c[1] in tag_matrix.columns]
+    if tag_conditions:
+        # Totes les etiquetes alhora: un AND de bitmaps sobre totes les files
+        include = {tag_matrix.dataset_of(col): values for _, col, values in tag_conditions}
+        rows = tag_matrix.positions(tag_matrix.query(include, rows=rows))
+        conditions = [c for c in conditions if c not in tag_conditions]
+    rows = np.arange(len(df)) if rows is None else rows
+    for condition in order_by_selectivity(df, conditions):
+        rows = rows[condition_mask(df, condition, rows)]
+        if len(rows) == 0:
+            break
+    return rows
+
+
+def order_by_selectivity(df: pd.DataFrame, conditions) -> list:
+    """
+    Ordena les condicions per la fracció estimada de files que les compleixen
+    (sobre una mostra equiespaiada de com a màxim SELECTIVITY_SAMPLE_SIZE files).
+    """
+    if len(conditions) < 2 or len(df) == 0:
+        return list(conditions)
+
+    step = max(1, len(df) // SELECTIVITY_SAMPLE_SIZE)
+    sample = np.arange(0, len(df), step)
+
+    def pass_fraction(condition):
+        if condition[0] == "genes":
+            return len(condition[1]) / len(df)
+        return condition_mask(df, condition, sample).mean()
+
+    return sorted(conditions, key=pass_fraction)
+
+
+def condition_mask(df: pd.DataFrame, condition, rows: np.ndarray) -> np.ndarray:
+    """
+    Avalua una condició atòmica sobre les files `rows` i retorna la màscara booleana.
+    """
+    op, col, value = condition if condition[0] != "genes" else ("genes", "Gene", condition[1])
+    series = df[col]
+
+    if op == "in" and isinstance(series.dtype, pd.CategoricalDtype):
+        # Comparació sobre els codis enters de la categoria, sense tocar el text
+        allowed = series.cat.categories.get_indexer(list(value))
+        codes = series.cat.codes.to_numpy()[rows]
+        return np.isin(codes, allowed[allowed >= 0])
+    if op in ("in", "genes"):
+        return series.iloc[rows].isin(value).to_numpy()
+
+    values = series.to_numpy()[rows]
+    value = np.float64(value)
+    # Les comparacions amb NaN sempre són falses: els valors nuls queden exclosos
+    with np.errstate(invalid="ignore"):
+        if op == "lt":
+            return values < value
+        if op == "abs_ge":
+            return np.abs(values) >= value
+    raise ValueError(f"Condició desconeguda: {condition!r}")
+
+
+def display_columns(columns, datasets_to_show, undesired_substrings=ID_SUBSTRINGS) -> list:
+    """
+    Columnes de la taula final: 'Gene' i les dels datasets seleccionats,
+    excepte les que contenen subcadenes no desitjades (identificadors).
+    """
+    cols_to_show = []
+    for col in columns:
+        # Comprovem que no conté subcadenes no desitjades
+        if any(sub in col.lower() for sub in undesired_substrings):
+            continue
+
+        # "Gene" la volem sempre
+        if col == "Gene":
+            cols_to_show.append(col)
+            continue
+
+        # Només incloem la columna si el prefix està entre els datasets seleccionats
+        if "_" in col and dataset_prefix(col) in datasets_to_show:
+            cols_to_show.append(col)
+    return cols_to_show
+
+
+def select(df: pd.DataFrame, rows: np.ndarray, columns) -> pd.DataFrame:
+    """
+    Materialitza el resultat: les files `rows` i les columnes `columns` en un sol pas.
+    """
+    return df.iloc[rows, df.columns.get_indexer(columns)]
+
+
+def sort_positions(df: pd.DataFrame, rows: np.ndarray, sort_by: str, ascending: bool = True) -> np.ndarray:
+    """
+    Reordena les posicions `rows` segons els valors de la columna `sort_by`
+    (ordenació estable, valors nuls al final).
+    """
+    values = df[sort_by].iloc[rows].reset_index(drop=True)
+    order = values.sort_values(ascending=ascending, na_position="last", kind="stable").index.to_numpy()
+    return rows[order]
+
+
+def spec_key(conditions, version: str = "") -> str:
+    """
+    Hash canònic d'un conjunt de condicions (vegeu FilterSpec.conditions) i de la versió de les dades.
+    """
+    return hashlib.sha1(repr((version, tuple(conditions))).encode("utf-8")).hexdigest()
+
+
+class FilterCache:
+    """
+    Memòria cau LRU dels resultats de filtratge, compartida entre sessions.
+
+    Només es guarden les posicions de les files (np.ndarray), identificades pel hash
+    canònic de les condicions i per la versió de les dades. Quan una consulta no hi és
+    però conté totes les condicions d'una consulta desada (p.ex. s'hi ha afegit un filtre),
+    es parteix del subconjunt desat més petit i només s'avaluen les condicions noves.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.sort_hits = 0
+        self.sort_misses = 0
+        self._entries = OrderedDict()  # key -> (version, frozenset(condicions), rows)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def rows(self, df: pd.DataFrame, conditions, version: str = "", gene_index=None, tag_matrix=None) -> np.ndarray:
+        """
+        Retorna (de la memòria cau si hi és) les posicions de les files que compleixen `conditions`.
+        `gene_index` i `tag_matrix` es passen a `evaluate` (vegeu-la).
+        """
+        key = spec_key(conditions, version)
+        wanted = frozenset(conditions)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            base = self._best_subset(version, wanted)
+
+        if base is None:
+            rows = evaluate(df, conditions, gene_index=gene_index, tag_matrix=tag_matrix)
+        else:
+            base_conditions, base_rows = base
+            rows = evaluate(
+                df, [c for c in conditions if c not in base_conditions], rows=base_rows,
+                gene_index=gene_index, tag_matrix=tag_matrix,
+            )
+        if len(df) < 2**31:
+            # Les posicions caben en int32: la meitat de memòria a la memòria cau
+            rows = rows.astype(np.int32)
+        rows.setflags(write=False)
+
+        with self._lock:
+            if base is None:
+                self.misses += 1
+            else:
+                self.partial_hits += 1
+            self._store(key, (version, wanted, rows))
+        return rows
+
+    def sorted_rows(self, df: pd.DataFrame, conditions, version: str = "", sort_by: str = None,
+                    ascending: bool = True, gene_index=None, tag_matrix=None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Com `rows`, però ordenades per la columna `sort_by` (valors nuls al final; en cas
+        d'empat es manté l'ordre original). L'ordenació també es desa a la memòria cau,
+        de manera que canviar de pàgina no torna a filtrar ni a ordenar.
+        Si es passa `rows` (el resultat ja filtrat de `conditions`, p.ex. pel backend DuckDB),
+        no es filtra.
+        """
+        if rows is None:
+            rows = self.rows(df, conditions, version, gene_index=gene_index, tag_matrix=tag_matrix)
+        if not sort_by:
+            return rows
+        return self.rows_for(
+            spec_key(conditions, f"{version}|sort={sort_by}|asc={ascending}"),
+            lambda: sort_positions(df, rows, sort_by, ascending),
+            sort=True,
+        )
+
+    def rows_for(self, key: str, compute, sort: bool = False) -> np.ndarray:
+        """
+        Retorna l'array desat amb la clau `key` o, si no hi és, el calcula amb `compute()` i el desa.
+        Amb `sort=True` (una ordenació, no un filtratge) compta als comptadors d'ordenacions.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if sort:
+                    self.sort_hits += 1
+                else:
+                    self.hits += 1
+                return entry[2]
+        rows = compute()
+        rows.setflags(write=False)
+        with self._lock:
+            if sort:
+                self.sort_misses += 1
+            else:
+                self.misses += 1
+            # Versió None: aquestes entrades no es fan servir com a punt de partida d'altres consultes
+            self._store(key, (None, frozenset(), rows))
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "sort_hits": self.sort_hits,
+                "sort_misses": self.sort_misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _best_subset(self, version: str, wanted: frozenset):
+        best = None
+        for entry_version, entry_conditions, entry_rows in self._entries.values():
+            if entry_version != version or not entry_conditions < wanted:
+                continue
+            if best is None or len(entry_rows) < len(best[1]):
+                best = (entry_conditions, entry_rows)
+        return best
+
+    def _store(self, key: str, entry: tuple):
+        size = entry[2].nbytes
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2].nbytes
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted_rows) = self._entries.popitem(last=False)
+            self._bytes -= evicted_rows.nbytes
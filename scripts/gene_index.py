@@ -0,0 +1,192 @@
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from schema import ID_SUBSTRINGS
+
+# Longitud dels n-grames de l'índex de subcadenes
+NGRAM = 3
+
+# Separadors acceptats en una llista de gens enganxada (salts de línia, comes, espais...)
+LIST_SEPARATORS = re.compile(r"[\s,;|]+")
+
+
+@dataclass
+class GeneIndex:
+    """
+    Índex de cerca de gens (sense distingir majúscules):
+
+    - genes: gens ordenats per `keys`
+    - keys: gens en majúscules, ordenats (cerca per prefix amb searchsorted)
+    - ngrams: {n-grama: posicions dins `keys`} per a la cerca de subcadenes
+    - aliases: {àlies en majúscules: gen} (identificadors, símbols alternatius...)
+    - lookup: taula de hash sobre `genes` (nom exacte -> posició dins `genes`)
+    - rows: posició de cada gen a la seqüència original (p.ex. fila de la taula unificada)
+    """
+    genes: np.ndarray
+    keys: np.ndarray
+    ngrams: dict = field(repr=False)
+    aliases: dict = field(default_factory=dict, repr=False)
+    lookup: pd.Index = field(default=None, repr=False)
+    rows: np.ndarray = field(default=None, repr=False)
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """
+        Com a molt `limit` gens per al text escrit: coincidència exacta, després els que
+        comencen pel text, els àlies que hi coincideixen i finalment els que el contenen.
+        """
+        query = query.strip().upper()
+        if not query:
+            return []
+        found = dict.fromkeys(self._prefix(query, limit))
+        if len(found) < limit:
+            alias = self.aliases.get(query)
+            if alias is not None:
+                found[alias] = None
+        if len(found) < limit:
+            for gene in self._substring(query, limit + len(found)):
+                found.setdefault(gene, None)
+                if len(found) >= limit:
+                    break
+        return list(found)[:limit]
+
+    def resolve(self, names) -> tuple:
+        """
+        Tradueix noms (gens o àlies, en qualsevol combinació de majúscules) a gens de l'índex.
+        Retorna (gens trobats, en l'ordre d'entrada i sense repeticions; noms desconeguts).
+        """
+        names = [str(name).strip() for name in names if str(name).strip()]
+        if not names or not len(self.keys):
+            return [], list(dict.fromkeys(names))
+        # Primer, tots els noms alhora contra la taula de hash (coincidència exacta)
+        positions = self.lookup.get_indexer(names)
+        resolved = np.where(positions >= 0, self.genes[positions], None)
+
+        # La resta: sense distingir majúscules (cerca binària sobre `keys`) o com a àlies
+        pending = np.flatnonzero(positions < 0)
+        if len(pending):
+            upper = np.array([names[i].upper() for i in pending], dtype=object)
+            candidates = np.searchsorted(self.keys, upper).clip(0, len(self.keys) - 1)
+            exact = self.keys[candidates] == upper
+            for i, key, candidate, is_gene in zip(pending, upper, candidates, exact):
+                resolved[i] = self.genes[candidate] if is_gene else self.aliases.get(key)
+
+        found, unknown = {}, {}
+        for name, gene in zip(names, resolved):
+            if gene is None:
+                unknown.setdefault(name, None)
+            else:
+                found.setdefault(gene, None)
+        return list(found), list(unknown)
+
+    def positions(self, genes) -> np.ndarray:
+        """
+        Posicions (ordenades i sense repeticions) a la seqüència original de tots els gens
+        indicats (noms exactes), en un sol pas sobre la taula de hash. Els desconeguts s'ignoren.
+        """
+        found = self.lookup.get_indexer(list(genes))
+        return np.unique(self.rows[found[found >= 0]])
+
+    def gene_rows(self, genes) -> np.ndarray:
+        """
+        Posició a la seqüència original de cada gen (noms exactes), en el mateix ordre;
+        -1 per als desconeguts.
+        """
+        found = self.lookup.get_indexer(list(genes))
+        return np.where(found >= 0, self.rows[found], -1)
+
+    def _prefix(self, query: str, limit: int) -> list:
+        start = np.searchsorted(self.keys, query, side="left")
+        end = np.searchsorted(self.keys, query + "\uffff", side="left")
+        matches = self.genes[start:min(end, start + limit)].tolist()
+        # La coincidència exacta, si n'hi ha, sempre surt primer
+        exact = [gene for gene in matches if gene.upper() == query]
+        return exact + [gene for gene in matches if gene.upper() != query]
+
+    def _substring(self, query: str, limit: int) -> list:
+        if len(query) < NGRAM:
+            return []
+        # Candidats: posicions que contenen tots els n-grames del text (intersecció de llistes)
+        postings = []
+        for gram in {query[i:i + NGRAM] for i in range(len(query) - NGRAM + 1)}:
+            positions = self.ngrams.get(gram)
+            if positions is None:
+                return []
+            postings.append(positions)
+        postings.sort(key=len)
+        candidates = postings[0]
+        for positions in postings[1:]:
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+            if not len(candidates):
+                return []
+        # Els n-grames no garanteixen l'ordre: es comprova la subcadena sencera
+        matches = []
+        for position in candidates:
+            if query in self.keys[position]:
+                matches.append(self.genes[position])
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+def build_gene_index(genes, aliases: dict = None) -> GeneIndex:
+    """
+    Construeix l'índex a partir d'una seqüència de gens (amb o sense repeticions, p.ex. la
+    columna 'Gene' de la taula unificada) i, opcionalment, d'un diccionari {àlies: gen}.
+    """
+    genes = pd.Series(list(genes), dtype=object)
+    genes = genes[genes.notna()].astype(str)
+    # Si un gen es repeteix, es queda la primera posició
+    genes = genes[~genes.duplicated()]
+    rows = np.asarray(genes.index, dtype=np.int64)
+    genes = genes.to_numpy(dtype=object)
+    keys = np.array([gene.upper() for gene in genes], dtype=object)
+    order = np.argsort(keys, kind="stable")
+    genes, keys, rows = genes[order], keys[order], rows[order]
+
+    ngrams = {}
+    for position, key in enumerate(keys):
+        for gram in {key[i:i + NGRAM] for i in range(len(key) - NGRAM + 1)}:
+            ngrams.setdefault(gram, []).append(position)
+    ngrams = {gram: np.array(positions, dtype=np.int32) for gram, positions in ngrams.items()}
+
+    gene_keys = set(keys.tolist())
+    alias_map = {}
+    for alias, gene in (aliases or {}).items():
+        alias = str(alias).strip().upper()
+        # Un àlies mai amaga un gen amb el mateix nom
+        if alias and alias not in gene_keys:
+            alias_map.setdefault(alias, str(gene))
+    return GeneIndex(
+        genes=genes, keys=keys, ngrams=ngrams, aliases=alias_map,
+        lookup=pd.Index(genes, dtype=object), rows=rows,
+    )
+
+
+def table_aliases(df: pd.DataFrame) -> dict:
+    """
+    {àlies: gen} a partir de les columnes d'identificadors de la taula unificada
+    (les que contenen ID_SUBSTRINGS, p.ex. '<full>_ensembl_id' o '<full>_symbol').
+    """
+    aliases = {}
+    genes = df["Gene"].astype(str).to_numpy()
+    for col in df.columns:
+        if col == "Gene" or not any(sub in col.lower() for sub in ID_SUBSTRINGS):
+            continue
+        values = df[col]
+        valid = values.notna().to_numpy()
+        for alias, gene in zip(values.to_numpy()[valid].astype(str), genes[valid]):
+            aliases.setdefault(alias, gene)
+    return aliases
+
+
+def split_gene_list(text: str) -> list:
+    """
+    Noms d'una llista enganxada (separats per salts de línia, comes, punts i coma o espais).
+    """
+    return [name for name in LIST_SEPARATORS.split(text or "") if name]
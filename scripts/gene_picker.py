@@ -0,0 +1,135 @@
+import io
+
+import pandas as pd
+import streamlit as st
+
+from gene_index import GeneIndex, split_gene_list
+
+# Modes de selecció de gens: cerca al multiselect o llista gran (fitxer o text enganxat)
+SELECTION_MODES = ["Cerca", "Llista de gens"]
+
+# Nombre màxim de coincidències que s'envien al navegador per a cada cerca
+MAX_MATCHES = 50
+
+# Nombre màxim de gens desconeguts que es mostren a l'avís
+MAX_UNKNOWN_SHOWN = 200
+
+
+def gene_selection(index: GeneIndex, label: str, key: str, container=st.sidebar) -> tuple:
+    """
+    Selecció de gens amb els dos modes (SELECTION_MODES). Retorna (gens, mode_llista).
+    """
+    mode = container.radio("Selecció de gens:", SELECTION_MODES, horizontal=True, key=f"{key}_mode")
+    if mode == SELECTION_MODES[1]:
+        return gene_list_input(index, key, container), True
+    return gene_selector(index, label, key, container), False
+
+
+def gene_selector(index: GeneIndex, label: str, key: str, container=st.sidebar) -> list:
+    """
+    Selector de gens basat en un GeneIndex: en lloc d'enviar tot l'univers de gens com a
+    opcions del multiselect, només s'hi envien els gens ja seleccionats i les primeres
+    coincidències (prefix, àlies o subcadena) del text cercat. També es pot enganxar una
+    llista de gens; els que no es troben es mostren tots junts en un sol avís.
+    Retorna la llista de gens seleccionats.
+    """
+    selected_key = f"{key}_genes"
+    selected = st.session_state.get(selected_key, [])
+
+    query = container.text_input(
+        "Cerca gens:", key=f"{key}_query", placeholder="Símbol, prefix o identificador",
+        help=f"{len(index):,} gens disponibles".replace(",", "."),
+    )
+    matches = index.search(query, MAX_MATCHES)
+    options = list(dict.fromkeys(list(selected) + matches))
+    # Sense `key`: les opcions canvien amb cada cerca i el widget es recrea amb la
+    # selecció desada com a valor per defecte
+    selected = container.multiselect(label, options, default=selected)
+    st.session_state[selected_key] = selected
+    if query and not matches:
+        container.caption(f"Cap gen coincideix amb «{query.strip()}».")
+
+    with container.expander("Enganxa una llista de gens"):
+        st.text_area("Gens (un per línia o separats per comes):", key=f"{key}_paste")
+        st.button("Afegeix a la selecció", key=f"{key}_add", on_click=_add_pasted, args=(index, key))
+        show_unknown(st.session_state.get(f"{key}_unknown"), st)
+    return selected
+
+
+def gene_list_input(index: GeneIndex, key: str, container=st.sidebar) -> list:
+    """
+    Llista gran de gens (centenars o milers), des d'un fitxer (.txt, .csv, .tsv) o enganxada.
+    Tots els noms es resolen alhora amb l'índex; els desconeguts es mostren en un sol avís
+    i es poden descarregar. Retorna els gens trobats, en l'ordre de la llista.
+    """
+    uploaded = container.file_uploader(
+        "Fitxer amb gens (.txt, .csv, .tsv):", type=["txt", "csv", "tsv"], key=f"{key}_file"
+    )
+    pasted = container.text_area("O enganxa la llista:", key=f"{key}_list", height=150)
+    names = read_gene_file(uploaded) if uploaded is not None else split_gene_list(pasted)
+    if not names:
+        container.info("Carrega o enganxa una llista de gens.")
+        return []
+
+    genes, unknown = index.resolve(names)
+    container.caption(f"{len(genes):,} gens trobats (de {len(names):,} noms)".replace(",", "."))
+    if unknown:
+        show_unknown(unknown, container)
+        container.download_button(
+            "Descarregar els gens no trobats",
+            data="\n".join(unknown),
+            file_name="gens_no_trobats.txt",
+            mime="text/plain",
+            key=f"{key}_unknown_download",
+        )
+    return genes
+
+
+def read_gene_file(uploaded) -> list:
+    """
+    Noms de gens d'un fitxer carregat. En un CSV/TSV es fa servir la columna amb capçalera
+    'Gene' (o 'Symbol') si n'hi ha; si no, la primera columna. Un .txt es llegeix com
+    una llista enganxada.
+
+    El separador surt de l'extensió (tabulador per a .tsv; coma o, si a la primera línia n'hi ha
+    més, punt i coma per a .csv) i no es dedueix del contingut: en un fitxer d'una sola columna
+    es prendria una lletra per separador.
+    """
+    text = uploaded.getvalue().decode("utf-8-sig", errors="replace")
+    if not uploaded.name.lower().endswith((".csv", ".tsv")):
+        return split_gene_list(text)
+    if uploaded.name.lower().endswith(".tsv"):
+        sep = "\t"
+    else:
+        first_line = text.split("\n", 1)[0]
+        sep = ";" if first_line.count(";") > first_line.count(",") else ","
+    try:
+        table = pd.read_csv(io.StringIO(text), sep=sep, header=None, dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        return []
+    header = [value.strip().lower() for value in table.iloc[0]]
+    column = table.iloc[:, 0]
+    for name in ("gene", "symbol"):
+        if name in header:
+            column = table.iloc[1:, header.index(name)]
+            break
+    return [value.strip() for value in column if value.strip()]
+
+
+def show_unknown(unknown, container=st.sidebar):
+    """
+    Un sol avís amb tots els noms que no s'han trobat (com a molt MAX_UNKNOWN_SHOWN).
+    """
+    if not unknown:
+        return
+    shown = ", ".join(unknown[:MAX_UNKNOWN_SHOWN])
+    more = f" i {len(unknown) - MAX_UNKNOWN_SHOWN} més" if len(unknown) > MAX_UNKNOWN_SHOWN else ""
+    container.warning(f"{len(unknown)} gens no s'han trobat: {shown}{more}")
+
+
+def _add_pasted(index: GeneIndex, key: str):
+    # S'executa abans de tornar a dibuixar la pàgina (el multiselect ja surt amb els gens afegits)
+    found, unknown = index.resolve(split_gene_list(st.session_state.get(f"{key}_paste", "")))
+    current = st.session_state.get(f"{key}_genes", [])
+    st.session_state[f"{key}_genes"] = list(dict.fromkeys(list(current) + found))
+    st.session_state[f"{key}_unknown"] = unknown
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+import psutil
+
+# Registre estructurat: una línia JSON per etapa. No es propaga al registre general
+# (per no barrejar-lo amb els missatges de l'aplicació); s'hi ha d'afegir un handler
+logger = logging.getLogger("geneanalysis.stages")
+logger.propagate = False
+
+# Si està definida, les etapes s'escriuen (JSON Lines) en aquest fitxer
+STAGE_LOG = os.environ.get("GENEANALYSIS_STAGE_LOG")
+
+_process = psutil.Process()
+_local = threading.local()
+
+
+@dataclass
+class StageRecord:
+    """
+    Mesura d'una etapa:
+
+    - stage: nom de l'etapa
+    - depth: nivell d'imbricació (0 = etapa de primer nivell)
+    - seconds: temps de rellotge
+    - rows_in, rows_out: files d'entrada i de sortida (si s'han indicat)
+    - memory_bytes: increment de memòria durant l'etapa (memòria assignada segons tracemalloc
+      si està actiu; si no, variació de la memòria resident del procés)
+    - cache: "hit", "miss" o "partial" per a les etapes amb memòria cau
+    """
+    stage: str
+    depth: int = 0
+    seconds: float = 0.0
+    rows_in: int = None
+    rows_out: int = None
+    memory_bytes: int = None
+    cache: str = None
+    started_at: float = field(default_factory=time.time)
+
+
+class StageRun:
+    """
+    Etapes d'una execució (p.ex. una execució d'una pàgina de Streamlit), en ordre d'inici.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+
+    def total_seconds(self) -> float:
+        return sum(record.seconds for record in self.records if record.depth == 0)
+
+    def to_dicts(self) -> list:
+        return [{"run": self.name, "run_id": self.run_id, **asdict(record)} for record in self.records]
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dicts(), indent=2)
+
+
+def current_run():
+    """
+    Execució activa en aquest fil (o None).
+    """
+    return getattr(_local, "run", None)
+
+
+@contextmanager
+def stage_run(name: str):
+    """
+    Agrupa les etapes executades dins del bloc (en aquest fil) en un StageRun.
+    """
+    previous = current_run()
+    run = StageRun(name)
+    _local.run = run
+    try:
+        yield run
+    finally:
+        _local.run = previous
+
+
+@contextmanager
+def stage(name: str, rows_in: int = None, cached: bool = False):
+    """
+    Mesura una etapa. Dins del bloc es poden indicar `rows_out` i `cache` al registre retornat.
+
+    Amb `cached=True` l'etapa es considera un encert de memòria cau llevat que el codi
+    cachejat (que només s'executa quan no hi és) cridi `mark_cache_miss()`.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    record = StageRecord(stage=name, depth=len(stack), rows_in=rows_in, cache="hit" if cached else None)
+    run = current_run()
+    if run is not None:
+        run.records.append(record)
+
+    tracing = tracemalloc.is_tracing()
+    memory_before = tracemalloc.get_traced_memory()[0] if tracing else _process.memory_info().rss
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        stack.pop()
+        memory_after = tracemalloc.get_traced_memory()[0] if tracing else _process.memory_info().rss
+        record.memory_bytes = memory_after - memory_before
+        if logger.handlers and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                "run": run.name if run else None,
+                "run_id": run.run_id if run else None,
+                **asdict(record),
+            }))
+
+
+def mark_cache_miss():
+    """
+    Marca com a fallada de memòria cau l'etapa `cached=True` més interna en curs.
+    Es crida des del cos d'una funció cachejada (p.ex. amb st.cache_data).
+    """
+    for record in reversed(getattr(_local, "stack", [])):
+        if record.cache is not None:
+            record.cache = "miss"
+            return
+
+
+def _configure_stage_log():
+    if not STAGE_LOG or any(getattr(h, "_geneanalysis_stage_log", False) for h in logger.handlers):
+        return
+    os.makedirs(os.path.dirname(STAGE_LOG) or ".", exist_ok=True)
+    handler = logging.FileHandler(STAGE_LOG, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._geneanalysis_stage_log = True
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+_configure_stage_log()
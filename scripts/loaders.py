@@ -0,0 +1,353 @@
+import logging
+import os
+from functools import partial
+
+import pandas as pd
+
+import data_cache
+from data_cache import (
+    arrow_safe, cached_frame, file_version, path_key, read_frame, read_frame_schema, remove_stale, sheet_versions,
+    write_frame,
+)
+from instrumentation import stage
+from schema import TAG_SUFFIXES, apply_schema, classify_column
+
+logger = logging.getLogger(__name__)
+
+# S'ha d'incrementar quan canvia la manera de construir la taula unificada,
+# perquè les còpies Arrow antigues deixin de ser vàlides
+MERGED_CACHE_VERSION = 5
+
+# El mateix per als blocs per full (vegeu `sheet_blocks`)
+SHEET_CACHE_VERSION = 3
+
+# Maneres de tractar els gens repetits dins d'un mateix full:
+#   first: es conserva la primera fila de cada gen
+#   aggregate: columnes numèriques -> mitjana, la resta -> primer valor no nul
+#   error: es llança un ValueError
+DUPLICATE_POLICIES = ("first", "aggregate", "error")
+
+
+def read_merged_workbook(file_path: str, duplicates: str = "first") -> pd.DataFrame:
+    """
+    Llegeix un Excel amb múltiples fulls (decimal=',') i uneix totes les dades
+    en un únic DataFrame (outer join) per la columna 'Gene'.
+    La columna 'Gene' es manté sense renombrar; totes les altres columnes es renomenen amb el prefix del full.
+    Les columnes es converteixen al seu tipus definitiu (vegeu schema.apply_schema).
+    """
+    with stage("read_excel") as record:
+        sheets = pd.read_excel(file_path, sheet_name=None, decimal=",")
+        record.rows_out = sum(len(df_sheet) for df_sheet in sheets.values())
+    with stage("merge_on_gene", rows_in=record.rows_out) as record:
+        merged_df = merge_on_gene(sheets, duplicates=duplicates)
+        record.rows_out = 0 if merged_df is None else len(merged_df)
+    if merged_df is None:
+        return None
+    with stage("apply_schema", rows_in=len(merged_df)) as record:
+        merged_df = apply_schema(merged_df)
+        record.rows_out = len(merged_df)
+    return merged_df
+
+
+def merge_on_gene(sheets: dict, duplicates: str = "first") -> pd.DataFrame:
+    """
+    Uneix (outer join per 'Gene') tots els fulls en una sola passada.
+
+    En lloc d'encadenar pd.merge (que copia la taula creixent a cada pas), es construeix
+    un únic índex global de gens i cada full s'hi alinea una sola vegada.
+    Els gens repetits dins d'un full es tracten segons `duplicates` (vegeu DUPLICATE_POLICIES)
+    i es llisten a `df.attrs["duplicate_genes"]` ({nom_full: [gens]}).
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"Política de duplicats desconeguda: {duplicates!r}")
+
+    blocks = {}
+    for sheet_name, df_sheet in sheets.items():
+        block = sheet_block(sheet_name, df_sheet, duplicates)
+        if block is not None:
+            blocks[sheet_name] = block
+    if not blocks:
+        return None
+    merged_df = align_blocks(list(blocks.values()), gene_union(block.index for block in blocks.values()))
+    merged_df.attrs["duplicate_genes"] = duplicate_report(blocks)
+    return merged_df
+
+
+def sheet_block(sheet_name: str, df_sheet: pd.DataFrame, duplicates: str = "first") -> pd.DataFrame:
+    """
+    Prepara un full per a la unió: columnes amb el prefix del full, una sola fila per gen
+    (segons `duplicates`) i 'Gene' com a índex. Els gens repetits queden a
+    `block.attrs["duplicate_genes"]`. Retorna None si el full és buit.
+    """
+    if df_sheet.empty:
+        return None
+    if "Gene" not in df_sheet.columns:
+        raise ValueError(f"El full '{sheet_name}' no té la columna 'Gene'.")
+
+    # Renombrar totes les columnes excepte 'Gene'
+    rename_map = {
+        col: f"{sheet_name}_{col}"
+        for col in df_sheet.columns
+        if col != "Gene"
+    }
+    df_sheet = df_sheet.rename(columns=rename_map)
+
+    repeated = find_duplicate_genes(df_sheet)
+    if repeated:
+        df_sheet = drop_duplicate_genes(df_sheet, duplicates, sheet_name)
+
+    block = df_sheet.set_index("Gene")
+    block.attrs["duplicate_genes"] = repeated
+    return block
+
+
+def gene_union(indexes) -> pd.Index:
+    """
+    Índex global: unió dels gens de tots els blocs (els seus índexs), ordenada com ho faria
+    pd.merge(how="outer").
+    """
+    indexes = list(indexes)
+    gene_index = indexes[0]
+    for index in indexes[1:]:
+        gene_index = gene_index.union(index, sort=False)
+    try:
+        gene_index = gene_index.sort_values()
+    except TypeError:
+        # Tipus barrejats (p.ex. text i números): es manté l'ordre d'aparició
+        pass
+    return gene_index
+
+
+def align_blocks(blocks: list, gene_index: pd.Index) -> pd.DataFrame:
+    """
+    Alinea cada bloc a l'índex global (una sola vegada) i els uneix en una taula amb columna 'Gene'.
+    """
+    merged_df = pd.concat([block.reindex(gene_index) for block in blocks], axis=1)
+    merged_df.index.name = "Gene"
+    return merged_df.reset_index()
+
+
+def duplicate_report(blocks: dict) -> dict:
+    return {name: block.attrs["duplicate_genes"] for name, block in blocks.items() if block.attrs.get("duplicate_genes")}
+
+
+def find_duplicate_genes(df_sheet: pd.DataFrame) -> list:
+    """
+    Retorna la llista (ordenada, com a text) dels gens que apareixen més d'una vegada.
+    """
+    repeated = df_sheet.loc[df_sheet["Gene"].duplicated(), "Gene"].unique()
+    return sorted(str(gene) for gene in repeated)
+
+
+def drop_duplicate_genes(df_sheet: pd.DataFrame, duplicates: str, sheet_name: str = "") -> pd.DataFrame:
+    """
+    Deixa una sola fila per gen segons la política `duplicates`.
+    """
+    if duplicates == "error":
+        repeated = find_duplicate_genes(df_sheet)
+        raise ValueError(
+            f"El full '{sheet_name}' té {len(repeated)} gens duplicats: {', '.join(repeated[:10])}"
+            + ("..." if len(repeated) > 10 else "")
+        )
+    if duplicates == "first":
+        return df_sheet[~df_sheet["Gene"].duplicated(keep="first")]
+
+    if df_sheet.columns.tolist() == ["Gene"]:
+        return df_sheet.drop_duplicates()
+
+    aggregations = {
+        col: "mean" if pd.api.types.is_numeric_dtype(df_sheet[col]) else "first"
+        for col in df_sheet.columns
+        if col != "Gene"
+    }
+    return df_sheet.groupby("Gene", sort=False, dropna=False).agg(aggregations).reset_index()
+
+
+def sheet_blocks(file_path: str, duplicates: str = "first", versions: dict = None, cache_dir: str = None,
+                 sheet_names: list = None) -> dict:
+    """
+    Blocs (vegeu `sheet_block`, ja amb els tipus definitius) de tots els fulls, en l'ordre del llibre
+    (o només dels fulls `sheet_names`).
+
+    Cada bloc es desa en disc (Arrow) identificat pel hash de contingut del seu full
+    (data_cache.sheet_versions): quan l'Excel canvia, només es tornen a llegir els fulls
+    que han canviat. Els fulls buits hi són com a blocs sense files. A més dels gens repetits,
+    els attrs del bloc porten el vocabulari de cada columna d'etiquetes (`attrs["tags"]`).
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"Política de duplicats desconeguda: {duplicates!r}")
+    cache_dir = cache_dir or data_cache.CACHE_DIR
+    versions = versions or sheet_versions(file_path, cache_dir)
+    wanted = list(versions) if sheet_names is None else [name for name in versions if name in set(sheet_names)]
+
+    blocks, missing = {}, []
+    for sheet_name in wanted:
+        try:
+            block = read_frame(sheet_block_path(file_path, sheet_name, versions[sheet_name], duplicates, cache_dir))
+            blocks[sheet_name] = block.set_index("Gene")
+            blocks[sheet_name].attrs = block.attrs
+        except (OSError, ValueError, KeyError):
+            missing.append(sheet_name)
+
+    if missing:
+        with stage("read_excel") as record:
+            sheets = pd.read_excel(file_path, sheet_name=missing, decimal=",")
+            record.rows_out = sum(len(df_sheet) for df_sheet in sheets.values())
+        with stage("apply_schema", rows_in=record.rows_out):
+            for sheet_name in missing:
+                block = sheet_block(sheet_name, sheets[sheet_name], duplicates)
+                if block is None:
+                    block = pd.DataFrame(index=pd.Index([], name="Gene"))
+                    block.attrs["duplicate_genes"] = []
+                repeated = block.attrs["duplicate_genes"]
+                block = arrow_safe(apply_schema(block.reset_index()))
+                block.attrs = {"duplicate_genes": repeated, "tags": tag_vocabularies(block)}
+                path = sheet_block_path(file_path, sheet_name, versions[sheet_name], duplicates, cache_dir)
+                try:
+                    write_frame(block, path)
+                    remove_stale(os.path.dirname(path), os.path.basename(path).rsplit("-", 1)[0], keep=path)
+                except OSError as e:
+                    logger.warning("No s'ha pogut desar el bloc %s: %s", path, e)
+                blocks[sheet_name] = block.set_index("Gene")
+                blocks[sheet_name].attrs = block.attrs
+    return {sheet_name: blocks[sheet_name] for sheet_name in wanted}
+
+
+def sheet_block_path(file_path: str, sheet_name: str, digest: str, duplicates: str = "first",
+                     cache_dir: str = None) -> str:
+    """
+    Ruta del bloc Arrow d'un full (per a una versió del full i una política de duplicats).
+    """
+    prefix = path_key(os.path.abspath(file_path), f"{sheet_name}|v{SHEET_CACHE_VERSION}-{duplicates}")
+    return os.path.join(cache_dir or data_cache.CACHE_DIR, "sheets", f"{prefix}-{digest[:16]}.arrow")
+
+
+def tag_vocabularies(block: pd.DataFrame) -> dict:
+    """
+    {columna d'etiquetes: valors possibles, ordenats} d'un bloc.
+    """
+    return {
+        col: sorted(block[col].cat.categories.tolist())
+        for col in block.columns
+        if str(col).endswith(TAG_SUFFIXES) and block[col].dtype == "category"
+    }
+
+
+def read_full_sheet(file_path: str, sheet_name: str) -> pd.DataFrame:
+    """
+    Llegeix un full complet d'un Excel (totes les columnes, decimal=',').
+    La columna 'Gene' (si existeix) es retorna com a text.
+    """
+    with stage("load_full_sheet") as record:
+        df = pd.read_excel(file_path, sheet_name=sheet_name, decimal=",")
+        if "Gene" in df.columns:
+            df["Gene"] = df["Gene"].astype(str)
+        record.rows_out = len(df)
+    return df
+
+
+def sheet_metadata(file_path: str, duplicates: str = "first", versions: dict = None, cache_dir: str = None) -> dict:
+    """
+    Metadades de cada full, sense carregar-ne les dades: {full: {"columns": [...] (sense 'Gene'),
+    "duplicate_genes": [...], "tags": {columna: valors}}}.
+
+    Es llegeixen de l'esquema dels blocs Arrow; els fulls que encara no en tenen (o que han
+    canviat) es llegeixen de l'Excel un sol cop per construir-los.
+    """
+    versions = versions or sheet_versions(file_path, cache_dir)
+    metadata, missing = {}, []
+    for sheet_name, digest in versions.items():
+        try:
+            columns, attrs = read_frame_schema(sheet_block_path(file_path, sheet_name, digest, duplicates, cache_dir))
+            metadata[sheet_name] = _block_metadata([col for col in columns if col != "Gene"], attrs)
+        except (OSError, ValueError, KeyError):
+            missing.append(sheet_name)
+    if missing:
+        for sheet_name, block in sheet_blocks(file_path, duplicates, versions, cache_dir, missing).items():
+            metadata[sheet_name] = _block_metadata(list(block.columns), block.attrs)
+    return {sheet_name: metadata[sheet_name] for sheet_name in versions}
+
+
+def _block_metadata(columns: list, attrs: dict) -> dict:
+    return {
+        "columns": columns,
+        "duplicate_genes": attrs.get("duplicate_genes", []),
+        "tags": attrs.get("tags", {}),
+    }
+
+
+def sheet_columns(file_path: str, sheet_name: str, digest: str, columns: list, duplicates: str = "first",
+                  cache_dir: str = None) -> pd.DataFrame:
+    """
+    Només algunes columnes (p.ex. 'Gene' o els identificadors) del bloc d'un full, amb 'Gene'
+    com a índex. Si el bloc no és en disc, es reconstrueix.
+    """
+    columns = list(dict.fromkeys(["Gene"] + list(columns)))
+    try:
+        block = read_frame(sheet_block_path(file_path, sheet_name, digest, duplicates, cache_dir), columns=columns)
+        return block.set_index("Gene")
+    except (OSError, ValueError, KeyError):
+        block = sheet_blocks(file_path, duplicates, {sheet_name: digest}, cache_dir)[sheet_name]
+        return block[[col for col in columns if col != "Gene"]]
+
+
+def read_merged_sheets(file_path: str, duplicates: str = "first", previous: pd.DataFrame = None,
+                       cache_dir: str = None) -> pd.DataFrame:
+    """
+    Mateix resultat que `read_merged_workbook`, però construït a partir dels blocs per full
+    (`sheet_blocks`): només es llegeixen de l'Excel els fulls que han canviat.
+
+    Si es passa la taula unificada anterior (`previous`) i el conjunt de gens no ha canviat,
+    es reutilitzen les seves columnes i només es substitueixen les dels fulls modificats.
+    Els hashos dels fulls es desen a `df.attrs["sheet_versions"]`.
+    """
+    versions = sheet_versions(file_path, cache_dir)
+    blocks = sheet_blocks(file_path, duplicates, versions, cache_dir)
+    blocks = {name: block for name, block in blocks.items() if len(block) or len(block.columns)}
+    if not blocks:
+        return None
+
+    with stage("merge_on_gene", rows_in=sum(len(block) for block in blocks.values())) as record:
+        gene_index = gene_union(block.index for block in blocks.values())
+        old_versions = previous.attrs.get("sheet_versions") if previous is not None else None
+        if (
+            old_versions is not None
+            and list(old_versions) == list(versions)
+            and previous["Gene"].equals(pd.Series(gene_index, name="Gene"))
+        ):
+            # Mateixos fulls i mateixos gens: només es tornen a alinear els fulls canviats
+            changed = {name for name in versions if old_versions[name] != versions[name]}
+            parts = [previous[["Gene"]]]
+            for name, block in blocks.items():
+                if name in changed:
+                    parts.append(block.reindex(gene_index).reset_index(drop=True))
+                else:
+                    parts.append(previous[list(block.columns)])
+            merged_df = pd.concat(parts, axis=1)
+        else:
+            merged_df = align_blocks(list(blocks.values()), gene_index)
+        record.rows_out = len(merged_df)
+
+    merged_df.attrs["duplicate_genes"] = duplicate_report(blocks)
+    merged_df.attrs["schema"] = {col: classify_column(col) for col in merged_df.columns}
+    merged_df.attrs["sheet_versions"] = versions
+    return merged_df
+
+
+def load_merged_workbook(file_path: str, duplicates: str = "first", previous: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Igual que `read_merged_workbook`, però reutilitzant la còpia Arrow en disc
+    mentre el fitxer Excel no canviï (sobreviu a reinicis i es comparteix entre rèpliques).
+    Quan canvia, només es tornen a llegir els fulls modificats (vegeu `read_merged_sheets`).
+    A `df.attrs["version"]` s'hi desa un identificador del contingut del fitxer.
+    """
+    variant = f"merged-v{MERGED_CACHE_VERSION}-{duplicates}"
+    merged_df = cached_frame(
+        file_path,
+        partial(read_merged_sheets, duplicates=duplicates, previous=previous),
+        variant=variant,
+    )
+    if merged_df is not None:
+        # Identificador de la versió de les dades (per a memòries cau de resultats derivats)
+        merged_df.attrs["version"] = f"{file_version(file_path)[:16]}-{variant}"
+    return merged_df
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+# Tipus de columna mètrica i subcadena (en minúscules) que la identifica al nom
+METRIC_KINDS = ("pvalue", "fdr", "logfc")
+
+# Totes les mètriques es guarden en float64: les p-values i FDR poden ser molt petites, i
+# un logFC en float32 (2.3 -> 2.2999999523) deixaria de complir |logFC| >= 2.3
+METRIC_DTYPES = {"pvalue": np.float64, "fdr": np.float64, "logfc": np.float64}
+
+# Columnes d'etiqueta: <dataset>_genes_tag, o ProteiNs_expr_pval_Patient_Ctrl per a proteïnes
+TAG_SUFFIXES = ("_genes_tag", "_expr_pval_Patient_Ctrl")
+
+# Columnes identificadores (no es mostren a la taula principal)
+ID_SUBSTRINGS = ("id", "symbol")
+
+
+def dataset_prefix(col: str) -> str:
+    """
+    Retorna el nom del dataset (full) d'una columna: el prefix abans del primer '_'.
+    """
+    return col.split("_")[0]
+
+
+def tag_column(sheet_name: str) -> str:
+    """
+    Retorna el nom de la columna d'etiquetes d'un dataset.
+    """
+    if sheet_name == "ProteiNs":
+        return f"{sheet_name}_expr_pval_Patient_Ctrl"
+    return f"{sheet_name}_genes_tag"
+
+
+def metric_kinds(col: str) -> list:
+    """
+    Retorna els tipus de mètrica (pvalue, fdr, logfc) que conté el nom de la columna.
+    """
+    lower = col.lower()
+    return [kind for kind in METRIC_KINDS if kind in lower]
+
+
+def classify_column(col: str) -> str:
+    """
+    Classifica una columna de la taula unificada com a 'id', 'tag', 'metric' o 'text'.
+    """
+    if col == "Gene":
+        return "id"
+    if col.endswith(TAG_SUFFIXES):
+        return "tag"
+    if metric_kinds(col):
+        return "metric"
+    if any(sub in col.lower() for sub in ID_SUBSTRINGS):
+        return "id"
+    return "text"
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converteix les columnes al seu tipus definitiu un sol cop, en carregar les dades:
+      - Mètriques (pvalue, FDR, logFC): float (les comes decimals es converteixen a punts;
+        els valors no numèrics passen a NaN).
+      - Etiquetes (*_genes_tag, *_expr_pval_Patient_Ctrl): pandas Categorical.
+      - 'id' i 'text': es deixen tal qual.
+    La classificació es desa a `df.attrs["schema"]` ({columna: tipus}).
+    """
+    schema = {col: classify_column(col) for col in df.columns}
+    typed = {}
+    for col, kind in schema.items():
+        if kind == "metric":
+            typed[col] = to_float(df[col], METRIC_DTYPES[metric_kinds(col)[0]])
+        elif kind == "tag":
+            typed[col] = df[col].astype("category")
+
+    df = df.assign(**typed)
+    df.attrs["schema"] = schema
+    return df
+
+
+def to_float(series: pd.Series, dtype=np.float64) -> pd.Series:
+    """
+    Converteix una columna a float acceptant comes com a separador decimal.
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(
+            series.astype(str).str.replace(",", ".", regex=False),
+            errors="coerce"
+        )
+    return series.astype(dtype)
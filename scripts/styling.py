@@ -1,122 +1,114 @@
-def highlight_all_datasets(row):
+import numpy as np
+import pandas as pd
+
+from schema import dataset_prefix, tag_column
+
+# Colors de fons segons l'etiqueta del gen a cada dataset
+DEG_TAG_COLORS = {
+    "NOT_DEG": "#edede9",        # gris clar
+    "POSSIBLE_DEG": "#fffacd",   # groc clar
+    "PREVALENT_DEG": "#e1f7d5",  # verd clar
+}
+PROTEIN_TAG_COLORS = {
+    "up": "#e1f7d5",    # verd clar
+    "down": "#fffacd",  # groc clar
+}
+
+
+def highlight_all_datasets(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Aplica estils a les cel·les d'un DataFrame per a streamlit.
+    Retorna els estils CSS de totes les cel·les d'un DataFrame per a streamlit.
+    S'aplica amb `df.style.apply(highlight_all_datasets, axis=None)`.
 
     - Per a la majoria dels datasets, s'utilitza la columna <dataset>_genes_tag amb:
          NOT_DEG: gris clar (#edede9)
          POSSIBLE_DEG: groc clar (#fffacd)
          PREVALENT_DEG: verd clar (#e1f7d5)
-    
+
     - Per al dataset ProteiNs, s'utilitza la columna ProteiNs_expr_pval_Patient_Ctrl amb:
          up: verd clar (#e1f7d5)
          down: groc clar (#fffacd)
-    
+
     - A més, per a les columnes que continguin "logFCs" al nom:
          Si el valor és superior a 0, el text es mostrarà en verd.
          Si el valor és inferior a 0, el text es mostrarà en vermell.
          Es manté també el color de fons calculat segons el dataset.
+
+    Els colors es calculen per columnes senceres: una sola consulta per dataset
+    (compartida per totes les seves columnes) i el signe dels logFCs amb np.sign.
     """
-    styles = []
-    for col in row.index:
+    styles = np.full(df.shape, "", dtype=object)
+    background_by_prefix = {}
+
+    for j, col in enumerate(df.columns):
         if col == "Gene":
             # No s'aplica estil a la columna 'Gene'
-            styles.append("")
-        elif "logFCs" in col:
-            # Per a les columnes amb 'logFCs': assignem estil tant per al text com per al fons
-            # Estil per al text segons el valor numèric
-            try:
-                value = float(row[col])
-                if value > 0:
-                    text_style = "color: green"
-                elif value < 0:
-                    text_style = "color: red"
-                else:
-                    text_style = ""
-            except (ValueError, TypeError):
-                text_style = ""
-            # Estil per al fons si la columna segueix el patró amb "_"
-            if "_" in col:
-                prefix = col.split("_")[0]
-                if prefix == "ProteiNs":
-                    tag_val = row.get("ProteiNs_expr_pval_Patient_Ctrl", None)
-                    if tag_val == "up":
-                        bg_color = "#e1f7d5"  # verd clar
-                    elif tag_val == "down":
-                        bg_color = "#fffacd"  # groc clar
-                    else:
-                        bg_color = ""
-                else:
-                    tag_val = row.get(f"{prefix}_genes_tag", None)
-                    if tag_val == "NOT_DEG":
-                        bg_color = "#edede9"  # gris clar
-                    elif tag_val == "POSSIBLE_DEG":
-                        bg_color = "#fffacd"  # groc clar
-                    elif tag_val == "PREVALENT_DEG":
-                        bg_color = "#e1f7d5"  # verd clar
-                    else:
-                        bg_color = ""
-            else:
-                bg_color = ""
+            continue
+
+        if "_" in col:
+            prefix = dataset_prefix(col)
+            if prefix not in background_by_prefix:
+                background_by_prefix[prefix] = _background_css(df, prefix)
+            background = background_by_prefix[prefix]
+        else:
+            background = np.full(len(df), "", dtype=object)
+
+        if "logFCs" in col:
+            # Color del text segons el signe del valor (els no numèrics no tenen color)
+            values = pd.to_numeric(df.iloc[:, j], errors="coerce").to_numpy(dtype=float)
+            sign = np.sign(values)
+            text = np.select([sign > 0, sign < 0], ["color: green", "color: red"], "").astype(object)
             # Combina els estils si n'hi ha de fons i de text
-            if bg_color and text_style:
-                combined_style = f"background-color: {bg_color}; {text_style}"
-            elif bg_color:
-                combined_style = f"background-color: {bg_color}"
-            elif text_style:
-                combined_style = text_style
-            else:
-                combined_style = ""
-            styles.append(combined_style)
-        elif "_" in col:
-            # Aplica estil de fons segons el dataset
-            prefix = col.split("_")[0]
-            if prefix == "ProteiNs":
-                tag_val = row.get("ProteiNs_expr_pval_Patient_Ctrl", None)
-                if tag_val == "up":
-                    color = "#e1f7d5"  # verd clar
-                elif tag_val == "down":
-                    color = "#fffacd"  # groc clar
-                else:
-                    color = ""
-            else:
-                tag_val = row.get(f"{prefix}_genes_tag", None)
-                if tag_val == "NOT_DEG":
-                    color = "#edede9"  # gris clar
-                elif tag_val == "POSSIBLE_DEG":
-                    color = "#fffacd"  # groc clar
-                elif tag_val == "PREVALENT_DEG":
-                    color = "#e1f7d5"  # verd clar
-                else:
-                    color = ""
-            styles.append(f"background-color: {color}" if color else "")
+            styles[:, j] = np.where(
+                background == "",
+                text,
+                np.where(text == "", background, background + "; " + text),
+            )
         else:
-            styles.append("")
-    return styles
+            styles[:, j] = background
+
+    return pd.DataFrame(styles, index=df.index, columns=df.columns)
+
 
 # Funció per aplicar l'estil de fons (només color, sense text) a la matriu
-def highlight_matrix(row):
-    styles = []
-    for col in row.index:
+def highlight_matrix(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Retorna els estils CSS de la matriu de colors (una columna d'etiquetes per dataset).
+    S'aplica amb `df.style.apply(highlight_matrix, axis=None)`.
+    """
+    styles = np.full(df.shape, "", dtype=object)
+    for j, col in enumerate(df.columns):
         if col == "Gene":
-            styles.append("")  # La columna 'Gene' es deixa sense estil
-        else:
-            val = row[col]
-            color = ""
-            if col == "ProteiNs":
-                if val == "up":
-                    color = "#e1f7d5"  # verd clar
-                elif val == "down":
-                    color = "#fffacd"  # groc clar
-            else:
-                if val == "NOT_DEG":
-                    color = "#edede9"  # gris clar
-                elif val == "POSSIBLE_DEG":
-                    color = "#fffacd"  # groc clar
-                elif val == "PREVALENT_DEG":
-                    color = "#e1f7d5"  # verd clar
-            if color:
-                # Es mostra només el color de fons (el text es fa transparent)
-                styles.append(f"background-color: {color}; color: transparent")
-            else:
-                styles.append("")
-    return styles
+            continue  # La columna 'Gene' es deixa sense estil
+        palette = PROTEIN_TAG_COLORS if col == "ProteiNs" else DEG_TAG_COLORS
+        colors = _lookup_colors(df.iloc[:, j], palette)
+        # Es mostra només el color de fons (el text es fa transparent)
+        styles[:, j] = np.where(colors == "", "", "background-color: " + colors + "; color: transparent")
+    return pd.DataFrame(styles, index=df.index, columns=df.columns)
+
+
+def _background_css(df: pd.DataFrame, prefix: str) -> np.ndarray:
+    """
+    Estil de fons ('background-color: ...' o '') de cada fila per a les columnes d'un dataset.
+    """
+    tag_col = tag_column(prefix)
+    if tag_col not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    palette = PROTEIN_TAG_COLORS if prefix == "ProteiNs" else DEG_TAG_COLORS
+    colors = _lookup_colors(df[tag_col], palette)
+    return np.where(colors == "", "", "background-color: " + colors).astype(object)
+
+
+def _lookup_colors(tags: pd.Series, palette: dict) -> np.ndarray:
+    """
+    Color de cada valor d'etiqueta segons `palette` ('' si no hi és).
+    Per a columnes categòriques només es consulten les categories, i després els codis.
+    """
+    if isinstance(tags.dtype, pd.CategoricalDtype):
+        category_colors = np.array(
+            [palette.get(category, "") for category in tags.cat.categories] + [""],
+            dtype=object,
+        )
+        # El codi -1 (valor nul) apunta a l'últim element: ''
+        return category_colors[tags.cat.codes.to_numpy()]
+    return tags.map(palette).fillna("").to_numpy(dtype=object)
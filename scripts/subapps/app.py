@@ -1,6 +1,19 @@
+import os
+import time
+import warnings
+
 import pandas as pd
 import streamlit as st
 from styling import highlight_all_datasets, highlight_matrix  # Importem la funció d'estil
+from watcher import DataSnapshot, DataStore
+from warmup import EXPLORER_FILE, explorer_gene_index, explorer_store
+from warmup_panel import wait_for
+from filtering import FilterCache, FilterSpec, display_columns, select, spec_key
+from export import EXPORT_FORMATS, cached_export, iter_chunks
+from schema import dataset_prefix, tag_column
+from datasets import DatasetCatalogue
+from gene_picker import gene_selection
+from instrumentation import mark_cache_miss, stage
 
 st.markdown("""
     <style>
@@ -12,67 +25,206 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
-def load_and_merge_data(file_path: str) -> pd.DataFrame:
+@st.cache_resource
+def get_data_store(file_path: str, duplicates: str = "first") -> DataStore:
     """
-    Llegeix un Excel amb múltiples fulls (decimal=',') i uneix totes les dades
-    en un únic DataFrame (outer join) per la columna 'Gene'.
+    Taula unificada d'un Excel amb múltiples fulls (decimal=','): outer join per la columna 'Gene'.
     La columna 'Gene' es manté sense renombrar; totes les altres columnes es renomenen amb el prefix del full.
+    Els gens repetits dins d'un full es tracten segons `duplicates` ("first", "aggregate" o "error").
+    Només se'n llegeixen les metadades; les columnes de cada full es carreguen quan un filtre o la
+    taula les necessita (vegeu datasets.py). El fitxer es vigila en segon pla: quan canvia, només
+    es tornen a llegir els fulls modificats i la nova versió substitueix l'anterior (vegeu watcher.py).
+    És la mateixa que carrega l'escalfament en segon pla (vegeu warmup.py); si encara no ha
+    acabat, s'espera, i si havia fallat, es torna a provar.
     """
-    sheets = pd.read_excel(file_path, sheet_name=None, decimal=",")
-    merged_df = None
-
-    for sheet_name, df_sheet in sheets.items():
-        if df_sheet.empty:
-            continue
-        df_sheet = df_sheet.copy()
-
-        # Renombrar totes les columnes excepte 'Gene'
-        rename_map = {
-            col: f"{sheet_name}_{col}"
-            for col in df_sheet.columns
-            if col != "Gene"
-        }
-        df_sheet = df_sheet.rename(columns=rename_map)
+    mark_cache_miss()
+    return explorer_store(file_path, duplicates, retry=True).result()
+
+def session_snapshot(store: DataStore) -> DataSnapshot:
+    """
+    Versió de les dades d'aquesta sessió. Es manté fixa encara que arribi una versió nova del
+    fitxer (filtres, pàgines i descàrregues es refereixen sempre a les mateixes dades) fins
+    que l'usuari decideix carregar-la.
+    """
+    latest = store.current
+    pinned = st.session_state.get("data_snapshot")
+    if pinned is None:
+        st.session_state["data_snapshot"] = latest
+        return latest
+    if pinned.version != latest.version:
+        loaded = time.strftime("%H:%M:%S", time.localtime(latest.loaded_at))
+        st.sidebar.info(f"Hi ha una versió nova de les dades (carregada a les {loaded}).")
+        if st.sidebar.button("Carrega la versió nova"):
+            st.session_state["data_snapshot"] = latest
+            st.rerun()
+    return pinned
+
+# Nombre màxim de combinacions de datasets que es dibuixen al gràfic d'interseccions
+MAX_UPSET_BARS = 20
+
+# Motor de filtratge: "pandas" (per defecte) o "duckdb" (consulta SQL sobre Parquet)
+QUERY_BACKEND = os.environ.get("GENEANALYSIS_BACKEND", "pandas")
+
+@st.cache_resource(max_entries=4)
+def get_duckdb_backend(version: str, _table: DatasetCatalogue):
+    """
+    Motor DuckDB per a una versió de les dades: la taula unificada (tots els datasets) es construeix
+    i es desa en Parquet un sol cop per versió, no a cada execució de l'script.
+    """
+    from duckdb_backend import DuckDBBackend, export_parquet
+    datasets = {dataset_prefix(col) for col in _table.columns if "_" in col}
+    return DuckDBBackend(export_parquet(_table.frame(datasets), version))
+
+@st.cache_resource
+def get_filter_cache() -> FilterCache:
+    """
+    Memòria cau de resultats de filtratge (posicions de files), compartida per totes les sessions.
+    """
+    return FilterCache(max_bytes=64 * 2**20)
+
+@st.cache_resource(max_entries=4)
+def get_gene_index(version: str, _table: DatasetCatalogue):
+    """
+    Índex de cerca de gens (prefix, subcadena i àlies de les columnes d'identificadors)
+    per a una versió de les dades. Es construeix un sol cop (en segon pla, vegeu warmup.py)
+    i es comparteix entre sessions. Les posicions de l'índex són les files de la taula unificada.
+    """
+    return explorer_gene_index(_table, retry=True).result()
+
+def _filter_cache_outcome(before: dict, after: dict) -> str:
+    """
+    Resultat ("hit", "partial" o "miss") d'una consulta a la FilterCache segons els comptadors.
+    """
+    if after["hits"] > before["hits"]:
+        return "hit"
+    if after["partial_hits"] > before["partial_hits"]:
+        return "partial"
+    return "miss"
+
+def show_set_tags(df_merged, conditions, datasets, data_version, export_format, num_rows, tag_matrix, rows,
+                  backend=None):
+    """
+    Recompte d'etiquetes per dataset de tot el conjunt filtrat (de la matriu d'etiquetes) i
+    descàrrega de la matriu d'etiquetes (Gene + una columna per dataset) en el format triat.
+    """
+    st.write("---")
+    st.markdown("### Etiquetes de tot el conjunt")
+    tag_cols = [tag_column(ds) for ds in datasets if tag_column(ds) in tag_matrix.columns]
+    if not tag_cols:
+        st.write("Els datasets seleccionats no tenen columna d'etiquetes.")
+        return
 
-        # Primera fulla: la prenem tal qual, després fem el merge per 'Gene'
-        if merged_df is None:
-            merged_df = df_sheet
+    def make_chunks():
+        if backend is not None:
+            chunks = backend.iter_query(conditions, ["Gene"] + tag_cols)
         else:
-            merged_df = pd.merge(
-                merged_df,
-                df_sheet,
-                on="Gene",
-                how="outer"
+            chunks = iter_chunks(df_merged, rows, ["Gene"] + tag_cols)
+        # Mateixos noms de columna que la matriu de colors (el prefix del dataset)
+        return (chunk.rename(columns=dataset_prefix) for chunk in chunks)
+
+    with stage("tag_counts", rows_in=num_rows) as record:
+        counts = tag_matrix.counts(rows, tag_cols)
+        record.rows_out = len(counts)
+    st.dataframe(counts, use_container_width=True)
+
+    extension, mime = EXPORT_FORMATS[export_format]
+    tags_key = f"tags_{spec_key(conditions, f'{data_version}|{tag_cols}|{export_format}')}"
+    if st.button("Preparar matriu d'etiquetes", key=f"prepare_{tags_key}"):
+        with st.spinner("Preparant el fitxer..."), stage("export_tag_matrix", rows_in=num_rows):
+            st.session_state[tags_key] = cached_export(
+                f"{data_version}|tag_matrix", conditions, tag_cols, export_format, make_chunks
+            )
+    tags_path = st.session_state.get(tags_key)
+    if tags_path and os.path.exists(tags_path):
+        with open(tags_path, "rb") as f:
+            st.download_button(
+                label=f"Descarregar matriu d'etiquetes ({export_format})",
+                data=f,
+                file_name=f"matriu_etiquetes{extension}",
+                mime=mime,
             )
 
-    return merged_df
+def show_tag_intersections(tag_matrix, tag_cols, rows):
+    """
+    Interseccions d'una etiqueta entre datasets (estil UpSet) de tot el conjunt filtrat,
+    comptades sobre la matriu d'etiquetes sense construir cap taula.
+    """
+    st.write("---")
+    st.markdown("### Interseccions d'etiquetes entre datasets")
+    tags = sorted({tag for col in tag_cols for tag in tag_matrix.column_tags[col]})
+    if len(tag_cols) < 2 or not tags:
+        st.write("Cal mostrar almenys dos datasets amb columna d'etiquetes.")
+        return
+    tag = st.selectbox(
+        "Etiqueta:", tags, index=tags.index("PREVALENT_DEG") if "PREVALENT_DEG" in tags else 0, key="upset_tag"
+    )
+    with stage("tag_intersections", rows_in=len(rows)) as record:
+        intersections = tag_matrix.intersections(tag, tag_cols, rows)
+        record.rows_out = len(intersections)
+    if intersections.empty:
+        st.write(f"Cap gen filtrat té l'etiqueta {tag} en aquests datasets.")
+        return
+
+    col_plot, col_table = st.columns([3, 2])
+    col_table.dataframe(
+        pd.DataFrame({
+            "Datasets": [
+                " ∩ ".join(ds for ds, member in zip(intersections.index.names, combination) if member)
+                for combination in intersections.index
+            ],
+            "Gens": intersections.to_numpy(),
+        }),
+        hide_index=True,
+        use_container_width=True,
+    )
+    import matplotlib.pyplot as plt
+    from upsetplot import UpSet
+    fig = plt.figure(figsize=(8, 4))
+    with warnings.catch_warnings():
+        # UpSetPlot 0.9 fa servir operacions de pandas obsoletes (avisos sense efecte)
+        warnings.simplefilter("ignore", FutureWarning)
+        UpSet(intersections.head(MAX_UPSET_BARS), sort_by="cardinality", show_counts=True).plot(fig=fig)
+    col_plot.pyplot(fig)
+    plt.close(fig)
 
 def main():
-    rows_to_show = 200
+    rows_to_show = 200  # Mida de pàgina per defecte
+    page_sizes = [50, 100, 200, 500, 1000]
     undesired_substrings = ["id", "symbol"]
+    duplicate_policy = "first"  # Gens repetits dins d'un full: "first", "aggregate" o "error"
     
     st.title("GEN Explorer")
     
-    # 1) Carregar el DataFrame unificat (cachejat)
-    file_path = "data/Gene_data_20250312.xlsx"
-    df_merged = load_and_merge_data(file_path)
-    
-    # Verifiquem que existeix la columna 'Gene'
-    if "Gene" not in df_merged.columns:
-        st.error("No s'ha trobat la columna 'Gene'. Comprova que existeixi a totes les fulles.")
+    # 1) Catàleg de la taula unificada (cachejat): de moment només metadades i gens
+    #    Mentre es carrega en segon pla, la pàgina no es bloqueja: es torna a executar quan és a punt
+    file_path = EXPLORER_FILE
+    if wait_for([explorer_store(file_path, duplicate_policy)], "S'estan carregant les dades de GEN Explorer..."):
+        return
+    try:
+        with stage("load_and_merge_data", cached=True) as record:
+            table = session_snapshot(get_data_store(file_path, duplicates=duplicate_policy)).table
+            record.rows_out = len(table)
+    except ValueError as e:
+        st.error(str(e))
         st.stop()
+
+    # Avís si algun full tenia gens repetits (només se n'ha conservat una fila per gen)
+    duplicate_genes = table.duplicate_genes
+    if duplicate_genes:
+        resum = ", ".join(f"{full} ({len(gens)})" for full, gens in duplicate_genes.items())
+        with st.expander(f"⚠️ Gens duplicats dins dels fulls: {resum}"):
+            for full, gens in duplicate_genes.items():
+                st.write(f"**{full}**: {', '.join(gens)}")
     
     # Exemple de filtres: barra lateral per seleccionar gens
     st.sidebar.header("Configuració de filtres")
     
     st.sidebar.subheader("Filtrar Gens")
-    unique_genes = sorted(df_merged["Gene"].dropna().unique().tolist())
-    selected_genes = st.sidebar.multiselect(
-        "Selecciona un o varis Gens:",
-        unique_genes,
-        default=[]
-    )
+    data_version = table.version
+    with stage("gene_index", rows_in=len(table)):
+        gene_index = get_gene_index(data_version, table)
+    selected_genes, list_mode = gene_selection(gene_index, "Selecciona un o varis Gens:", key="explorer_genes")
+    tag_matrix = table.tag_matrix()
     
     # Definir el nombre màxim de decimals permesos
     decimals = 4
@@ -102,13 +254,22 @@ def main():
     st.sidebar.header("Configuració per Dataset")
     
     # 3) Detectar possibles fulles (prefixos) a partir de les columnes (excepte 'Gene')
-    all_columns = df_merged.columns.tolist()
+    all_columns = table.columns
     possible_sheets = set()
     for col in all_columns:
         if "_" in col:
             sheet_prefix = col.split("_")[0]
             possible_sheets.add(sheet_prefix)
     possible_sheets = sorted(list(possible_sheets))
+
+    # --- Selecció de quins datasets volem mostrar ---
+    # (es demana abans dels filtres: decideix quins fulls cal carregar)
+    st.write("---")
+    datasets_to_show = st.multiselect(
+        "Selecciona datasets a mostrar:",
+        possible_sheets,
+        default=possible_sheets,  # Per defecte, tots seleccionats
+    )
     
     # Diccionaris per guardar configuracions per cada dataset
     pvalue_config = {}      # {sheet_name: [llista de columnes pvalue seleccionades]}
@@ -145,7 +306,7 @@ def main():
             else:
                 tag_col = f"{sheet_name}_genes_tag"
             if tag_col in all_columns:
-                unique_tags = sorted(df_merged[tag_col].dropna().unique().tolist())
+                unique_tags = table.tag_values(tag_col)
                 selected_tags = st.multiselect(
                     f"Filtra per {tag_col}:",
                     unique_tags,
@@ -155,97 +316,100 @@ def main():
             else:
                 st.write(f"No s'ha trobat la columna de filtre per {sheet_name}.")
     
-    # 4) Aplicar els filtres
-    df_final = df_merged.copy()
-    
-    # Filtrar per 'Gene'
-    if selected_genes:
-        df_final = df_final[df_final["Gene"].isin(selected_genes)]
-    
-    # Filtrar per cada dataset: pvalue i tag
-    for sheet_name in possible_sheets:
-        # Filtrar per pvalue
-        if sheet_name in pvalue_config:
-            pvalue_cols = [c for c in pvalue_config[sheet_name] if "pvalue" in c.lower()]
-            fdr_cols = [c for c in pvalue_config[sheet_name] if "fdr" in c.lower()]
-            # Filtrar columnas de p-value con el umbral correspondiente
-            for col in pvalue_cols:
-                df_final[col] = pd.to_numeric(
-                    df_final[col].astype(str).str.replace(",", ".", regex=False),
-                    errors='coerce'
-                )
-                df_final = df_final[df_final[col].notna() & (df_final[col] < global_p_value)]
-            
-            # Filtrar columnas de FDR con el umbral correspondiente
-            for col in fdr_cols:
-                df_final[col] = pd.to_numeric(
-                    df_final[col].astype(str).str.replace(",", ".", regex=False),
-                    errors='coerce'
-                )
-                df_final = df_final[df_final[col].notna() & (df_final[col] < global_fdr)]
-            
-            # Filtrar per logFC: s'eliminen les files on el valor absolut és inferior al umbral global_logfc
-            logfc_cols = [c for c in pvalue_config[sheet_name] if "logfc" in c.lower()]
-            for col in logfc_cols:
-                df_final[col] = pd.to_numeric(
-                    df_final[col].astype(str).str.replace(",", ".", regex=False),
-                    errors='coerce'
-                )
-                df_final = df_final[df_final[col].notna() & (df_final[col].abs() >= global_logfc)]
-                
-        # Filtrar per tag (gene_tag o expr_pval_Patient_Ctrl)
-        if sheet_name in tag_filter_config:
-            tag_col, selected_tags = tag_filter_config[sheet_name]
-            if selected_tags:
-                df_final = df_final[df_final[tag_col].isin(selected_tags)]
-    
-    # --- Selecció de quins datasets volem mostrar ---
-    st.write("---")
-    datasets_to_show = st.multiselect(
-        "Selecciona datasets a mostrar:",
-        possible_sheets,
-        default=possible_sheets,  # Per defecte, tots seleccionats
+    # 4) Aplicar els filtres: totes les condicions es combinen en una sola màscara
+    #    i s'avaluen de la més selectiva a la menys (vegeu filtering.py)
+    filter_spec = FilterSpec(
+        genes=selected_genes,
+        p_value=global_p_value,
+        fdr=global_fdr,
+        logfc=global_logfc,
+        metrics={s: cols for s, cols in pvalue_config.items() if s in possible_sheets},
+        tags={s: config for s, config in tag_filter_config.items() if s in possible_sheets},
     )
-    
+    conditions = filter_spec.conditions()
+
+    # Només es carreguen els datasets que es mostren o que tenen algun filtre de mètriques
+    # (els filtres d'etiquetes es resolen amb la matriu d'etiquetes)
+    needed_datasets = set(datasets_to_show)
+    needed_datasets.update(s for s, cols in filter_spec.metrics.items() if cols)
+    with stage("load_datasets", rows_in=len(needed_datasets)) as record:
+        df_merged = table.frame(needed_datasets)
+        record.rows_out = len(df_merged)
+    st.sidebar.caption(
+        f"Datasets en memòria: {len(table.loaded())} de {len(table.sheets)} "
+        f"({table.memory_bytes() / 2**20:.1f} MB)"
+    )
+
+    # Les posicions de les files filtrades es desen a la memòria cau per a cada conjunt de condicions:
+    # canviar de pàgina o d'ordenació no torna a filtrar
+    filter_cache = get_filter_cache()
+    if QUERY_BACKEND == "duckdb":
+        # Filtres dins la lectura del Parquet (es construeix un sol cop per versió, amb tots els datasets)
+        backend = get_duckdb_backend(data_version, table)
+    with stage("filter", rows_in=len(df_merged)) as record:
+        stats_before = filter_cache.stats()
+        if QUERY_BACKEND == "duckdb":
+            filtered_rows = filter_cache.rows_for(
+                spec_key(conditions, f"{data_version}|duckdb"),
+                lambda: backend.positions(conditions),
+            )
+        else:
+            filtered_rows = filter_cache.rows(
+                df_merged, conditions, version=data_version, gene_index=gene_index, tag_matrix=tag_matrix
+            )
+        record.rows_out = len(filtered_rows)
+        record.cache = _filter_cache_outcome(stats_before, filter_cache.stats())
+
+    # Estat de la memòria cau de filtres
+    cache_stats = filter_cache.stats()
+    st.sidebar.caption(
+        f"Memòria cau de filtres: {cache_stats['hits']} encerts, "
+        f"{cache_stats['partial_hits']} parcials, {cache_stats['misses']} fallades · "
+        f"ordenacions: {cache_stats['sort_hits']} encerts, {cache_stats['sort_misses']} fallades · "
+        f"{cache_stats['entries']} entrades, "
+        f"{cache_stats['bytes'] / 2**20:.1f} / {cache_stats['max_bytes'] / 2**20:.0f} MB"
+    )
+
     # Definir quines columnes volem a la taula final
-    cols_to_show = []
-    for col in df_final.columns:
-        # Comprovem que no conté subcadenes no desitjades
-        if any(sub in col.lower() for sub in undesired_substrings):
-            continue
-        
-        # "Gene" la volem sempre
-        if col == "Gene":
-            cols_to_show.append(col)
-            continue
-        
-        # Només incloem la columna si el prefix està entre els datasets seleccionats
-        if "_" in col:
-            prefix = col.split("_")[0]
-            if prefix in datasets_to_show:
-                cols_to_show.append(col)
-    
-    # A df_final només hi deixem les columnes que volem mostrar
-    df_final = df_final[cols_to_show]
+    cols_to_show = display_columns(df_merged.columns, datasets_to_show, undesired_substrings)
+
+    num_rows = len(filtered_rows)
+    num_genes_distintos = df_merged["Gene"].iloc[filtered_rows].nunique()
     
     # 5) Mostrar el resultat
-    if df_final.empty:
+    if num_rows == 0 or not cols_to_show:
         st.warning("No hi ha gens que compleixin els filtres.")
     else:
         # KPI: nombre de gens únics
-        num_genes_distintos = df_final["Gene"].nunique()
         formatted_num_genes = "{:,}".format(num_genes_distintos).replace(",", ".")
         st.metric(label="Gens que compleixen", value=formatted_num_genes)
         
-        # Mostrem només les primeres rows_to_show files per defecte
-        if df_final.shape[0] > rows_to_show:
-            st.info(
-                f"Només es mostren les {rows_to_show} primeres files. "
-                "Descarrega el CSV per obtenir totes les files filtrades."
+        # Paginació i ordenació al servidor: només es seleccionen, s'estilitzen i s'envien
+        # les files de la pàgina visible (el filtratge no es torna a executar)
+        col_sort, col_order, col_size, col_page = st.columns(4)
+        sort_by = col_sort.selectbox("Ordena per:", ["(ordre original)"] + cols_to_show)
+        sort_by = None if sort_by == "(ordre original)" else sort_by
+        ascending = col_order.radio("Ordre:", ["Ascendent", "Descendent"], horizontal=True) == "Ascendent"
+        page_size = col_size.selectbox("Files per pàgina:", page_sizes, index=page_sizes.index(rows_to_show))
+        num_pages = max(1, -(-num_rows // page_size))
+        page = col_page.number_input(
+            f"Pàgina (de {num_pages}):",
+            min_value=1,
+            max_value=num_pages,
+            value=1,
+            # La pàgina torna a 1 quan canvien els filtres, l'ordenació o la mida de pàgina
+            key=f"page_{spec_key(conditions, f'{sort_by}|{ascending}|{page_size}')}",
+        )
+        offset = (page - 1) * page_size
+
+        with stage("sort_and_page", rows_in=num_rows) as record:
+            ordered_rows = filter_cache.sorted_rows(
+                df_merged, conditions, version=data_version, sort_by=sort_by, ascending=ascending,
+                rows=filtered_rows,
             )
-            df_display = df_final.head(rows_to_show)
-        else:
-            df_display = df_final
+            df_display = select(df_merged, ordered_rows[offset:offset + page_size], cols_to_show)
+            record.rows_out = len(df_display)
+        st.caption(f"Files {offset + 1}–{offset + len(df_display)} de {num_rows:,}".replace(",", "."))
             
         # Deixa la columna 'Gene' sense enllaços (només text)
         # Afegim una opció per activar/desactivar la visualització dels enllaços
@@ -271,46 +435,58 @@ def main():
         }
         
         # --- Mostra la taula principal ---
-        st.dataframe(
-            df_display.style.apply(highlight_all_datasets, axis=1),
-            column_config=column_config_main,
-            hide_index=True,
-            use_container_width=True
-        )
+        # (l'Styler és mandrós: els estils es calculen en serialitzar la taula)
+        with stage("style_and_render_table", rows_in=len(df_display)):
+            st.dataframe(
+                df_display.style.apply(highlight_all_datasets, axis=None),
+                column_config=column_config_main,
+                hide_index=True,
+                use_container_width=True
+            )
         
-        # Botó per descarregar el CSV filtrat
-        csv_data = df_final.to_csv(index=False)
-        st.download_button(
-            label="Descarregar CSV filtrat",
-            data=csv_data,
-            file_name="genes_filtrats_unics.csv",
-            mime="text/csv"
-        )
+        # Descàrrega del resultat filtrat: el fitxer només s'escriu quan es demana (a blocs,
+        # directament a disc) i es reutilitza mentre no canviïn les dades, els filtres o les columnes
+        col_format, col_prepare = st.columns([1, 3])
+        export_format = col_format.selectbox("Format:", list(EXPORT_FORMATS))
+        extension, mime = EXPORT_FORMATS[export_format]
+
+        if QUERY_BACKEND == "duckdb":
+            make_chunks = lambda: backend.iter_query(conditions, cols_to_show)
+        else:
+            make_chunks = lambda: iter_chunks(df_merged, filtered_rows, cols_to_show)
+        export_key = f"export_{spec_key(conditions, f'{data_version}|{cols_to_show}|{export_format}')}"
+
+        if col_prepare.button("Preparar descàrrega", key=f"prepare_{export_key}"):
+            with st.spinner("Preparant el fitxer..."), stage("export", rows_in=num_rows):
+                st.session_state[export_key] = cached_export(
+                    data_version, conditions, cols_to_show, export_format, make_chunks
+                )
+        export_path = st.session_state.get(export_key)
+        if export_path and os.path.exists(export_path):
+            with open(export_path, "rb") as f:
+                st.download_button(
+                    label=f"Descarregar {export_format} filtrat",
+                    data=f,
+                    file_name=f"genes_filtrats_unics{extension}",
+                    mime=mime,
+                )
         
         # --- Construir la matriu de colors amb el mateix ordre de df_display ---
-        df_matrix = pd.DataFrame()
-        df_matrix["Gene"] = df_display["Gene"]  # Primer copiem la columna 'Gene'
-
-        # 1) Llistem, en l'ordre en què apareixen, les columnes de df_display
-        #    que siguin "tag columns" (acaben en '_genes_tag' o '_expr_pval_Patient_Ctrl')
-        matrix_tag_cols = []
-        for c in df_display.columns:
-            if c == "Gene":
-                continue
-            if c.endswith("_genes_tag") or c.endswith("_expr_pval_Patient_Ctrl"):
-                matrix_tag_cols.append(c)
-
-        # 2) Per cadascuna d'aquestes columnes, creem una nova columna a df_matrix
-        #    anomenada com el prefix (p.ex. 'ProteiNs', 'iAs', etc.)
-        for c in matrix_tag_cols:
-            prefix = c.split("_")[0]
-            df_matrix[prefix] = df_display[c]
+        # Posicions de les files de la pàgina a la taula unificada
+        page_rows = ordered_rows[offset:offset + page_size]
+
+        # Les columnes d'etiquetes que es mostren (*_genes_tag, *_expr_pval_Patient_Ctrl), en el
+        # mateix ordre, amb el prefix del dataset com a nom; es llegeixen dels codis de la matriu
+        # d'etiquetes en lloc de les columnes de text
+        matrix_tag_cols = [c for c in tag_matrix.columns if c in df_display.columns]
+        df_matrix = tag_matrix.frame(page_rows, matrix_tag_cols)
+        df_matrix.insert(0, "Gene", df_display["Gene"].to_numpy())
 
         st.write("---")
         st.markdown("### Matriu de colors per dataset")
         
         # Creem el styled DataFrame i li afegim un atribut de taula per identificar-la
-        styled_matrix = df_matrix.style.apply(highlight_matrix, axis=1)
+        styled_matrix = df_matrix.style.apply(highlight_matrix, axis=None)
         styled_matrix.set_table_attributes('class="narrow-df"')
         
         # CSS específic per ajustar l'amplada (només per les columnes de datasets, deixant 'Gene' amb ample automàtic)
@@ -326,11 +502,20 @@ def main():
         """, unsafe_allow_html=True)
         
         # --- Mostra la matriu de colors ---
-        st.dataframe(
-            styled_matrix,
-            hide_index=True,
-            use_container_width=True
-        )
+        with stage("style_and_render_matrix", rows_in=len(df_matrix)):
+            st.dataframe(
+                styled_matrix,
+                hide_index=True,
+                use_container_width=True
+            )
+
+        show_tag_intersections(tag_matrix, matrix_tag_cols, filtered_rows)
+
+        # Llista gran de gens: etiquetes de tot el conjunt filtrat (no només de la pàgina visible),
+        # sense dibuixar res per gen
+        if list_mode:
+            show_set_tags(df_merged, conditions, datasets_to_show, data_version, export_format, num_rows,
+                          tag_matrix, filtered_rows, backend if QUERY_BACKEND == "duckdb" else None)
 
 if __name__ == "__main__":
     main()
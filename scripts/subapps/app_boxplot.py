@@ -1,65 +1,206 @@
+import json
+
 import streamlit as st
-import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from charts import (
+    condition_stats_table,
+    expression_long_table,
+    gene_figure,
+    missing_cells,
+    selection_figure,
+)
+from data_cache import file_version, sheet_versions
+from differential import differential_expression
+from expression import condition_summary
+from gene_index import build_gene_index
+from gene_picker import gene_selection
+from instrumentation import mark_cache_miss, stage
+from warmup import COUNTS_FILES, counts_catalogue, counts_matrix
+from warmup_panel import wait_for
 
-@st.cache_data
-def load_sheets_info(file_paths):
+@st.cache_data(max_entries=8)
+def load_sheets_info(file_paths, versions):
     """
     Carrega només la columna 'Gene' de cada full i retorna:
       - Llista global ordenada de gens
       - Diccionari que mapeja {nom_full: file_path}
+      - Diccionari que mapeja {nom_full: nombre de files}
+    Cada fitxer s'obre una sola vegada en mode streaming i s'analitza en paral·lel;
+    el resultat també es desa en disc i es comparteix entre processos (vegeu catalogue.py).
+    `versions` (hash de cada fitxer) forma part de la clau: si un Excel canvia, es torna a llegir.
+    És el mateix catàleg que carrega l'escalfament en segon pla (vegeu warmup.py).
+    """
+    mark_cache_miss()
+    return counts_catalogue(file_paths, versions, retry=True).result()
+
+@st.cache_resource
+def gene_search_index(file_paths, _tots_gens):
+    """
+    Índex de cerca sobre el catàleg de gens. `file_paths` inclou la versió de cada fitxer,
+    de manera que l'índex es reconstrueix només quan canvia algun Excel.
+    """
+    return build_gene_index(_tots_gens)
+
+@st.cache_resource(max_entries=32)
+def load_expression_matrix(file_path, sheet_name, version):
+    """
+    Carrega un full de comptatges una sola vegada com a matriu float32 (gens x mostres)
+    amb un índex gen -> fila (vegeu expression.ExpressionMatrix).
+    La matriu es desa en disc (.npy) i es mapa en memòria en només lectura, de manera que
+    tots els processos del servidor comparteixen les mateixes pàgines.
+    `version` és el hash del contingut del full: si l'Excel canvia, només es tornen a
+    convertir els fulls modificats, i les versions antigues surten de la memòria cau
+    (`max_entries`). La conversió es fa en segon pla (vegeu warmup.py): si encara no ha acabat, s'espera.
+    Retorna None si el full no té la columna 'Gene'.
+    """
+    mark_cache_miss()
+    return counts_matrix(file_path, sheet_name, version, retry=True).result()
+
+@st.cache_data(max_entries=32)
+def top_genes_table(file_path, dataset, version, n, stat):
+    """
+    Els `n` gens amb més diferència entre C i P (vegeu ExpressionMatrix.top_genes). Es cacheja
+    per (dataset, versió del full, n, estadístic): no es torna a calcular a cada execució de la pàgina.
+    """
+    mark_cache_miss()
+    return load_expression_matrix(file_path, dataset, version).top_genes(n, stat=stat)
+
+@st.cache_data(max_entries=16)
+def differential_table(file_path, dataset, version, samples, swapped):
+    """
+    Expressió diferencial (P vs C) de tots els gens d'un dataset amb les mostres `samples`, i amb
+    la condició de les mostres `swapped` canviada (vegeu differential.differential_expression).
+    Es cacheja per (dataset, versió del full, mostres, mostres canviades): canviar qualsevol altre
+    control de la pàgina no repeteix la prova.
+    """
+    mark_cache_miss()
+    matrix = load_expression_matrix(file_path, dataset, version)
+    conditions = {
+        sample: {"C": "P", "P": "C"}.get(condition, condition)
+        for sample, condition in zip(matrix.samples, matrix.conditions)
+        if sample in swapped
+    }
+    return differential_expression(
+        matrix, samples=list(samples), conditions=conditions, log_scale=dataset == "ProteiNs"
+    )
+
+def load_matrices(sources) -> dict:
+    """
+    {dataset: ExpressionMatrix o None} per a les fonts (dataset, file_path, versió del full) indicades.
+    """
+    return {dataset: load_expression_matrix(file_path, dataset, version) for dataset, file_path, version in sources}
+
+@st.cache_data(max_entries=512)
+def gene_figure_json(gene, sources, include_zero):
+    """
+    Figura d'un gen (un boxplot per dataset amb dades) serialitzada en JSON, i la llista
+    de datasets sense dades per a aquest gen. Es cacheja per (gen, datasets, include_zero);
+    les fonts inclouen la versió de cada fitxer.
+    """
+    mark_cache_miss()
+    matrices = load_matrices(sources)
+    datasets = [dataset for dataset, _, _ in sources]
+    long = expression_long_table(matrices, [gene], datasets)
+    missing = missing_cells(matrices, long, [gene], datasets)
+    with_data = [dataset for dataset in datasets if dataset in set(long["Dataset"])]
+    if not with_data:
+        return None, missing
+    stats = condition_stats_table(matrices, [gene], with_data)
+    fig_json = gene_figure(long, gene, with_data, include_zero, stats=stats).to_json()
+    return fig_json, missing
+
+@st.cache_data(max_entries=64)
+def selection_figure_json(genes, sources, include_zero):
+    """
+    Una sola figura per a tots els gens seleccionats (files) i datasets (columnes), en JSON,
+    i la llista de combinacions gen-dataset sense dades.
+    """
+    mark_cache_miss()
+    matrices = load_matrices(sources)
+    datasets = [dataset for dataset, _, _ in sources]
+    long = expression_long_table(matrices, genes, datasets)
+    missing = missing_cells(matrices, long, genes, datasets)
+    genes_with_data = [gene for gene in genes if gene in set(long["Gene"])]
+    datasets_with_data = [dataset for dataset in datasets if dataset in set(long["Dataset"])]
+    if not genes_with_data:
+        return None, missing
+    stats = condition_stats_table(matrices, genes_with_data, datasets_with_data)
+    fig = selection_figure(long, genes_with_data, datasets_with_data, include_zero, stats=stats)
+    return fig.to_json(), missing
+
+def show_missing(missing):
+    """
+    Un sol avís amb totes les combinacions gen-dataset sense dades.
     """
-    tots_gens = set()
-    sheets_info = {}  # Map: nom_full -> file_path
-    
-    for file_path in file_paths:
-        xls = pd.ExcelFile(file_path)
-        for nom_full in xls.sheet_names:
-            try:
-                # Llegim només la columna 'Gene' per evitar carregar tot el full
-                df_temp = pd.read_excel(file_path, sheet_name=nom_full, usecols=['Gene'])
-            except ValueError:
-                # El full pot no tenir la columna 'Gene'
-                continue
-            df_temp = df_temp.dropna(subset=['Gene'])
-            df_temp['Gene'] = df_temp['Gene'].astype(str)
-            tots_gens.update(df_temp['Gene'].unique().tolist())
-            sheets_info[nom_full] = file_path
-
-    return sorted(tots_gens), sheets_info
-
-@st.cache_data
-def load_full_sheet(file_path, sheet_name):
-    """
-    Carrega el full complet d'un Excel (totes les columnes).
-    Retorna un DataFrame amb la columna 'Gene' com a string (si existeix).
-    """
-    df = pd.read_excel(file_path, sheet_name=sheet_name, decimal=",")
-    if 'Gene' in df.columns:
-        df['Gene'] = df['Gene'].astype(str)
-    return df
+    messages = {
+        "no_gene_column": "El dataset **{dataset}** no té la columna 'Gene'.",
+        "absent": "El gen **{gene}** no apareix a **{dataset}**.",
+        "empty": "El gen **{gene}** a **{dataset}** té valors no numèrics o tots NaN.",
+    }
+    if missing:
+        st.warning("\n".join(
+            "- " + messages[reason].format(gene=gene, dataset=dataset) for gene, dataset, reason in missing
+        ))
+
+def show_list_summary(genes, sources):
+    """
+    Estadístics per condició (n, mitjana, mediana) de tots els gens d'una llista gran
+    a cada dataset, en una sola taula descarregable.
+    """
+    datasets = [dataset for dataset, _, _ in sources]
+    with stage("list_summary", rows_in=len(genes)) as record:
+        summary = condition_summary(load_matrices(sources), genes, datasets)
+        record.rows_out = len(summary)
+    st.markdown(f"## Resum de {len(genes):,} gens".replace(",", "."))
+    st.caption("Amb una llista de gens no es dibuixa cap gràfic; tria'n alguns amb «Cerca» per veure'n els boxplots.")
+    st.dataframe(summary, hide_index=True, use_container_width=True)
+    st.download_button(
+        "Descarregar CSV",
+        data=summary.to_csv(index=False),
+        file_name="resum_llista_gens.csv",
+        mime="text/csv",
+    )
+
+def show_figure_json(fig_json, key):
+    # La figura es reconstrueix des del JSON cachejat (sense tornar-la a generar)
+    st.plotly_chart(go.Figure(json.loads(fig_json)), use_container_width=True, key=key)
 
 def main():
+    chart_modes = ["Una figura per gen", "Una figura per a tota la selecció", "Un gràfic per gen i dataset"]
+
     st.title("GEN Boxplots")
 
     # 1) Rutes dels fitxers Excel
-    file_paths = [
-        "data/data_normalized_counts.xlsx",
-        "data/data_norm_counts_orgs.xlsx"
-    ]
+    file_paths = list(COUNTS_FILES)
 
     # 2) Carrega la informació mínima (només la columna 'Gene')
-    tots_gens, sheets_info = load_sheets_info(file_paths)
+    #    Mentre el catàleg es carrega en segon pla, la pàgina no es bloqueja
+    file_versions = tuple(file_version(file_path) for file_path in file_paths)
+    if wait_for([counts_catalogue(file_paths, file_versions)], "S'està carregant el catàleg de gens..."):
+        return
+    with stage("load_sheets_info", cached=True) as record:
+        tots_gens, sheets_info, row_counts = load_sheets_info(file_paths, file_versions)
+        record.rows_out = len(tots_gens)
     if not sheets_info:
         st.error("No s'han trobat fulles amb la columna 'Gene' als fitxers.")
         return
 
     # 3) Selecció de gens (a la barra lateral)
-    selected_genes = st.sidebar.multiselect(
-        "Selecciona gens:",
-        tots_gens,
-        default=[]
+    # Hash de cada full, llegit un sol cop per execució: tota la pàgina fa servir la mateixa versió
+    sheet_version = {}
+    for file_path in sorted(set(sheets_info.values())):
+        versions = sheet_versions(file_path)
+        sheet_version.update({ds: versions.get(ds, "")[:16] for ds, path in sheets_info.items() if path == file_path})
+    index_key = tuple(zip(file_paths, file_versions))
+    selected_genes, list_mode = gene_selection(
+        gene_search_index(index_key, tots_gens), "Selecciona gens:", key="boxplot_genes"
     )
+    # Conversió de cada full de comptatges (en segon pla): els datasets que ja són a punt es
+    # mostren de seguida, i la resta quan acaben
+    matrix_tasks = {
+        ds: counts_matrix(path, ds, sheet_version[ds]) for ds, path in sheets_info.items()
+    }
 
     # 4) Selecció de datasets (a la barra lateral)
     # Ordenem els datasets segons l'ordre fix: iNs, iAs, iPSCs, Fibros, i després la resta (ordenada alfabèticament)
@@ -72,17 +213,107 @@ def main():
     selected_datasets = st.sidebar.multiselect(
         "Selecciona datasets:",
         all_dataset_names,
-        default=all_dataset_names
+        default=all_dataset_names,
+        help=", ".join(f"{ds}: {row_counts.get(ds, 0):,} gens" for ds in all_dataset_names)
     )
 
     st.sidebar.toggle("Force Y-axis to include 0", value=True, key="include_zero")
+    chart_mode = st.sidebar.radio("Gràfics:", chart_modes, index=0)
+
+    # Gens amb més diferència entre condicions (a partir dels estadístics precalculats)
+    with st.expander("Gens amb més diferència entre C i P"):
+        col_ds, col_stat, col_n = st.columns(3)
+        top_dataset = col_ds.selectbox("Dataset:", all_dataset_names, key="top_dataset")
+        top_stat = col_stat.radio("Estadístic:", ["mean", "median"], horizontal=True, key="top_stat")
+        top_n = col_n.number_input("Nombre de gens:", min_value=1, max_value=500, value=20, key="top_n")
+        if not wait_for([matrix_tasks[top_dataset]], f"S'està carregant {top_dataset}..."):
+            with stage("top_genes", cached=True) as record:
+                top_matrix = load_expression_matrix(sheets_info[top_dataset], top_dataset, sheet_version[top_dataset])
+                if top_matrix is None or top_matrix.stats is None:
+                    st.write("Aquest dataset no té estadístics disponibles.")
+                elif not {"C", "P"} <= set(top_matrix.stats.conditions):
+                    st.write("Aquest dataset no té mostres de les dues condicions (C i P).")
+                else:
+                    top_table = top_genes_table(
+                        sheets_info[top_dataset], top_dataset, sheet_version[top_dataset], int(top_n), top_stat
+                    )
+                    record.rows_in, record.rows_out = len(top_matrix.genes), len(top_table)
+                    st.dataframe(top_table, hide_index=True, use_container_width=True)
+
+    # Expressió diferencial recalculada (P vs C) amb les mostres i agrupacions triades
+    with st.expander("Expressió diferencial (recalculada)"):
+        de_dataset = st.selectbox("Dataset:", all_dataset_names, key="de_dataset")
+        if not wait_for([matrix_tasks[de_dataset]], f"S'està carregant {de_dataset}..."):
+            de_matrix = load_expression_matrix(sheets_info[de_dataset], de_dataset, sheet_version[de_dataset])
+            if de_matrix is None:
+                st.write("Aquest dataset no té la columna 'Gene'.")
+            else:
+                samples = list(de_matrix.samples)
+                col_samples, col_swap = st.columns(2)
+                de_samples = col_samples.multiselect(
+                    "Mostres incloses:", samples, default=samples, key=f"de_samples_{de_dataset}"
+                )
+                swapped = col_swap.multiselect(
+                    "Mostres amb la condició canviada (C ↔ P):", de_samples, key=f"de_swap_{de_dataset}"
+                )
+                max_fdr = st.number_input("FDR màxim:", min_value=0.0, max_value=1.0, value=0.05, step=0.01, key="de_fdr")
+                with stage("differential_expression", rows_in=len(de_matrix.genes), cached=True) as record:
+                    de_table = differential_table(
+                        sheets_info[de_dataset], de_dataset, sheet_version[de_dataset],
+                        tuple(sorted(de_samples)), tuple(sorted(swapped)),
+                    )
+                    significant = de_table[de_table["FDR"] <= max_fdr].sort_values("pvalue")
+                    record.rows_out = len(significant)
+                st.write(f"{len(significant):,} gens amb FDR ≤ {max_fdr:g} (de {de_table['pvalue'].notna().sum():,} provats).")
+                st.dataframe(significant.head(500), hide_index=True, use_container_width=True)
 
     # 5) Si no s'ha seleccionat com a mínim un gen i un dataset, no es fa res
     if not selected_genes or not selected_datasets:
         st.info("Selecciona com a mínim un gen i un dataset per veure els boxplots.")
         return
 
-    # 6) Per cada gen seleccionat, es mostren els boxplots de cada dataset en files (màxim 4 per fila)
+    include_zero = st.session_state.get("include_zero", True)
+    # Els datasets que encara es carreguen s'afegiran quan acabin
+    loading = [dataset for dataset in selected_datasets if not matrix_tasks[dataset].done]
+    if wait_for(
+        [matrix_tasks[dataset] for dataset in loading],
+        f"S'està carregant {', '.join(loading)}: es mostrarà quan estigui a punt.",
+    ):
+        selected_datasets = [dataset for dataset in selected_datasets if dataset not in loading]
+        if not selected_datasets:
+            return
+    sources = tuple(
+        (dataset, sheets_info[dataset], sheet_version[dataset])
+        for dataset in selected_datasets
+    )
+
+    # 6) Llista gran de gens: una taula amb els estadístics de tot el conjunt (sense un gràfic per gen)
+    if list_mode:
+        show_list_summary(selected_genes, sources)
+        return
+
+    # 6a) Una sola figura (amb un boxplot per dataset) per gen, o una per a tota la selecció
+    if chart_mode == chart_modes[0]:
+        for gene in selected_genes:
+            st.markdown(f"## Gen: {gene}")
+            with stage("gene_figure", rows_in=len(sources), cached=True) as record:
+                fig_json, missing = gene_figure_json(gene, sources, include_zero)
+                show_missing(missing)
+                if fig_json is not None:
+                    show_figure_json(fig_json, key=f"fig_{gene}")
+                record.rows_out = len(sources) - len(missing)
+        return
+
+    if chart_mode == chart_modes[1]:
+        with stage("selection_figure", rows_in=len(selected_genes) * len(sources), cached=True) as record:
+            fig_json, missing = selection_figure_json(tuple(selected_genes), sources, include_zero)
+            show_missing(missing)
+            if fig_json is not None:
+                show_figure_json(fig_json, key="fig_selection")
+            record.rows_out = len(selected_genes) * len(sources) - len(missing)
+        return
+
+    # 6b) Per cada gen seleccionat, es mostren els boxplots de cada dataset en files (màxim 4 per fila)
     for gene in selected_genes:
         st.markdown(f"## Gen: {gene}")
         # Processem els datasets en grups de 4 per crear files
@@ -92,67 +323,50 @@ def main():
             for j, dataset_name in enumerate(dataset_chunk):
                 with cols[j]:
                     file_path = sheets_info[dataset_name]
-                    df_full = load_full_sheet(file_path, dataset_name)
+                    with stage("load_expression_matrix", cached=True) as record:
+                        expression = load_expression_matrix(file_path, dataset_name, sheet_version[dataset_name])
+                        record.rows_out = None if expression is None else len(expression.genes)
                     
-                    if 'Gene' not in df_full.columns:
+                    if expression is None:
                         st.warning(f"El dataset **{dataset_name}** no té la columna 'Gene'.")
                         continue
 
-                    # Filtra pel gen seleccionat
-                    df_gene = df_full[df_full['Gene'] == gene].copy()
-                    if df_gene.empty:
+                    # Cerca directa del gen a l'índex (sense recórrer tot el full)
+                    sample_means = expression.sample_means(gene)
+                    if sample_means is None:
                         st.warning(f"El gen **{gene}** no apareix a **{dataset_name}**.")
                         continue
 
-                    # Transformació a format llarg
-                    df_melted = df_gene.melt(
-                        id_vars='Gene',
-                        var_name='Sample',
-                        value_name='Expression'
-                    )
-
-                    # Creem 'Condition' a partir de 'Sample'
-                    df_melted['Condition'] = df_melted['Sample'].str.split('_').str[-1]
-
-                    # Convertim a majúscules (per evitar confusions p/P o c/C)
-                    df_melted['Condition'] = df_melted['Condition'].str.upper()
-
-                    # Assegurem que 'Expression' sigui numèrica
-                    df_melted['Expression'] = pd.to_numeric(df_melted['Expression'], errors='coerce')
-                    df_melted.dropna(subset=['Expression'], inplace=True)
-
-                    if df_melted.empty:
+                    if sample_means.empty:
                         st.warning(f"El gen **{gene}** a **{dataset_name}** té valors no numèrics o tots NaN.")
                         continue
 
-                    # Calculem la mitjana d'expressió per mostra
-                    sample_means = df_melted.groupby(['Sample', 'Condition'])['Expression'].mean().reset_index()
-
-                    # Creem el boxplot amb títol "Dataset - Gen" i amb l'ordre fix de 'Condition': C, P
-                    fig = px.box(
-                        sample_means,
-                        x='Condition',
-                        y='Expression',
-                        color='Condition',
-                        points='all',
-                        hover_data=['Sample'],
-                        title=f"{dataset_name} : {gene}",
-                        category_orders={"Condition": ["C", "P"]},
-                        color_discrete_map={"C": "#bae1ff", "P": "#daf7a6"},
-                        labels={'Expression': 'Log2 abundances' if dataset_name == "ProteiNs" else 'mRNA Expression <br> (Normalized Read Counts)'}
-                    )
-                    fig.update_traces(
-                        jitter=0,
-                        pointpos=0,
-                        marker=dict(size=10, opacity=0.8),
-                        line=dict(width=1)
-                    )
+                    with stage("chart", rows_in=len(sample_means)):
+                        # Creem el boxplot amb títol "Dataset - Gen" i amb l'ordre fix de 'Condition': C, P
+                        fig = px.box(
+                            sample_means,
+                            x='Condition',
+                            y='Expression',
+                            color='Condition',
+                            points='all',
+                            hover_data=['Sample'],
+                            title=f"{dataset_name} : {gene}",
+                            category_orders={"Condition": ["C", "P"]},
+                            color_discrete_map={"C": "#bae1ff", "P": "#daf7a6"},
+                            labels={'Expression': 'Log2 abundances' if dataset_name == "ProteiNs" else 'mRNA Expression <br> (Normalized Read Counts)'}
+                        )
+                        fig.update_traces(
+                            jitter=0,
+                            pointpos=0,
+                            marker=dict(size=10, opacity=0.8),
+                            line=dict(width=1)
+                        )
 
-                    # Els gràfics estan centrats a Y=0 a menys que l'usuari indiqui el contrari
-                    if st.session_state.get("include_zero", True):
-                        fig.update_yaxes(rangemode="tozero")
+                        # Els gràfics estan centrats a Y=0 a menys que l'usuari indiqui el contrari
+                        if st.session_state.get("include_zero", True):
+                            fig.update_yaxes(rangemode="tozero")
 
-                    st.plotly_chart(fig, use_container_width=True)
+                        st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from schema import dataset_prefix
+
+# Els codis són int8: com a molt 127 etiquetes diferents (-1 = sense etiqueta)
+MAX_TAGS = 127
+
+
+@dataclass
+class TagMatrix:
+    """
+    Etiquetes de tots els datasets (columnes *_genes_tag i *_expr_pval_Patient_Ctrl),
+    codificades un sol cop per a totes les files de la taula unificada:
+
+    - columns: columna d'etiquetes de cada dataset
+    - datasets: prefix de cada columna (vegeu schema.dataset_prefix)
+    - tags: vocabulari comú (el codi d'una etiqueta és la seva posició; -1 = sense etiqueta)
+    - codes: matriu int8 (files × datasets)
+    - column_tags: {columna: etiquetes possibles (categories de la columna)}
+    - bitmaps: {(dataset, etiqueta): bits empaquetats (np.packbits) de les files que la tenen}
+
+    Les consultes entre datasets («PREVALENT_DEG a iAs i NewiNs però NOT_DEG a Fibros»)
+    són AND/OR de bitmaps sobre totes les files alhora.
+    """
+    columns: list
+    datasets: list
+    tags: list
+    codes: np.ndarray = field(repr=False)
+    column_tags: dict = field(default_factory=dict, repr=False)
+    bitmaps: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def n_rows(self) -> int:
+        return self.codes.shape[0]
+
+    def dataset_of(self, column: str) -> str:
+        return self.datasets[self.columns.index(column)]
+
+    def bitmap(self, dataset: str, tags) -> np.ndarray:
+        """
+        Files on `dataset` té alguna de les etiquetes `tags` (una o una llista), en bits empaquetats.
+        """
+        tags = [tags] if isinstance(tags, str) else list(tags)
+        bits = np.zeros(-(-self.n_rows // 8), dtype=np.uint8)
+        for tag in tags:
+            tag_bits = self.bitmaps.get((dataset, tag))
+            if tag_bits is not None:
+                bits |= tag_bits
+        return bits
+
+    def query(self, include: dict = None, exclude: dict = None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Bits de les files que tenen, a cada dataset de `include` ({dataset: etiqueta o llista}),
+        alguna de les etiquetes indicades i, a cada dataset d'`exclude`, cap de les indicades.
+        Amb `rows` es limita a aquestes posicions (p.ex. un resultat ja filtrat).
+        """
+        bits = self.rows_bitmap(rows) if rows is not None else self._all_bits()
+        for dataset, tags in (include or {}).items():
+            bits &= self.bitmap(dataset, tags)
+        for dataset, tags in (exclude or {}).items():
+            bits &= ~self.bitmap(dataset, tags)
+        return bits
+
+    def count(self, bits: np.ndarray) -> int:
+        return int(np.bitwise_count(bits).sum())
+
+    def positions(self, bits: np.ndarray) -> np.ndarray:
+        """
+        Posicions (ordenades) de les files marcades.
+        """
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    def rows_bitmap(self, rows: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def frame(self, rows: np.ndarray, columns: list = None) -> pd.DataFrame:
+        """
+        Etiquetes de les files `rows` (en aquest ordre) com a columnes categòriques amb el nom
+        del dataset, directament dels codis (p.ex. per a la matriu de colors).
+        Les posicions negatives són files sense etiquetes.
+        """
+        columns = self.columns if columns is None else columns
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.where((rows >= 0)[:, None], self.codes[rows][:, [self.columns.index(col) for col in columns]], -1)
+        return pd.DataFrame({
+            self.dataset_of(col): pd.Categorical.from_codes(codes[:, j], self.tags)
+            for j, col in enumerate(columns)
+        })
+
+    def counts(self, rows: np.ndarray = None, columns: list = None) -> pd.DataFrame:
+        """
+        Recompte de cada etiqueta per dataset (files: etiquetes; columnes: dataset) de les
+        files `rows` (totes si no s'indiquen).
+        """
+        columns = self.columns if columns is None else columns
+        counts = {}
+        for col in columns:
+            codes = self.codes[:, self.columns.index(col)]
+            codes = codes if rows is None else codes[rows]
+            totals = np.bincount(codes[codes >= 0], minlength=len(self.tags))
+            counts[self.dataset_of(col)] = pd.Series(totals, index=self.tags)
+        tags = sorted({tag for col in columns for tag in self.column_tags.get(col, [])})
+        return pd.DataFrame(counts, index=pd.Index(tags, dtype=object)).astype(int)
+
+    def intersections(self, tag: str, columns: list = None, rows: np.ndarray = None) -> pd.Series:
+        """
+        Nombre de files per combinació de datasets on apareix `tag` (format d'UpSetPlot: índex
+        booleà amb un nivell per dataset), de més a menys files. Les files on no apareix a cap
+        dels datasets no hi compten.
+        """
+        columns = self.columns if columns is None else columns
+        datasets = [self.dataset_of(col) for col in columns]
+        if tag not in self.tags or not columns:
+            return pd.Series([], dtype=np.int64, name=tag)
+        codes = self.codes[:, [self.columns.index(col) for col in columns]]
+        codes = codes if rows is None else codes[rows]
+        # Cada combinació és un enter: el bit j indica si la fila té l'etiqueta al dataset j
+        patterns = (codes == self.tags.index(tag)).astype(np.int64) @ (1 << np.arange(len(columns), dtype=np.int64))
+        values, counts = np.unique(patterns[patterns > 0], return_counts=True)
+        index = pd.MultiIndex.from_arrays(
+            [(values >> j & 1).astype(bool) for j in range(len(columns))], names=datasets
+        )
+        return pd.Series(counts, index=index, name=tag).sort_values(ascending=False, kind="stable")
+
+    def _all_bits(self) -> np.ndarray:
+        return np.packbits(np.ones(self.n_rows, dtype=bool))
+
+
+def build_tag_matrix(tag_columns: dict, n_rows: int = None) -> TagMatrix:
+    """
+    Construeix la matriu a partir de {columna d'etiquetes: Series} (totes alineades a les
+    files de la taula unificada; categòriques o de text). `n_rows` només cal si no hi ha
+    cap columna.
+    """
+    columns = list(tag_columns)
+    categoricals = {col: pd.Categorical(values) for col, values in tag_columns.items()}
+    column_tags = {col: categoricals[col].categories.tolist() for col in columns}
+    tags = sorted({tag for col_tags in column_tags.values() for tag in col_tags})
+    if len(tags) > MAX_TAGS:
+        raise ValueError(f"Massa etiquetes diferents per a una matriu int8: {len(tags)}")
+
+    n_rows = len(next(iter(categoricals.values()))) if columns else (n_rows or 0)
+    codes = np.full((n_rows, len(columns)), -1, dtype=np.int8)
+    vocabulary = pd.Index(tags, dtype=object)
+    for j, col in enumerate(columns):
+        if column_tags[col]:
+            mapping = vocabulary.get_indexer(column_tags[col])
+            local = categoricals[col].codes
+            codes[:, j] = np.where(local >= 0, mapping[local], -1)
+
+    bitmaps = {}
+    for j, col in enumerate(columns):
+        for tag in column_tags[col]:
+            bitmaps[(dataset_prefix(col), tag)] = np.packbits(codes[:, j] == tags.index(tag))
+    return TagMatrix(
+        columns=columns, datasets=[dataset_prefix(col) for col in columns], tags=tags, codes=codes,
+        column_tags=column_tags, bitmaps=bitmaps,
+    )
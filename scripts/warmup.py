@@ -0,0 +1,343 @@
+"""
+Escalfament de les dades en segon pla.
+
+En arrencar el servidor (vegeu app_integrada.py) es carreguen en fils de fons la taula unificada
+de GEN Explorer (metadades, matriu d'etiquetes i índex de gens; els datasets, només amb
+GENEANALYSIS_WARMUP_DATASETS=1), el catàleg de gens de GEN Boxplots i totes les matrius de comptatges. Cada càrrega és una tasca amb estat
+(`Warmup.progress()`). Les pàgines demanen les mateixes tasques (si no existeixen, es programen
+en aquell moment) i mostren el que ja és a punt sense esperar la resta.
+
+També es pot executar sol, p.ex. abans d'engegar el servidor o després de deixar Excels nous a
+`data/`, per deixar a punt les còpies en disc (que comparteixen tots els processos):
+
+    python -m scripts.warmup [--explorer FITXER] [--counts FITXER ...] [--datasets]
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+if __package__:
+    # Executat com a `python -m scripts.warmup`: els mòduls del projecte s'importen pel nom
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import catalogue
+from data_cache import file_version, sheet_versions
+from expression import cached_expression_matrix
+from gene_index import build_gene_index
+from loaders import DUPLICATE_POLICIES, read_full_sheet
+from watcher import DataStore, default_watcher
+
+logger = logging.getLogger(__name__)
+
+# Fitxers de cada pàgina
+EXPLORER_FILE = "data/Gene_data_20250312.xlsx"
+COUNTS_FILES = ("data/data_normalized_counts.xlsx", "data/data_norm_counts_orgs.xlsx")
+
+# Escalfament en arrencar l'aplicació ("0" el desactiva: les dades es carreguen quan les
+# demana una pàgina)
+WARMUP_ENABLED = os.environ.get("GENEANALYSIS_WARMUP", "1") != "0"
+
+# Càrrega de tots els datasets de GEN Explorer en escalfar ("1" l'activa). Per defecte només
+# s'escalfen les metadades, la matriu d'etiquetes i l'índex de gens: els datasets es carreguen
+# quan una pàgina els necessita, i així la memòria només creix amb els que es fan servir
+WARMUP_DATASETS = os.environ.get("GENEANALYSIS_WARMUP_DATASETS", "0") == "1"
+
+# Fils de fons per a les tasques
+WARMUP_WORKERS = min(4, os.cpu_count() or 1)
+
+
+@dataclass
+class WarmupTask:
+    """
+    Una càrrega en segon pla:
+
+    - name: clau de la tasca (inclou el fitxer i, si n'hi ha, la versió de les dades)
+    - label: descripció per mostrar
+    - status: "pending", "running", "done" o "failed"
+    - seconds: durada, un cop acabada
+    - error: missatge de l'error, si ha fallat
+    """
+    name: tuple
+    label: str
+    status: str = "pending"
+    seconds: float = None
+    error: str = None
+    future: Future = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None):
+        """
+        Resultat de la tasca, esperant-la si encara no ha acabat (si ha fallat, en torna a llançar l'error).
+        """
+        return self.future.result(timeout)
+
+    def to_dict(self) -> dict:
+        return {"label": self.label, "status": self.status, "seconds": self.seconds, "error": self.error}
+
+
+class Warmup:
+    """
+    Tasques de càrrega en fils de fons, identificades pel nom. Demanar una tasca que ja existeix
+    retorna la mateixa (i, per tant, el mateix objecte en memòria per a totes les sessions);
+    una tasca que ha fallat només es torna a programar si es demana amb `retry=True`.
+
+    Les tasques no esperen mai el resultat d'una altra (no bloquegen els fils): quan una
+    càrrega en fa possibles d'altres, les programa ella mateixa en acabar.
+    """
+
+    def __init__(self, max_workers: int = WARMUP_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geneanalysis-warmup")
+        self._tasks = {}  # nom -> WarmupTask
+        self._lock = threading.Lock()
+
+    def task(self, name: tuple, label: str, build, *args, retry: bool = False, **kwargs) -> WarmupTask:
+        """
+        Tasca `name`; si no existeix (o ha fallat i `retry`), es programa `build(*args, **kwargs)`.
+        """
+        with self._lock:
+            task = self._tasks.get(name)
+            if task is None or (retry and task.status == "failed"):
+                task = WarmupTask(name=name, label=label)
+                task.future = self._pool.submit(self._run, task, build, args, kwargs)
+                self._tasks[name] = task
+        return task
+
+    def get(self, name: tuple) -> WarmupTask:
+        return self._tasks.get(name)
+
+    def tasks(self) -> list:
+        with self._lock:
+            return list(self._tasks.values())
+
+    def forget(self, names):
+        """
+        Oblida les tasques indicades (les que encara s'executen acaben igualment).
+        """
+        names = list(names)
+        with self._lock:
+            for name in names:
+                self._tasks.pop(name, None)
+
+    def progress(self) -> dict:
+        """
+        Senyal de disponibilitat: nombre de tasques, acabades i fallides, si ja és tot a punt
+        (`ready`) i l'estat de cada tasca.
+        """
+        tasks = self.tasks()
+        return {
+            "total": len(tasks),
+            "done": sum(task.status == "done" for task in tasks),
+            "failed": sum(task.status == "failed" for task in tasks),
+            "ready": all(task.done for task in tasks),
+            "tasks": [task.to_dict() for task in tasks],
+        }
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Espera que acabin totes les tasques, també les que es programen mentrestant.
+        Retorna False si s'ha esgotat el temps.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pending = [task.future for task in self.tasks() if not task.done]
+            if not pending:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait(pending, timeout=remaining)
+
+    def _run(self, task: WarmupTask, build, args, kwargs):
+        task.status = "running"
+        start = time.perf_counter()
+        try:
+            result = build(*args, **kwargs)
+        except Exception as e:
+            task.status, task.error = "failed", str(e)
+            logger.warning("Escalfament: %s ha fallat: %s", task.label, e)
+            raise
+        finally:
+            task.seconds = time.perf_counter() - start
+        task.status = "done"
+        logger.info("Escalfament: %s (%.2f s)", task.label, task.seconds)
+        return result
+
+
+def explorer_store(file_path: str = EXPLORER_FILE, duplicates: str = "first", warmup: Warmup = None,
+                   retry: bool = False, datasets: bool = WARMUP_DATASETS) -> WarmupTask:
+    """
+    Tasca que construeix la DataStore de GEN Explorer (vegeu watcher.py) i en vigila el fitxer.
+    Quan acaba, programa la matriu d'etiquetes i l'índex de gens de la versió vigent (i de cada
+    versió nova que arribi); amb `datasets`, també la càrrega de tots els datasets.
+    """
+    warmup = warmup or default_warmup()
+    return warmup.task(
+        ("explorer", file_path, duplicates), f"GEN Explorer: {os.path.basename(file_path)}",
+        _load_store, warmup, file_path, duplicates, datasets, retry=retry,
+    )
+
+
+def _load_store(warmup: Warmup, file_path: str, duplicates: str, datasets: bool) -> DataStore:
+    store = DataStore(file_path, duplicates=duplicates)
+    default_watcher().watch(file_path, lambda path: store.refresh())
+    store.listeners.append(lambda snapshot: _warm_table(warmup, snapshot.table, datasets))
+    _warm_table(warmup, store.current.table, datasets)
+    return store
+
+
+def _warm_table(warmup: Warmup, table, datasets: bool):
+    # Les tasques de versions anteriors ja no calen (i retindrien la seva taula en memòria)
+    warmup.forget([
+        task.name for task in warmup.tasks()
+        if task.name[0] in ("explorer_tags", "explorer_datasets", "explorer_index")
+        and task.name[1] == table.file_path and task.name[2] != table.version
+    ])
+    name = os.path.basename(table.file_path)
+    warmup.task(
+        ("explorer_tags", table.file_path, table.version), f"GEN Explorer: etiquetes de {name}", table.tag_matrix
+    )
+    if datasets:
+        warmup.task(
+            ("explorer_datasets", table.file_path, table.version),
+            f"GEN Explorer: {len(table.sheets)} datasets de {name}", table.preload,
+        )
+    explorer_gene_index(table, warmup)
+
+
+def explorer_gene_index(table, warmup: Warmup = None, retry: bool = False) -> WarmupTask:
+    """
+    Tasca de l'índex de cerca de gens d'una versió de la taula de GEN Explorer
+    (gene_index.build_gene_index, amb els àlies de les columnes d'identificadors).
+    """
+    warmup = warmup or default_warmup()
+    return warmup.task(
+        ("explorer_index", table.file_path, table.version),
+        f"GEN Explorer: índex de gens de {os.path.basename(table.file_path)}",
+        _build_table_index, table, retry=retry,
+    )
+
+
+def _build_table_index(table):
+    return build_gene_index(table.genes, table.aliases())
+
+
+def counts_catalogue(file_paths=COUNTS_FILES, versions: tuple = None, warmup: Warmup = None,
+                     retry: bool = False) -> WarmupTask:
+    """
+    Tasca del catàleg de gens dels fitxers de comptatges (vegeu catalogue.load_sheets_info) per a
+    les versions indicades (hash de cada fitxer; si no s'indiquen, es calculen ara). Quan acaba,
+    programa la conversió de tots els fulls (`counts_matrix`).
+    """
+    warmup = warmup or default_warmup()
+    file_paths = tuple(file_paths)
+    versions = tuple(versions or (file_version(file_path) for file_path in file_paths))
+    return warmup.task(
+        ("catalogue", file_paths, versions), "GEN Boxplots: catàleg de gens",
+        _load_catalogue, warmup, file_paths, retry=retry,
+    )
+
+
+def _load_catalogue(warmup: Warmup, file_paths: tuple) -> tuple:
+    tots_gens, sheets_info, row_counts = catalogue.load_sheets_info(file_paths)
+    current = set()
+    for file_path in sorted(set(sheets_info.values())):
+        versions = sheet_versions(file_path)
+        for sheet_name, path in sheets_info.items():
+            if path == file_path:
+                current.add(counts_matrix(file_path, sheet_name, versions.get(sheet_name, "")[:16], warmup).name)
+    # Les matrius de versions anteriors dels fulls ja no calen (i retindrien la seva memòria)
+    warmup.forget([
+        task.name for task in warmup.tasks()
+        if task.name[0] == "counts" and task.name[1] in file_paths and task.name not in current
+    ])
+    return tots_gens, sheets_info, row_counts
+
+
+def counts_matrix(file_path: str, sheet_name: str, version: str, warmup: Warmup = None,
+                  retry: bool = False) -> WarmupTask:
+    """
+    Tasca de la matriu de comptatges d'un full (vegeu expression.cached_expression_matrix):
+    `version` és el hash del full.
+    """
+    warmup = warmup or default_warmup()
+    return warmup.task(
+        ("counts", file_path, sheet_name, version), f"GEN Boxplots: {sheet_name}",
+        cached_expression_matrix, file_path, sheet_name, read_full_sheet, version=version, retry=retry,
+    )
+
+
+def warm_up(explorer_file: str = EXPLORER_FILE, counts_files=COUNTS_FILES, duplicates: str = "first",
+            warmup: Warmup = None, datasets: bool = WARMUP_DATASETS) -> Warmup:
+    """
+    Programa la càrrega de les dades de les dues pàgines (vegeu explorer_store per a `datasets`)
+    i retorna de seguida.
+    """
+    warmup = warmup or default_warmup()
+    explorer_store(explorer_file, duplicates, warmup, datasets=datasets)
+    counts_files = tuple(counts_files)
+    # El hash dels fitxers de comptatges també es calcula en segon pla
+    warmup.task(
+        ("counts_files", counts_files), "GEN Boxplots: versions dels fitxers",
+        _warm_counts, warmup, counts_files,
+    )
+    return warmup
+
+
+def _warm_counts(warmup: Warmup, counts_files: tuple) -> tuple:
+    return counts_catalogue(counts_files, warmup=warmup).name
+
+
+_default_warmup = None
+_default_lock = threading.Lock()
+
+
+def default_warmup() -> Warmup:
+    """
+    Tasques d'escalfament compartides pel procés.
+    """
+    global _default_warmup
+    with _default_lock:
+        if _default_warmup is None:
+            _default_warmup = Warmup()
+        return _default_warmup
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.warmup",
+        description="Carrega totes les dades (i en deixa a punt les còpies en disc) sense interfície.",
+    )
+    parser.add_argument("--explorer", default=EXPLORER_FILE, help=f"Excel de GEN Explorer (per defecte {EXPLORER_FILE})")
+    parser.add_argument("--counts", nargs="+", default=list(COUNTS_FILES), help="Excels de comptatges de GEN Boxplots")
+    parser.add_argument("--duplicates", default="first", choices=DUPLICATE_POLICIES,
+                        help="Tractament dels gens repetits dins d'un full")
+    parser.add_argument("--datasets", action="store_true", default=WARMUP_DATASETS,
+                        help="Carrega també tots els datasets de GEN Explorer (i en deixa a punt les còpies en disc)")
+    parser.add_argument("--timeout", type=float, default=None, help="Temps màxim d'espera, en segons")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    warmup = Warmup()
+    start = time.perf_counter()
+    warm_up(args.explorer, args.counts, args.duplicates, warmup, datasets=args.datasets)
+    finished = warmup.wait(args.timeout)
+    progress = warmup.progress()
+    logger.info("%d de %d tasques acabades en %.2f s", progress["done"], progress["total"], time.perf_counter() - start)
+    # Els fils del vigilant són daemon: el procés acaba encara que vigilin el fitxer
+    default_watcher().stop()
+    if not finished:
+        logger.error("S'ha esgotat el temps d'espera")
+        return 1
+    return 1 if progress["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
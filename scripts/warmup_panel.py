@@ -0,0 +1,49 @@
+import streamlit as st
+
+from warmup import default_warmup
+
+# Segons entre dues consultes de l'estat de l'escalfament
+POLL_SECONDS = 2
+
+
+def show_warmup_progress(container=st.sidebar):
+    """
+    Progrés de l'escalfament de les dades (vegeu warmup.py). S'actualitza sol mentre queden
+    tasques per acabar.
+    """
+    def progress_bar():
+        progress = default_warmup().progress()
+        if progress["total"] == 0:
+            return
+        finished = progress["done"] + progress["failed"]
+        if not progress["ready"]:
+            st.progress(finished / progress["total"], text=f"Preparant dades: {finished} de {progress['total']}")
+        if progress["failed"]:
+            with st.expander(f"⚠️ {progress['failed']} càrregues han fallat"):
+                for task in progress["tasks"]:
+                    if task["status"] == "failed":
+                        st.write(f"**{task['label']}**: {task['error']}")
+
+    ready = default_warmup().progress()["ready"]
+    with container:
+        st.fragment(progress_bar, run_every=None if ready else POLL_SECONDS)()
+
+
+def wait_for(tasks, message: str, container=None) -> bool:
+    """
+    Si alguna de les tasques encara no ha acabat, mostra `message` i retorna True sense
+    bloquejar l'execució: la pàgina es torna a executar sola quan han acabat totes.
+    """
+    names = [task.name for task in tasks if not task.done]
+    if not names:
+        return False
+
+    def notice():
+        pending = [default_warmup().get(name) for name in names]
+        if all(task is None or task.done for task in pending):
+            st.rerun()
+        st.info(message)
+
+    with container or st.container():
+        st.fragment(notice, run_every=POLL_SECONDS)()
+    return True
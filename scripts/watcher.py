@@ -0,0 +1,160 @@
+import dataclasses
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from data_cache import file_signature
+from datasets import DatasetCatalogue
+
+logger = logging.getLogger(__name__)
+
+# Segons entre dues comprovacions dels fitxers vigilats (0 = sense vigilància)
+WATCH_INTERVAL = float(os.environ.get("GENEANALYSIS_WATCH_INTERVAL", "5"))
+
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """
+    Una versió de la taula unificada d'un Excel. El seu contingut no canvia mai: quan el fitxer
+    canvia se'n construeix una de nova, i qui encara té l'anterior la continua veient sencera.
+
+    - version: identificador del contingut (vegeu DatasetCatalogue.version)
+    - table: taula unificada, carregada per datasets a mesura que es fan servir
+    - signature: mida i mtime del fitxer quan es va llegir (vegeu data_cache.file_signature)
+    - loaded_at: moment de la càrrega
+    """
+    version: str
+    table: DatasetCatalogue = field(repr=False)
+    signature: dict = field(repr=False)
+    loaded_at: float = field(default_factory=time.time)
+
+
+class DataStore:
+    """
+    Versió vigent de la taula unificada d'un Excel, compartida per totes les sessions.
+
+    `refresh()` comprova el fitxer i, si ha canviat, construeix la nova versió (només es
+    tornen a llegir els fulls modificats, i els que no han canviat i ja eren en memòria es
+    reutilitzen, vegeu datasets.DatasetCatalogue) i la substitueix
+    d'una sola vegada. Si la lectura falla (p.ex. un fitxer a mig copiar), es manté la
+    versió anterior i es torna a provar a la comprovació següent.
+    """
+
+    def __init__(self, file_path: str, duplicates: str = "first"):
+        self.file_path = file_path
+        self.duplicates = duplicates
+        self.listeners = []
+        self._lock = threading.Lock()  # Una sola reconstrucció alhora
+        self._snapshot = self._load(None)
+
+    @property
+    def current(self) -> DataSnapshot:
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """
+        Carrega la nova versió si el fitxer ha canviat. Retorna True si s'ha substituït.
+        """
+        with self._lock:
+            previous = self._snapshot
+            try:
+                if file_signature(self.file_path) == previous.signature:
+                    return False
+                snapshot = self._load(previous)
+            except Exception as e:
+                logger.warning("No s'ha pogut tornar a llegir %s: %s", self.file_path, e)
+                return False
+            if snapshot.version == previous.version:
+                # Mateix contingut (p.ex. només ha canviat el mtime): es conserva la taula
+                self._snapshot = dataclasses.replace(previous, signature=snapshot.signature)
+                return False
+            self._snapshot = snapshot
+        logger.info("Nova versió de %s: %s", self.file_path, snapshot.version)
+        for listener in self.listeners:
+            listener(snapshot)
+        return True
+
+    def _load(self, previous: DataSnapshot) -> DataSnapshot:
+        signature = file_signature(self.file_path)
+        table = DatasetCatalogue(
+            self.file_path, duplicates=self.duplicates, previous=previous.table if previous else None
+        )
+        return DataSnapshot(version=table.version, table=table, signature=signature)
+
+
+class FileWatcher:
+    """
+    Fil de fons que comprova cada `interval` segons la mida i el mtime dels fitxers vigilats
+    i crida `on_change(path)` quan un fitxer ha canviat i s'ha mantingut igual durant una
+    comprovació sencera (per no llegir un fitxer que encara s'està copiant).
+    """
+
+    def __init__(self, interval: float = WATCH_INTERVAL):
+        self.interval = interval
+        self._watched = {}  # path -> [callbacks, última signatura vista, signatura notificada]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, path: str, on_change):
+        signature = _signature_or_none(path)
+        with self._lock:
+            entry = self._watched.setdefault(os.path.abspath(path), [[], signature, signature])
+            entry[0].append(on_change)
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="geneanalysis-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        """
+        Una comprovació de tots els fitxers (la fa el fil periòdicament).
+        """
+        with self._lock:
+            watched = list(self._watched.items())
+        for path, entry in watched:
+            callbacks, last_seen, notified = entry
+            signature = _signature_or_none(path)
+            entry[1] = signature
+            if signature is None or signature != last_seen or signature == notified:
+                continue
+            entry[2] = signature
+            for callback in callbacks:
+                try:
+                    callback(path)
+                except Exception:
+                    logger.exception("Error en processar el canvi de %s", path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+_default_watcher = None
+_default_lock = threading.Lock()
+
+
+def default_watcher() -> FileWatcher:
+    """
+    Vigilant compartit pel procés (s'engega el primer cop que es demana).
+    """
+    global _default_watcher
+    with _default_lock:
+        if _default_watcher is None:
+            _default_watcher = FileWatcher()
+            _default_watcher.start()
+        return _default_watcher
+
+
+def _signature_or_none(path: str):
+    try:
+        return file_signature(path)
+    except OSError:
+        return None
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Els mòduls de scripts/ s'importen pel nom, com fan les aplicacions i els benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,87 @@
+"""
+El backend DuckDB ha de retornar les mateixes files, en el mateix ordre, que filtering.evaluate.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from duckdb_backend import DuckDBBackend, export_parquet
+from filtering import FilterSpec, evaluate, select, sort_positions
+from loaders import merge_on_gene
+from schema import apply_schema
+
+# Valor que es posa exactament al llindar de logFC d'algunes files
+THRESHOLD = 2.3
+
+
+@pytest.fixture(scope="module")
+def table():
+    sheets = synthetic.gene_sheets(2_000, n_sheets=4, duplicates=3)
+    # Com als Excel reals, el llindar arriba com a text amb coma decimal en alguns fulls
+    sheets["iAs"].loc[:9, "logFC"] = [THRESHOLD, -THRESHOLD] * 5
+    sheets["NewiNs"].loc[:9, "logFCs"] = [f"{THRESHOLD}".replace(".", ",")] * 10
+    return apply_schema(merge_on_gene(sheets))
+
+
+@pytest.fixture(scope="module")
+def backend(table, tmp_path_factory):
+    return DuckDBBackend(export_parquet(table, "test", cache_dir=str(tmp_path_factory.mktemp("cache"))))
+
+
+SPECS = {
+    "no_filters": FilterSpec(),
+    "pvalue": FilterSpec(metrics={"iAs": ["iAs_pvalue"]}),
+    "logfc_at_threshold": FilterSpec(logfc=THRESHOLD, metrics={"iAs": ["iAs_logFC"], "NewiNs": ["NewiNs_logFCs"]}),
+    "text_logfc": FilterSpec(logfc=1.0, metrics={"iAs": ["iAs_logFCs"]}),
+    "metrics_and_tags": FilterSpec(
+        p_value=0.5, fdr=0.5, logfc=1.0,
+        metrics={"iAs": ["iAs_pvalue", "iAs_FDR", "iAs_logFC"], "ProteiNs": ["ProteiNs_pvalue"]},
+        tags={"iAs": ("iAs_genes_tag", ["PREVALENT_DEG", "POSSIBLE_DEG"]),
+              "ProteiNs": ("ProteiNs_expr_pval_Patient_Ctrl", ["up"])},
+    ),
+    "genes": FilterSpec(genes=[f"GENE{i:06d}" for i in range(0, 2_000, 7)], metrics={"NewiNs": ["NewiNs_FDR"]}),
+    "empty": FilterSpec(genes=["NOT_A_GENE"]),
+}
+
+
+@pytest.mark.parametrize("name", SPECS)
+def test_positions_match_evaluate(table, backend, name):
+    conditions = SPECS[name].conditions()
+    expected = evaluate(table, conditions)
+    np.testing.assert_array_equal(backend.positions(conditions), expected)
+    assert backend.count(conditions) == (len(expected), table["Gene"].iloc[expected].nunique())
+
+
+@pytest.mark.parametrize("column", ["iAs_logFC", "NewiNs_logFCs"])
+def test_logfc_at_threshold_is_kept(table, backend, column):
+    # |logFC| >= llindar inclou els valors que són exactament el llindar
+    conditions = FilterSpec(logfc=THRESHOLD, metrics={column.split("_")[0]: [column]}).conditions()
+    at_threshold = np.flatnonzero(table[column].abs() == THRESHOLD)
+    assert len(at_threshold) >= 10
+    assert np.isin(at_threshold, evaluate(table, conditions)).all()
+    assert np.isin(at_threshold, backend.positions(conditions)).all()
+
+
+@pytest.mark.parametrize("sort_by, ascending", [(None, True), ("iAs_logFC", False), ("NewiNs_pvalue", True)])
+def test_query_matches_select(table, backend, sort_by, ascending):
+    conditions = SPECS["metrics_and_tags"].conditions()
+    columns = ["Gene", "iAs_logFC", "iAs_genes_tag", "NewiNs_pvalue"]
+    rows = evaluate(table, conditions)
+    if sort_by:
+        rows = sort_positions(table, rows, sort_by, ascending)
+    expected = select(table, rows[5:25], columns)
+
+    result = backend.query(conditions, columns, sort_by=sort_by, ascending=ascending, limit=20, offset=5)
+    np.testing.assert_array_equal(result.index.to_numpy(), rows[5:25])
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False, check_categorical=False,
+    )
+
+
+def test_iter_query_matches_select(table, backend):
+    conditions = SPECS["pvalue"].conditions()
+    columns = ["Gene", "iAs_pvalue", "iAs_logFCs"]
+    result = pd.concat(backend.iter_query(conditions, columns, chunk_rows=100), ignore_index=True)
+    expected = select(table, evaluate(table, conditions), columns).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False)
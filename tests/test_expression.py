@@ -0,0 +1,48 @@
+"""
+Els estadístics precalculats de les caixes han de ser els que calcularia Plotly amb els punts
+(quartilemethod "linear", el per defecte).
+"""
+import numpy as np
+import pytest
+
+from expression import STAT_NAMES, compute_condition_stats
+
+# Valors d'una condició i (q1, mediana, q3, tanca inferior, tanca superior) que en calcula
+# plotly.js (box/calc.js: Lib.interp a la posició p·n - 0.5 i tanques limitades per q1/q3)
+PLOTLY_BOXES = [
+    ([1, 2, 3, 4], (1.5, 2.5, 3.5, 1, 4)),
+    ([4, 1, 3, 2], (1.5, 2.5, 3.5, 1, 4)),
+    ([1, 2, 3, 4, 5], (1.75, 3, 4.25, 1, 5)),
+    ([-20, 1, 2, 3, 4], (-4.25, 2, 3.25, -4.25, 4)),
+    ([1, 2, 3, 4, 5, 6, 7, 8], (2.5, 4.5, 6.5, 1, 8)),
+    ([1, 2, 3, 4, 5, 6, 7, 30], (2.5, 4.5, 6.5, 1, 7)),
+    ([5], (5, 5, 5, 5, 5)),
+    ([1, 3], (1, 2, 3, 1, 3)),
+]
+
+
+def _stats(values: list) -> dict:
+    stats = compute_condition_stats(np.array([values], dtype=np.float32), np.array(["C"] * len(values)))
+    return dict(zip(STAT_NAMES, stats.values[0, 0]))
+
+
+@pytest.mark.parametrize("values, expected", PLOTLY_BOXES)
+def test_box_matches_plotly(values, expected):
+    stats = _stats(values)
+    got = tuple(stats[name] for name in ("q1", "median", "q3", "lower_fence", "upper_fence"))
+    np.testing.assert_allclose(got, expected, rtol=1e-6)
+    assert stats["n"] == len(values)
+    assert (stats["min"], stats["max"]) == (min(values), max(values))
+
+
+def test_rows_with_missing_values():
+    # Cada gen (fila) amb un nombre diferent de valors: els NaN no compten
+    values = np.full((len(PLOTLY_BOXES), 8), np.nan, dtype=np.float32)
+    for i, (points, _) in enumerate(PLOTLY_BOXES):
+        values[i, :len(points)] = points
+    stats = compute_condition_stats(values, np.array(["C"] * 8))
+    for i, (points, expected) in enumerate(PLOTLY_BOXES):
+        row = dict(zip(STAT_NAMES, stats.values[0, i]))
+        got = tuple(row[name] for name in ("q1", "median", "q3", "lower_fence", "upper_fence"))
+        np.testing.assert_allclose(got, expected, rtol=1e-6)
+        assert row["mean"] == pytest.approx(np.mean(points))
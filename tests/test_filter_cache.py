@@ -0,0 +1,109 @@
+"""
+La memòria cau de filtres (filtering.FilterCache) ha de retornar sempre les mateixes files
+que filtering.evaluate, i no passar mai de `max_bytes`.
+"""
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from filtering import FilterCache, FilterSpec, evaluate, sort_positions
+from loaders import merge_on_gene
+from schema import apply_schema
+
+
+@pytest.fixture(scope="module")
+def table():
+    return apply_schema(merge_on_gene(synthetic.gene_sheets(2_000, n_sheets=3)))
+
+
+BASE = FilterSpec(p_value=0.5, metrics={"iAs": ["iAs_pvalue"]})
+NARROWER = FilterSpec(
+    p_value=0.5, logfc=1.0, metrics={"iAs": ["iAs_pvalue"], "NewiNs": ["NewiNs_logFC"]},
+    tags={"iAs": ("iAs_genes_tag", ["PREVALENT_DEG", "POSSIBLE_DEG"])},
+)
+
+
+def test_exact_hit(table):
+    cache = FilterCache()
+    conditions = BASE.conditions()
+    first = cache.rows(table, conditions, version="v1")
+    second = cache.rows(table, conditions, version="v1")
+    np.testing.assert_array_equal(first, evaluate(table, conditions))
+    assert second is first
+    assert (cache.hits, cache.partial_hits, cache.misses) == (1, 0, 1)
+
+
+def test_partial_hit_starts_from_subset(table):
+    cache = FilterCache()
+    cache.rows(table, BASE.conditions(), version="v1")
+    rows = cache.rows(table, NARROWER.conditions(), version="v1")
+    np.testing.assert_array_equal(rows, evaluate(table, NARROWER.conditions()))
+    assert (cache.hits, cache.partial_hits, cache.misses) == (0, 1, 1)
+
+
+def test_other_version_is_not_reused(table):
+    cache = FilterCache()
+    cache.rows(table, BASE.conditions(), version="v1")
+    cache.rows(table, BASE.conditions(), version="v2")
+    cache.rows(table, NARROWER.conditions(), version="v2")
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert cache.partial_hits == 1
+
+
+@pytest.mark.parametrize("ascending", [True, False])
+def test_sorted_rows(table, ascending):
+    cache = FilterCache()
+    conditions = NARROWER.conditions()
+    expected = sort_positions(table, evaluate(table, conditions), "iAs_logFC", ascending)
+    for _ in range(2):
+        rows = cache.sorted_rows(table, conditions, version="v1", sort_by="iAs_logFC", ascending=ascending)
+        np.testing.assert_array_equal(rows, expected)
+    # Les ordenacions tenen els seus comptadors; el filtre es reutilitza
+    stats = cache.stats()
+    assert (stats["sort_hits"], stats["sort_misses"]) == (1, 1)
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_sorted_rows_from_given_rows(table):
+    cache = FilterCache()
+    conditions = BASE.conditions()
+    rows = evaluate(table, conditions)
+    sorted_rows = cache.sorted_rows(table, conditions, version="v1", sort_by="iAs_pvalue", rows=rows)
+    np.testing.assert_array_equal(sorted_rows, sort_positions(table, rows, "iAs_pvalue"))
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_cached_rows_are_read_only(table):
+    rows = FilterCache().rows(table, BASE.conditions(), version="v1")
+    with pytest.raises(ValueError):
+        rows[0] = 0
+
+
+def test_eviction_respects_max_bytes():
+    cache = FilterCache(max_bytes=100)
+    for i in range(10):
+        cache.rows_for(f"k{i}", lambda: np.arange(10, dtype=np.int32))  # 40 bytes cadascuna
+        assert cache.stats()["bytes"] <= 100
+    assert cache.stats()["entries"] == 2
+    # Les més antigues són les que surten (LRU)
+    cache.rows_for("k9", lambda: pytest.fail("k9 hauria de ser a la memòria cau"))
+    calls = []
+    cache.rows_for("k0", lambda: calls.append(1) or np.arange(10, dtype=np.int32))
+    assert calls == [1]
+
+
+def test_recently_used_entry_survives():
+    cache = FilterCache(max_bytes=100)
+    cache.rows_for("a", lambda: np.arange(10, dtype=np.int32))
+    cache.rows_for("b", lambda: np.arange(10, dtype=np.int32))
+    cache.rows_for("a", lambda: pytest.fail("a hauria de ser a la memòria cau"))
+    cache.rows_for("c", lambda: np.arange(10, dtype=np.int32))
+    assert cache.stats()["entries"] == 2
+    cache.rows_for("a", lambda: pytest.fail("a s'ha usat fa poc i no s'hauria d'expulsar"))
+
+
+def test_entry_larger_than_max_bytes_is_not_stored():
+    cache = FilterCache(max_bytes=100)
+    rows = cache.rows_for("big", lambda: np.arange(100, dtype=np.int32))
+    assert len(rows) == 100
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
@@ -0,0 +1,78 @@
+"""
+Unió dels fulls per 'Gene' (loaders.merge_on_gene) amb cada política de gens repetits.
+"""
+from functools import reduce
+
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from loaders import DUPLICATE_POLICIES, merge_on_gene
+
+# Files repetides al final de cada full (les primeres del full, vegeu synthetic.gene_sheets)
+DUPLICATES = 3
+
+
+@pytest.fixture
+def sheets():
+    sheets = synthetic.gene_sheets(300, n_sheets=3, duplicates=DUPLICATES, proteins=False)
+    # Les còpies tenen un altre logFC, perquè "first" i "aggregate" donin resultats diferents
+    for df in sheets.values():
+        df.loc[df.index[-DUPLICATES:], "logFC"] += 1.0
+    return sheets
+
+
+def _repeated(sheets) -> dict:
+    return {name: sorted(df["Gene"].iloc[:DUPLICATES]) for name, df in sheets.items()}
+
+
+def _reference(sheets) -> pd.DataFrame:
+    # La unió encadenada amb pd.merge (outer), amb la primera fila de cada gen
+    renamed = [
+        df.drop_duplicates("Gene", keep="first").rename(columns=lambda col: col if col == "Gene" else f"{name}_{col}")
+        for name, df in sheets.items()
+    ]
+    return reduce(lambda left, right: pd.merge(left, right, on="Gene", how="outer"), renamed)
+
+
+def test_first_matches_chained_merge(sheets):
+    merged = merge_on_gene(sheets, duplicates="first")
+    pd.testing.assert_frame_equal(merged, _reference(sheets), check_like=True)
+    assert merged["Gene"].is_unique
+    assert merged.attrs["duplicate_genes"] == _repeated(sheets)
+
+
+def test_aggregate_averages_numeric_columns(sheets):
+    merged = merge_on_gene(sheets, duplicates="aggregate").set_index("Gene")
+    assert merged.index.is_unique
+    assert merged.attrs["duplicate_genes"] == _repeated(sheets)
+    for name, df in sheets.items():
+        for gene in _repeated(sheets)[name]:
+            rows = df[df["Gene"] == gene]
+            assert len(rows) == 2
+            assert merged.loc[gene, f"{name}_logFC"] == pytest.approx(rows["logFC"].mean())
+            # Les columnes de text es queden amb el primer valor
+            assert merged.loc[gene, f"{name}_genes_tag"] == rows["genes_tag"].iloc[0]
+    # Els gens no repetits no canvien
+    first = merge_on_gene(sheets, duplicates="first").set_index("Gene")
+    single = [gene for gene in first.index if not any(gene in genes for genes in _repeated(sheets).values())]
+    pd.testing.assert_frame_equal(merged.loc[single], first.loc[single], check_like=True)
+
+
+def test_error_names_the_sheet_and_genes(sheets):
+    name = next(iter(sheets))
+    with pytest.raises(ValueError, match=f"'{name}' té {DUPLICATES} gens duplicats"):
+        merge_on_gene(sheets, duplicates="error")
+
+
+@pytest.mark.parametrize("duplicates", DUPLICATE_POLICIES)
+def test_without_duplicates_all_policies_agree(duplicates):
+    sheets = synthetic.gene_sheets(300, n_sheets=3, proteins=False)
+    merged = merge_on_gene(sheets, duplicates=duplicates)
+    pd.testing.assert_frame_equal(merged, _reference(sheets), check_like=True)
+    assert merged.attrs["duplicate_genes"] == {}
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="Política de duplicats desconeguda"):
+        merge_on_gene(synthetic.gene_sheets(10, n_sheets=1), duplicates="last")
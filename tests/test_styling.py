@@ -0,0 +1,100 @@
+"""
+Els estils vectoritzats de styling.py han de ser idèntics als de la implementació anterior,
+que s'aplicava fila a fila (`df.style.apply(..., axis=1)`) i que es reprodueix aquí tal qual.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from loaders import merge_on_gene
+from schema import apply_schema
+from styling import highlight_all_datasets, highlight_matrix
+
+
+def _tag_color(prefix, tag_val):
+    if prefix == "ProteiNs":
+        return {"up": "#e1f7d5", "down": "#fffacd"}.get(tag_val, "") if isinstance(tag_val, str) else ""
+    if tag_val == "NOT_DEG":
+        return "#edede9"
+    if tag_val == "POSSIBLE_DEG":
+        return "#fffacd"
+    if tag_val == "PREVALENT_DEG":
+        return "#e1f7d5"
+    return ""
+
+
+def row_wise_all_datasets(row):
+    # Implementació anterior de highlight_all_datasets (una crida per fila)
+    styles = []
+    for col in row.index:
+        if col == "Gene":
+            styles.append("")
+        elif "logFCs" in col:
+            try:
+                value = float(row[col])
+                text_style = "color: green" if value > 0 else "color: red" if value < 0 else ""
+            except (ValueError, TypeError):
+                text_style = ""
+            bg_color = ""
+            if "_" in col:
+                prefix = col.split("_")[0]
+                tag_col = "ProteiNs_expr_pval_Patient_Ctrl" if prefix == "ProteiNs" else f"{prefix}_genes_tag"
+                bg_color = _tag_color(prefix, row.get(tag_col, None))
+            if bg_color and text_style:
+                styles.append(f"background-color: {bg_color}; {text_style}")
+            elif bg_color:
+                styles.append(f"background-color: {bg_color}")
+            else:
+                styles.append(text_style)
+        elif "_" in col:
+            prefix = col.split("_")[0]
+            tag_col = "ProteiNs_expr_pval_Patient_Ctrl" if prefix == "ProteiNs" else f"{prefix}_genes_tag"
+            color = _tag_color(prefix, row.get(tag_col, None))
+            styles.append(f"background-color: {color}" if color else "")
+        else:
+            styles.append("")
+    return styles
+
+
+def row_wise_matrix(row):
+    # Implementació anterior de highlight_matrix
+    styles = []
+    for col in row.index:
+        color = "" if col == "Gene" else _tag_color("ProteiNs" if col == "ProteiNs" else "", row[col])
+        styles.append(f"background-color: {color}; color: transparent" if color else "")
+    return styles
+
+
+@pytest.fixture(params=["categorical", "object"])
+def table(request):
+    df = merge_on_gene(synthetic.gene_sheets(400, n_sheets=3, coverage=0.7))
+    if request.param == "categorical":
+        # Tipus definitius: etiquetes categòriques i logFCs numèrics (amb NaN on el gen no hi és)
+        df = apply_schema(df)
+    else:
+        # Tal com arriba de l'Excel: etiquetes de text i logFCs amb coma decimal; alguns buits i zeros
+        df.loc[::17, "iAs_logFCs"] = np.nan
+        df.loc[::19, "NewiNs_logFCs"] = "0,000"
+        df.loc[::23, "iAs_genes_tag"] = "ALTRE"
+    df["Notes"] = "sense prefix"
+    return df
+
+
+def _assert_same_styles(df, vectorised, row_wise):
+    expected = df.apply(lambda row: pd.Series(row_wise(row), index=df.columns), axis=1)
+    pd.testing.assert_frame_equal(vectorised(df), expected)
+    # I el mateix HTML del Styler
+    new_html = df.style.set_uuid("t").apply(vectorised, axis=None).to_html()
+    old_html = df.style.set_uuid("t").apply(row_wise, axis=1).to_html()
+    assert new_html == old_html
+
+
+def test_highlight_all_datasets(table):
+    _assert_same_styles(table, highlight_all_datasets, row_wise_all_datasets)
+
+
+def test_highlight_matrix(table):
+    tag_cols = [col for col in table.columns if col.endswith(("_genes_tag", "_expr_pval_Patient_Ctrl"))]
+    matrix = table[["Gene"] + tag_cols].rename(columns=lambda col: col.split("_")[0])
+    _assert_same_styles(matrix, highlight_matrix, row_wise_matrix)
@@ -0,0 +1,99 @@
+"""
+La matriu d'etiquetes (tag_matrix.TagMatrix) ha de donar els mateixos resultats que les
+columnes de text: els filtres d'etiquetes, els recomptes i les interseccions.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from filtering import FilterSpec, evaluate
+from loaders import merge_on_gene
+from schema import TAG_SUFFIXES, apply_schema
+from tag_matrix import build_tag_matrix
+
+
+@pytest.fixture(scope="module")
+def table():
+    return apply_schema(merge_on_gene(synthetic.gene_sheets(2_000, n_sheets=4)))
+
+
+@pytest.fixture(scope="module")
+def tag_columns(table):
+    return [col for col in table.columns if col.endswith(TAG_SUFFIXES)]
+
+
+@pytest.fixture(scope="module")
+def tag_matrix(table, tag_columns):
+    return build_tag_matrix({col: table[col] for col in tag_columns})
+
+
+SPECS = {
+    "one_dataset": FilterSpec(tags={"iAs": ("iAs_genes_tag", ["PREVALENT_DEG"])}),
+    "several_tags": FilterSpec(tags={"iAs": ("iAs_genes_tag", ["PREVALENT_DEG", "POSSIBLE_DEG"])}),
+    "across_datasets": FilterSpec(tags={
+        "iAs": ("iAs_genes_tag", ["NOT_DEG"]),
+        "NewiNs": ("NewiNs_genes_tag", ["NOT_DEG", "POSSIBLE_DEG"]),
+        "ProteiNs": ("ProteiNs_expr_pval_Patient_Ctrl", ["up"]),
+    }),
+    "with_metrics": FilterSpec(
+        p_value=0.5, logfc=1.0, metrics={"iAs": ["iAs_pvalue"], "NewiNs": ["NewiNs_logFC"]},
+        tags={"AllOrgs": ("AllOrgs_genes_tag", ["POSSIBLE_DEG"])},
+    ),
+    "with_genes": FilterSpec(
+        genes=[f"GENE{i:06d}" for i in range(0, 2_000, 3)],
+        tags={"iPSCs": ("iPSCs_genes_tag", ["NOT_DEG"])},
+    ),
+}
+
+
+@pytest.mark.parametrize("name", SPECS)
+def test_filter_matches_text_columns(table, tag_matrix, name):
+    conditions = SPECS[name].conditions()
+    expected = evaluate(table, conditions)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(evaluate(table, conditions, tag_matrix=tag_matrix), expected)
+
+
+@pytest.mark.parametrize("name", SPECS)
+def test_filter_without_tag_columns(table, tag_matrix, tag_columns, name):
+    # Amb la matriu, la taula de treball no necessita les columnes d'etiquetes
+    conditions = SPECS[name].conditions()
+    without_tags = table.drop(columns=tag_columns)
+    np.testing.assert_array_equal(
+        evaluate(without_tags, conditions, tag_matrix=tag_matrix), evaluate(table, conditions)
+    )
+
+
+def test_filter_within_rows(table, tag_matrix):
+    rows = np.arange(0, len(table), 4)
+    conditions = SPECS["across_datasets"].conditions()
+    np.testing.assert_array_equal(
+        evaluate(table, conditions, rows=rows, tag_matrix=tag_matrix), evaluate(table, conditions, rows=rows)
+    )
+
+
+@pytest.mark.parametrize("rows", [None, "subset"])
+def test_counts_match_value_counts(table, tag_matrix, tag_columns, rows):
+    rows = np.arange(1, len(table), 3) if rows == "subset" else None
+    counts = tag_matrix.counts(rows)
+    part = table if rows is None else table.iloc[rows]
+    for col in tag_columns:
+        expected = part[col].value_counts()
+        got = counts[tag_matrix.dataset_of(col)]
+        assert got[got > 0].to_dict() == expected[expected > 0].to_dict()
+
+
+@pytest.mark.parametrize("tag", ["PREVALENT_DEG", "POSSIBLE_DEG", "NOT_DEG", "up"])
+@pytest.mark.parametrize("rows", [None, "subset"])
+def test_intersections_match_groupby(table, tag_matrix, tag_columns, tag, rows):
+    rows = np.arange(0, len(table), 2) if rows == "subset" else None
+    part = table if rows is None else table.iloc[rows]
+    flags = pd.DataFrame({tag_matrix.dataset_of(col): (part[col] == tag).to_numpy() for col in tag_columns})
+    flags = flags[flags.any(axis=1)]
+    expected = flags.groupby(list(flags.columns)).size()
+
+    got = tag_matrix.intersections(tag, rows=rows)
+    assert list(got.index.names) == list(flags.columns)
+    assert got.to_dict() == expected.to_dict()
+    assert got.is_monotonic_decreasing